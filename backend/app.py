@@ -1,61 +1,80 @@
-from flask import Flask, request, jsonify, send_from_directory, abort, url_for
+from flask import Flask, Blueprint, current_app, request, jsonify, send_from_directory, abort, url_for, Response, stream_with_context
 from flask_cors import CORS
-from werkzeug.utils import secure_filename
+from werkzeug.utils import secure_filename, safe_join
 import os
+import mimetypes
 import uuid
+import time
 import logging
 from datetime import datetime
 import subprocess
+import shutil
 import threading
 import json
 import signal
 import shlex
 from dotenv import load_dotenv
 
-# Load environment variables from .env file
+import archive
+import changefeed
+import compression
+import history
+import idempotency
+import layout
+import lifecycle
+import models
+import postprocess
+import resources
+import workers
+import workload
+
+# Load environment variables from .env file (the settings below are read
+# from the environment when this module is imported)
 load_dotenv()
 
-# Configure logging
-log_formatter = logging.Formatter(
-    '%(asctime)s - %(name)s - %(levelname)s - %(message)s - %(pathname)s:%(lineno)d'
-)
+# Application logger (helper modules log to its 'app.*' children); handlers
+# are attached by configure_logging() when the app is initialized
+logger = logging.getLogger('app')
 
-# File handler for all logs
-file_handler = logging.FileHandler("api.log")
-file_handler.setFormatter(log_formatter)
+# Routes are registered on a blueprint so that create_app() can build apps
+api = Blueprint('api', __name__)
 
-# Console handler for INFO and above
-console_handler = logging.StreamHandler()
-console_handler.setFormatter(log_formatter)
-console_handler.setLevel(logging.INFO)
+# Configure upload folders
+INPUT_FOLDER = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'input_images')
+OUTPUT_FOLDER = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'output_images')
 
-# Error file handler for ERROR and above
-error_handler = logging.FileHandler("error.log")
-error_handler.setFormatter(log_formatter)
-error_handler.setLevel(logging.ERROR)
+PREVIEW_FOLDER = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'preview_images')
 
-# Configure root logger
-logger = logging.getLogger(__name__)
-logger.setLevel(logging.INFO)
-logger.addHandler(file_handler)
-logger.addHandler(console_handler)
-logger.addHandler(error_handler)
+# Emit an intermediate preview every N denoising steps (0 disables previews)
+PREVIEW_INTERVAL = int(os.environ.get('PREVIEW_INTERVAL', 0))
 
-# Initialize Flask app
-app = Flask(__name__)
-app.config['SECRET_KEY'] = 'dev-secret-key'
-app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max upload size
+# How image bytes are delivered: 'direct' streams them from the worker (the
+# WSGI server uses sendfile through wsgi.file_wrapper when it can), while
+# 'x-accel' (nginx) and 'x-sendfile' (Apache/lighttpd) hand the transfer to
+# the front proxy once the route has resolved the file
+FILE_SERVING_MODE = os.environ.get('FILE_SERVING_MODE', 'direct').lower()
+X_ACCEL_PREFIX = os.environ.get('X_ACCEL_PREFIX', '/protected')
 
-# Configure CORS
-CORS(app, resources={r"/api/*": {"origins": "*"}})
+# Storage lifecycle policies (quotas and TTLs of 0 are disabled)
+STORAGE_POLICIES = {
+    'input': lifecycle.load_policy('INPUT'),
+    'output': lifecycle.load_policy('OUTPUT'),
+    'preview': {'quota_bytes': 0, 'ttl_seconds': 0, 'orphans': True},
+}
+STORAGE_GC_INTERVAL = int(os.environ.get('STORAGE_GC_INTERVAL', 0))
+STORAGE_GC_BATCH_SIZE = int(os.environ.get('STORAGE_GC_BATCH_SIZE', 200))
 
-# Configure upload folders
-INPUT_FOLDER = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'input_images')
-OUTPUT_FOLDER = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'output_images')
+# Number of inference jobs this instance runs at once (0 means unbounded)
+MAX_CONCURRENT_JOBS = int(os.environ.get('MAX_CONCURRENT_JOBS', 0))
 
-# Ensure directories exist
-os.makedirs(INPUT_FOLDER, exist_ok=True)
-os.makedirs(OUTPUT_FOLDER, exist_ok=True)
+# Jobs waiting to be batched beyond which submissions get 503 (0 means unbounded)
+MAX_QUEUED_JOBS = int(os.environ.get('MAX_QUEUED_JOBS', 100))
+
+# Report not ready when the output volume has less free space than this
+MIN_FREE_DISK_MB = int(os.environ.get('MIN_FREE_DISK_MB', 1024))
+
+# Maximum number of items accepted by the batch endpoints
+MAX_BATCH_SIZE = int(os.environ.get('MAX_BATCH_SIZE', 500))
 
 # Allowed file extensions
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
@@ -67,8 +86,104 @@ def allowed_file(filename):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+# One-time initialization state
+_initialized = False
+_init_lock = threading.Lock()
+# Jobs admitted by start_job that are not in active_processes yet
+_admissions = set()
+_admission_lock = threading.Lock()
+
+def configure_logging():
+    """Attach the console and log file handlers to the application logger."""
+    if logger.handlers:
+        return
+    
+    log_formatter = logging.Formatter(
+        '%(asctime)s - %(name)s - %(levelname)s - %(message)s - %(pathname)s:%(lineno)d'
+    )
+    
+    # File handler for all logs
+    file_handler = logging.FileHandler("api.log")
+    file_handler.setFormatter(log_formatter)
+    
+    # Console handler for INFO and above
+    console_handler = logging.StreamHandler()
+    console_handler.setFormatter(log_formatter)
+    console_handler.setLevel(logging.INFO)
+    
+    # Error file handler for ERROR and above
+    error_handler = logging.FileHandler("error.log")
+    error_handler.setFormatter(log_formatter)
+    error_handler.setLevel(logging.ERROR)
+    
+    logger.setLevel(logging.INFO)
+    logger.addHandler(file_handler)
+    logger.addHandler(console_handler)
+    logger.addHandler(error_handler)
+
+def initialize():
+    """Set up logging, folders and background workers once per process.
+
+    Runs on the first request (or explicitly from __main__), so importing
+    the module stays cheap and forked workers each open their own log files.
+    """
+    global _initialized
+    if _initialized:
+        return
+    with _init_lock:
+        if _initialized:
+            return
+        configure_logging()
+        
+        # Fail early on an invalid model registry
+        models.get_registry()
+        
+        # Ensure directories exist
+        os.makedirs(INPUT_FOLDER, exist_ok=True)
+        os.makedirs(OUTPUT_FOLDER, exist_ok=True)
+        os.makedirs(PREVIEW_FOLDER, exist_ok=True)
+        
+        # Start the background storage collector
+        if STORAGE_GC_INTERVAL > 0:
+            lifecycle.start_collector(STORAGE_GC_INTERVAL, lambda: run_storage_gc(dry_run=False),
+                                      history.HISTORY_DB_PATH + '.gc-lock')
+        
+        _initialized = True
+
+def recover_interrupted_jobs():
+    """Fail the jobs a previous server run left running or queued.
+
+    Must run once per server start, before any job is accepted: from
+    __main__, or from the gunicorn master (see gunicorn.conf.py). It can't
+    run in initialize(), which every worker process calls while its
+    siblings may already be running jobs.
+    """
+    now = datetime.now().isoformat()
+    interrupted = record_history(history.mark_interrupted, now, now)
+    if interrupted:
+        logger.warning(f"Marked {interrupted} jobs interrupted by a restart as failed")
+
+def compress_json(response):
+    """Compress JSON responses with the encoding the client prefers."""
+    return compression.compress_response(response, request.accept_encodings)
+
+def create_app():
+    """Create the Flask app; heavy setup is deferred to initialize()."""
+    app = Flask(__name__)
+    app.config['SECRET_KEY'] = 'dev-secret-key'
+    app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max upload size
+    app.config['USE_X_SENDFILE'] = FILE_SERVING_MODE == 'x-sendfile'
+    
+    # Configure CORS
+    CORS(app, resources={r"/api/*": {"origins": "*", "expose_headers": ["Idempotent-Replayed"]}})
+    
+    app.register_blueprint(api)
+    app.before_request(initialize)
+    app.after_request(compress_json)
+    return app
+
 # Custom error handlers
-@app.errorhandler(400)
+@api.app_errorhandler(400)
 def bad_request(error):
     request_data = request.get_json() if request.is_json else {}
     logger.error(f"Bad request: {error}, Route: {request.path}, Method: {request.method}, Data: {request_data}")
@@ -78,7 +193,7 @@ def bad_request(error):
         "path": request.path
     }), 400
 
-@app.errorhandler(404)
+@api.app_errorhandler(404)
 def not_found(error):
     logger.error(f"Resource not found: {error}, Path: {request.path}, Method: {request.method}")
     return jsonify({
@@ -87,7 +202,7 @@ def not_found(error):
         "path": request.path
     }), 404
 
-@app.errorhandler(405)
+@api.app_errorhandler(405)
 def method_not_allowed(error):
     logger.error(f"Method not allowed: {error}, Path: {request.path}, Method: {request.method}")
     return jsonify({
@@ -97,7 +212,7 @@ def method_not_allowed(error):
         "method": request.method
     }), 405
 
-@app.errorhandler(413)
+@api.app_errorhandler(413)
 def request_entity_too_large(error):
     logger.error(f"Request entity too large: {error}, Path: {request.path}")
     return jsonify({
@@ -106,7 +221,7 @@ def request_entity_too_large(error):
         "path": request.path
     }), 413
 
-@app.errorhandler(500)
+@api.app_errorhandler(500)
 def server_error(error):
     logger.error(f"Server error: {error}, Path: {request.path}, Method: {request.method}", exc_info=True)
     return jsonify({
@@ -115,7 +230,7 @@ def server_error(error):
         "path": request.path
     }), 500
 
-@app.errorhandler(Exception)
+@api.app_errorhandler(Exception)
 def unhandled_exception(error):
     logger.error(f"Unhandled exception: {error}, Path: {request.path}, Method: {request.method}", exc_info=True)
     return jsonify({
@@ -125,13 +240,70 @@ def unhandled_exception(error):
     }), 500
 
 # Health check endpoint
-@app.route('/api/health', methods=['GET'])
+@api.route('/api/health', methods=['GET'])
 def health_check():
-    logger.info("Health check endpoint called")
+    logger.debug("Health check endpoint called")
     return jsonify({"status": "ok", "timestamp": datetime.now().isoformat()})
 
+# Liveness probe: constant response, no logging
+LIVENESS_BODY = b'{"status":"ok"}\n'
+LIVENESS_HEADERS = {'Content-Type': 'application/json', 'Cache-Control': 'no-store'}
+
+@api.route('/api/health/live', methods=['GET'])
+def liveness_check():
+    return LIVENESS_BODY, 200, LIVENESS_HEADERS
+
+# Snapshot of the inference capacity of this instance
+def capacity_snapshot():
+    running = [info for info in list(active_processes.values()) if info['status'] == 'running']
+    queued = [info for info in list(active_processes.values()) if info['status'] == 'queued']
+    max_jobs = MAX_CONCURRENT_JOBS
+    free_slots = None if max_jobs <= 0 else max(max_jobs - len(running), 0)
+    
+    loaded_models = {info.get('params', {}).get('model_path') for info in running} - {None}
+    
+    # Persistent workers, or else CPU slots, bound concurrency as well
+    cpu_slots = resources.slot_status()
+    if workers.INFERENCE_WORKERS > 0:
+        pool = worker_pool()
+        cpu_slots = {'total': len(pool.workers), 'free': pool.idle_count()}
+        registry = models.get_registry()[1]
+        loaded_models.update(registry[model_id]['path'] for worker in pool.status()
+                             for model_id in worker['resident_models'])
+    if cpu_slots:
+        max_jobs = cpu_slots['total'] if max_jobs <= 0 else min(max_jobs, cpu_slots['total'])
+        free_slots = cpu_slots['free'] if free_slots is None else min(free_slots, cpu_slots['free'])
+    disk_free = shutil.disk_usage(OUTPUT_FOLDER).free
+    
+    return {
+        "running_jobs": len(running),
+        "max_concurrent_jobs": max_jobs or None,
+        "free_slots": free_slots,
+        "queue_depth": len(queued),
+        "loaded_models": sorted(loaded_models),
+        "disk_free_bytes": disk_free,
+        "disk_ok": disk_free >= MIN_FREE_DISK_MB * 1024 * 1024
+    }
+
+# Readiness probe: 503 while this instance cannot take another job
+@api.route('/api/health/ready', methods=['GET'])
+def readiness_check():
+    capacity = capacity_snapshot()
+    ready = capacity['disk_ok'] and capacity['free_slots'] != 0
+    capacity['status'] = 'ready' if ready else 'busy'
+    return jsonify(capacity), 200 if ready else 503
+
+# Model registry endpoint
+@api.route('/api/models', methods=['GET'])
+def list_models():
+    default_id, registry = models.get_registry()
+    response = {"default": default_id, "models": list(registry.values())}
+    if workers.INFERENCE_WORKERS > 0:
+        response["workers"] = worker_pool().status()
+    return jsonify(response)
+
 # File upload endpoint
-@app.route('/api/upload', methods=['POST'])
+@api.route('/api/upload', methods=['POST'])
 def upload_file():
     logger.info("Upload endpoint called")
     
@@ -147,7 +319,7 @@ def upload_file():
     if file and allowed_file(file.filename):
         # Generate a unique filename with UUID
         filename = str(uuid.uuid4()) + os.path.splitext(secure_filename(file.filename))[1]
-        file_path = os.path.join(INPUT_FOLDER, filename)
+        file_path = layout.shard_path(INPUT_FOLDER, filename)
         
         # Save the file
         file.save(file_path)
@@ -155,9 +327,10 @@ def upload_file():
         # Get file metadata
         file_size = os.path.getsize(file_path)
         created_time = datetime.now().isoformat()
+        record_change('input', 'added', filename, created_time, file_size)
         
         # Generate URL for the file
-        file_url = url_for('serve_image', folder='input', filename=filename, _external=True)
+        file_url = url_for('api.serve_image', folder='input', filename=filename, _external=True)
         
         logger.info(f"File uploaded successfully: {filename}")
         
@@ -173,74 +346,188 @@ def upload_file():
     logger.warning(f"Invalid file type: {file.filename}")
     return jsonify({"error": "Invalid file type. Allowed types: png, jpg, jpeg, gif"}), 400
 
-# List input images endpoint
-@app.route('/api/images/input', methods=['GET'])
-def list_input_images():
-    logger.info("List input images endpoint called")
+# Whether the client asked for the compact response shape (no per-item
+# paths or URLs; items are served from base_url + filename)
+def compact_requested():
+    return request.args.get('compact', '').lower() in ('1', 'true', 'yes')
+
+# URL prefix that image filenames of a folder are served under
+def image_base_url(folder):
+    return url_for('api.serve_image', folder=folder, filename='_', _external=True)[:-1]
+
+# Serialize a payload with the fast compact encoder
+def fast_jsonify(payload, status=200):
+    return current_app.response_class(compression.dumps(payload), status=status, mimetype='application/json')
+
+# List the images of a folder, newest first
+def list_images(folder, directory):
+    compact = compact_requested()
     
+    # Read the version first so changes made during the scan are replayed
+    version = changefeed.current_version()
     images = []
-    for filename in os.listdir(INPUT_FOLDER):
-        if os.path.isfile(os.path.join(INPUT_FOLDER, filename)) and allowed_file(filename):
-            file_path = os.path.join(INPUT_FOLDER, filename)
-            file_size = os.path.getsize(file_path)
-            created_time = datetime.fromtimestamp(os.path.getctime(file_path)).isoformat()
-            file_url = url_for('serve_image', folder='input', filename=filename, _external=True)
-            
-            images.append({
+    for entry in layout.iter_files(directory):
+        if allowed_file(entry.name):
+            filename = entry.name
+            stat = entry.stat()
+            image = {
                 "filename": filename,
-                "path": file_path,
-                "url": file_url,
-                "size": file_size,
-                "created": created_time
-            })
+                "size": stat.st_size,
+                "created": datetime.fromtimestamp(stat.st_ctime).isoformat()
+            }
+            if not compact:
+                image["path"] = entry.path
+                image["url"] = url_for('api.serve_image', folder=folder, filename=filename, _external=True)
+            images.append(image)
     
     # Sort by creation time (newest first)
     images.sort(key=lambda x: x["created"], reverse=True)
     
-    return jsonify({"images": images})
+    payload = {"images": images, "version": version}
+    if compact:
+        payload["base_url"] = image_base_url(folder)
+    return fast_jsonify(payload)
+
+# List input images endpoint
+@api.route('/api/images/input', methods=['GET'])
+def list_input_images():
+    logger.info("List input images endpoint called")
+    return list_images('input', INPUT_FOLDER)
 
 # List output images endpoint
-@app.route('/api/images/output', methods=['GET'])
+@api.route('/api/images/output', methods=['GET'])
 def list_output_images():
     logger.info("List output images endpoint called")
+    return list_images('output', OUTPUT_FOLDER)
+
+# Map a folder name from the URL to its directory
+def image_folder(folder):
+    return {'input': INPUT_FOLDER, 'output': OUTPUT_FOLDER}.get(folder)
+
+# Remove an image (and, for outputs, its compressed variants)
+def remove_image(folder, filename):
+    file_path = layout.resolve(image_folder(folder), filename)
+    if not os.path.isfile(file_path):
+        return False
+    os.remove(file_path)
+    if folder == 'output':
+        postprocess.remove_variants(file_path)
+    record_change(folder, 'removed', filename, datetime.now().isoformat())
+    return True
+
+# Append an image change to the gallery feed without failing the caller
+def record_change(folder, action, filename, created_at, size=None):
+    try:
+        changefeed.record(folder, action, filename, created_at, size)
+    except Exception as e:
+        logger.error(f"Error recording gallery change: {str(e)}")
+
+# Gallery change feed endpoint
+@api.route('/api/images/<folder>/changes', methods=['GET'])
+def image_changes(folder):
+    if image_folder(folder) is None:
+        return jsonify({"error": "Invalid folder"}), 400
     
-    images = []
-    for filename in os.listdir(OUTPUT_FOLDER):
-        if os.path.isfile(os.path.join(OUTPUT_FOLDER, filename)) and allowed_file(filename):
-            file_path = os.path.join(OUTPUT_FOLDER, filename)
-            file_size = os.path.getsize(file_path)
-            created_time = datetime.fromtimestamp(os.path.getctime(file_path)).isoformat()
-            file_url = url_for('serve_image', folder='output', filename=filename, _external=True)
-            
-            images.append({
-                "filename": filename,
-                "path": file_path,
-                "url": file_url,
-                "size": file_size,
-                "created": created_time
-            })
+    since = request.args.get('since', type=int)
+    limit = request.args.get('limit', 500, type=int)
+    if since is None or since < 0:
+        return jsonify({"error": "'since' must be a non-negative version"}), 400
     
-    # Sort by creation time (newest first)
-    images.sort(key=lambda x: x["created"], reverse=True)
+    try:
+        changes, version, has_more = changefeed.changes_since(folder, since, max(1, min(limit, 5000)))
+    except changefeed.VersionExpired as e:
+        # The client has to list the folder again
+        return jsonify({"error": str(e), "version": changefeed.current_version()}), 410
+    
+    compact = compact_requested()
+    items = []
+    for change in changes:
+        item = {"action": change['action'], "filename": change['filename'], "seq": change['seq']}
+        if change['action'] == 'added':
+            item.update({"size": change['size'], "created": change['created_at']})
+            if not compact:
+                item["url"] = url_for('api.serve_image', folder=folder, filename=change['filename'], _external=True)
+        items.append(item)
+    
+    payload = {"changes": items, "version": version, "has_more": has_more}
+    if compact:
+        payload["base_url"] = image_base_url(folder)
+    return fast_jsonify(payload)
+
+# Read and validate the list of names posted to a batch endpoint
+def batch_items(key):
+    data = request.get_json(silent=True) or {}
+    items = data.get(key)
+    if not isinstance(items, list) or not items or not all(isinstance(item, str) for item in items):
+        return None, (jsonify({"error": f"'{key}' must be a non-empty list of strings"}), 400)
+    if len(items) > MAX_BATCH_SIZE:
+        return None, (jsonify({"error": f"At most {MAX_BATCH_SIZE} items can be processed per request"}), 400)
+    return items, None
+
+# Batch delete endpoint
+@api.route('/api/images/<folder>/batch-delete', methods=['POST'])
+def batch_delete_images(folder):
+    logger.info(f"Batch delete endpoint called for folder: {folder}")
+    
+    if image_folder(folder) is None:
+        return jsonify({"error": "Invalid folder"}), 400
+    
+    filenames, error = batch_items('filenames')
+    if error:
+        return error
+    
+    deleted, not_found, errors = [], [], {}
+    for filename in filenames:
+        try:
+            if secure_filename(filename) != filename or not remove_image(folder, filename):
+                not_found.append(filename)
+            else:
+                deleted.append(filename)
+        except Exception as e:
+            logger.error(f"Error deleting {folder} image {filename}: {str(e)}")
+            errors[filename] = str(e)
+    
+    logger.info(f"Batch deleted {len(deleted)} {folder} images")
+    return jsonify({"deleted": deleted, "not_found": not_found, "errors": errors})
+
+# Export output images as a streamed zip or tar archive
+@api.route('/api/images/output/export', methods=['POST'])
+def export_output_images():
+    logger.info("Export output images endpoint called")
+    
+    filenames, error = batch_items('filenames')
+    if error:
+        return error
+    
+    archive_format = (request.get_json(silent=True) or {}).get('format', 'zip')
+    if archive_format not in ('zip', 'tar'):
+        return jsonify({"error": "Invalid format. Allowed formats: zip, tar"}), 400
+    
+    # Resolve everything up front so missing files fail before streaming starts
+    files = []
+    for filename in dict.fromkeys(filenames):
+        file_path = layout.resolve(OUTPUT_FOLDER, filename)
+        if secure_filename(filename) != filename or not os.path.isfile(file_path):
+            return jsonify({"error": f"Output image not found: {filename}"}), 404
+        files.append((filename, file_path))
     
-    return jsonify({"images": images})
+    stream = archive.stream_zip(files) if archive_format == 'zip' else archive.stream_tar(files)
+    mimetype = 'application/zip' if archive_format == 'zip' else 'application/x-tar'
+    return Response(stream_with_context(stream), mimetype=mimetype, headers={
+        'Content-Disposition': f'attachment; filename=omnigen-outputs.{archive_format}'
+    })
 
 # Delete input image endpoint
-@app.route('/api/images/input/<filename>', methods=['DELETE'])
+@api.route('/api/images/input/<filename>', methods=['DELETE'])
 def delete_input_image(filename):
     logger.info(f"Delete input image endpoint called for: {filename}")
     
     try:
-        # Construct the file path
-        file_path = os.path.join(INPUT_FOLDER, filename)
-        
-        # Check if file exists
-        if not os.path.exists(file_path):
+        # Delete the file
+        if not remove_image('input', filename):
             logger.error(f"Input image not found: {filename}")
             return jsonify({"error": "Image not found"}), 404
         
-        # Delete the file
-        os.remove(file_path)
         logger.info(f"Successfully deleted input image: {filename}")
         
         return jsonify({"message": f"Image {filename} deleted successfully"})
@@ -250,21 +537,16 @@ def delete_input_image(filename):
         return jsonify({"error": f"Error deleting image: {str(e)}"}), 500
 
 # Delete output image endpoint
-@app.route('/api/images/output/<filename>', methods=['DELETE'])
+@api.route('/api/images/output/<filename>', methods=['DELETE'])
 def delete_output_image(filename):
     logger.info(f"Delete output image endpoint called for: {filename}")
     
     try:
-        # Construct the file path
-        file_path = os.path.join(OUTPUT_FOLDER, filename)
-        
-        # Check if file exists
-        if not os.path.exists(file_path):
+        # Delete the file
+        if not remove_image('output', filename):
             logger.error(f"Output image not found: {filename}")
             return jsonify({"error": "Image not found"}), 404
         
-        # Delete the file
-        os.remove(file_path)
         logger.info(f"Successfully deleted output image: {filename}")
         
         return jsonify({"message": f"Image {filename} deleted successfully"})
@@ -273,52 +555,165 @@ def delete_output_image(filename):
         logger.error(f"Error deleting output image {filename}: {str(e)}")
         return jsonify({"error": f"Error deleting image: {str(e)}"}), 500
 
+# Send an image file, offloading the transfer to the front proxy if configured
+def send_image(folder, directory, filename):
+    if FILE_SERVING_MODE != 'x-accel':
+        return send_from_directory(directory, filename)
+    
+    file_path = safe_join(directory, filename)
+    if file_path is None or not os.path.isfile(file_path):
+        abort(404)
+    
+    # The proxy maps the prefix onto the directory containing the image folders
+    relative_path = os.path.relpath(file_path, os.path.dirname(folder)).replace(os.sep, '/')
+    response = current_app.response_class(status=200)
+    response.headers['X-Accel-Redirect'] = f"{X_ACCEL_PREFIX.rstrip('/')}/{relative_path}"
+    response.headers['Content-Type'] = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    return response
+
 # Serve image files
-@app.route('/api/images/view/<folder>/<filename>', methods=['GET'])
+@api.route('/api/images/view/<folder>/<filename>', methods=['GET'])
 def serve_image(folder, filename):
     logger.info(f"Serve image endpoint called for: {folder}/{filename}")
     
     if folder == 'input':
-        return send_from_directory(INPUT_FOLDER, filename)
+        directory = os.path.dirname(layout.resolve(INPUT_FOLDER, filename))
+        lifecycle.touch(os.path.join(directory, filename))
+        return send_image(INPUT_FOLDER, directory, filename)
     elif folder == 'output':
-        return send_from_directory(OUTPUT_FOLDER, filename)
+        # Serve the smallest post-processed variant the client can decode
+        directory = os.path.dirname(layout.resolve(OUTPUT_FOLDER, filename))
+        variant = postprocess.negotiate_variant(directory, filename, request.accept_mimetypes)
+        lifecycle.touch(os.path.join(directory, variant or filename))
+        response = send_image(OUTPUT_FOLDER, directory, variant or filename)
+        response.vary.add('Accept')
+        return response
+    elif folder == 'preview':
+        response = send_image(PREVIEW_FOLDER, PREVIEW_FOLDER, filename)
+        # Previews are overwritten in place while the job runs
+        response.headers['Cache-Control'] = 'no-store'
+        return response
     else:
         logger.warning(f"Invalid folder: {folder}")
         return jsonify({"error": "Invalid folder"}), 400
 
+# Remove the intermediate preview of a process once it is no longer needed
+def remove_preview(process_info):
+    preview_path = process_info.get('preview_path')
+    if preview_path and os.path.exists(preview_path):
+        try:
+            os.remove(preview_path)
+        except OSError as e:
+            logger.warning(f"Could not remove preview {preview_path}: {str(e)}")
+
+# Run one storage garbage collection pass over the image folders
+def run_storage_gc(dry_run=True):
+    referenced = {'input': set(), 'output': set(), 'preview': set()}
+    partial_paths = []
+    
+    # Jobs of other server processes are only known from the history
+    unfinished = [(job['process_id'], job['input_images'], job['output_filename'])
+                  for job in record_history(history.unfinished_jobs) or []]
+    for process_id, process_info in list(active_processes.items()):
+        if process_info['status'] in ('running', 'queued'):
+            unfinished.append((process_id, process_info.get('params', {}).get('input_images', []),
+                               process_info['output_filename']))
+        elif process_info['status'] in ('failed', 'cancelled'):
+            partial_paths.append(process_info['output_path'])
+    for process_id, input_images, output_filename in unfinished:
+        referenced['input'].update(os.path.splitext(img)[0] for img in input_images)
+        referenced['output'].add(os.path.splitext(output_filename)[0])
+        referenced['preview'].add(process_id)
+    
+    folders = {'input': INPUT_FOLDER, 'output': OUTPUT_FOLDER, 'preview': PREVIEW_FOLDER}
+    report = lifecycle.collect(folders, STORAGE_POLICIES, referenced, partial_paths, dry_run=dry_run,
+                               batch_size=None if dry_run else STORAGE_GC_BATCH_SIZE)
+    if not dry_run:
+        removed_at = datetime.now().isoformat()
+        for candidate in report['candidates']:
+            if candidate['folder'] in ('input', 'output'):
+                for filename in candidate['files']:
+                    if allowed_file(filename):
+                        record_change(candidate['folder'], 'removed', filename, removed_at)
+    return report
+
+# Storage GC dry-run report endpoint
+@api.route('/api/storage/gc/report', methods=['GET'])
+def storage_gc_report():
+    logger.info("Storage GC report endpoint called")
+    return jsonify(run_storage_gc(dry_run=True))
+
+# Record one line of inference output and parse progress and previews
+def handle_output_line(process_id, process_info, line):
+    line_str = line.decode('utf-8') if isinstance(line, bytes) else line
+    process_info['output'].append(line_str.strip())
+    
+    # Parse progress information from the output
+    if 'progress:' in line_str.lower():
+        try:
+            progress = int(line_str.split('progress:')[1].strip().rstrip('%'))
+            process_info['progress'] = progress
+            # Progress update
+            logger.info(f"Progress update for {process_id}: {progress}%")
+        except ValueError:
+            pass
+    
+    # Parse preview notifications ("preview: <step>") emitted after the
+    # inference script has rewritten the preview image
+    elif line_str.lower().startswith('preview:'):
+        try:
+            process_info['preview_step'] = int(line_str.split(':', 1)[1].strip())
+        except ValueError:
+            pass
+
 # Function to monitor process and update progress
 def monitor_process(process_id):
     process_info = active_processes[process_id]
     process = process_info['process']
     
     try:
-        # Read output line by line
-        for line in iter(process.stdout.readline, ''):
-            if not line:
-                break
-                
-            line_str = line.decode('utf-8') if isinstance(line, bytes) else line
-            process_info['output'].append(line_str.strip())
-                
-            # Parse progress information from the output
-            if 'progress:' in line_str.lower():
-                try:
-                    progress = int(line_str.split('progress:')[1].strip().rstrip('%'))
-                    process_info['progress'] = progress
-                    # Progress update
-                    logger.info(f"Progress update for {process_id}: {progress}%")
-                except ValueError:
-                    pass
-        
-        # Wait for process to complete
-        return_code = process.poll()
+        if isinstance(process, workers.WorkerJob):
+            # Persistent workers hand the job's output lines to a callback
+            return_code, error = process.run(lambda line: handle_output_line(process_id, process_info, line),
+                                             on_start=lambda: job_started(process_id, process_info))
+            if error:
+                process_info['output'].append(error)
+            rusage = None
+        else:
+            # Read output line by line
+            for line in iter(process.stdout.readline, ''):
+                if not line:
+                    break
+                handle_output_line(process_id, process_info, line)
+            
+            # Wait for process to complete and record its resource usage
+            return_code, rusage = resources.wait_with_rusage(process)
+        process_info['resources'] = resources.usage_report(rusage, process_info.get('started_at', time.monotonic()))
+        if process_info.get('timeout_timer'):
+            process_info['timeout_timer'].cancel()
+        remove_preview(process_info)
         
         # Update process status
-        if return_code == 0:
+        if process_info['status'] == 'cancelled' or process_info.get('cancel_requested'):
+            process_info['status'] = 'cancelled'
+            logger.info(f"Process {process_id} exited after cancellation")
+        elif process_info.get('timed_out'):
+            process_info['status'] = 'failed'
+            process_info['error'] = f"Process exceeded the time limit of {process_info['limits']['timeout_seconds']} seconds"
+            logger.error(f"Process {process_id} killed after timeout")
+        elif return_code == 0:
             process_info['status'] = 'completed'
             logger.info(f"Process completed successfully: {process_id}")
             # Process completed
             logger.info(f"Process {process_id} completed with output: {process_info['output_path']}")
+            if os.path.isfile(process_info['output_path']):
+                record_change('output', 'added', process_info['output_filename'], datetime.now().isoformat(),
+                              os.path.getsize(process_info['output_path']))
+            # Hand the output to the post-processing pool
+            future = postprocess.submit(process_info['output_path'], process_info.get('params', {}))
+            if future is not None:
+                submitted_at = time.monotonic()
+                future.add_done_callback(lambda done: postprocess_finished(process_id, submitted_at, done))
         else:
             process_info['status'] = 'failed'
             error_output = '\n'.join(process_info['output'])
@@ -332,9 +727,68 @@ def monitor_process(process_id):
         logger.error(f"Error monitoring process: {process_id}, Error: {str(e)}")
         # Process error
         logger.error(f"Error monitoring process {process_id}: {str(e)}")
+    finally:
+        resources.release_slot(process_id)
+        record_history(history.record_completion, process_id, process_info['status'],
+                       datetime.now().isoformat(), process_info.get('error'), process_info.get('resources'))
+        if 'finished' in process_info:
+            process_info['finished'].set()
+
+# Record how long post-processing took, or log why it failed
+def postprocess_finished(process_id, submitted_at, future):
+    error = future.exception()
+    if error is not None:
+        logger.error(f"Post-processing failed for process {process_id}: {str(error)}")
+        return
+    record_history(history.record_duration, process_id, 'postprocess', time.monotonic() - submitted_at)
+
+# Write to the job history without letting database errors affect the job
+def record_history(func, *args):
+    try:
+        return func(*args)
+    except Exception as e:
+        logger.error(f"Error writing job history: {str(e)}")
+
+# Completed earlier jobs with the same parameters whose output still exists
+def find_previous_results(params, input_hashes):
+    return [
+        job for job in history.find_previous(params, input_hashes)
+        if os.path.isfile(layout.resolve(OUTPUT_FOLDER, job['output_filename']))
+    ]
+
+# Status payload for a job that is only known from the history
+def history_status(job):
+    response = {
+        "process_id": job['process_id'],
+        "status": job['status'],
+        "progress": 100 if job['status'] == 'completed' else 0,
+        "start_time": job['created_at']
+    }
+    if job['status'] == 'completed':
+        response["output_url"] = url_for('api.serve_image', folder='output', filename=job['output_filename'], _external=True)
+    if job['status'] == 'failed' and job['error']:
+        response["error"] = job['error']
+    if job['resources']:
+        response["resources"] = job['resources']
+    return response
+
+# Kill a process that is still running when its time limit expires
+def enforce_timeout(process_id):
+    process_info = active_processes.get(process_id)
+    if process_info and process_info['status'] in ('running', 'queued'):
+        logger.warning(f"Process {process_id} exceeded its time limit, killing it")
+        process_info['timed_out'] = True
+        signal_job(process_info['process'], signal.SIGKILL)
+
+# Signal a job without reaping it, which is left to its monitor
+def signal_job(process, sig):
+    if isinstance(process, workers.WorkerJob):
+        process.stop(-sig)
+    else:
+        resources.signal_process(process, sig)
 
 # Script execution endpoint
-@app.route('/api/execute', methods=['POST'])
+@api.route('/api/execute', methods=['POST'])
 def execute_script():
     logger.info("Execute script endpoint called")
     
@@ -344,107 +798,355 @@ def execute_script():
         if not data:
             return jsonify({"error": "No data provided"}), 400
         
-        # Extract parameters
-        input_images = data.get('input_images', [])
-        if not input_images or not isinstance(input_images, list) or len(input_images) == 0:
-            return jsonify({"error": "At least one input image is required"}), 400
-        
-        # Validate input images exist
-        for img in input_images:
-            if not os.path.exists(os.path.join(INPUT_FOLDER, img)):
-                return jsonify({"error": f"Input image not found: {img}"}), 404
-        
-        # Generate output filename with UUID
-        output_filename = f"{str(uuid.uuid4())}.png"
-        output_path = os.path.join(OUTPUT_FOLDER, output_filename)
-        
-        # Build command with parameters
-        model_path = data.get('model_path', "OmniGen2/OmniGen2")
-        num_inference_step = data.get('num_inference_step', 50)
-        height = data.get('height', 1024)
-        width = data.get('width', 1024)
-        text_guidance_scale = data.get('text_guidance_scale', 5.0)
-        image_guidance_scale = data.get('image_guidance_scale', 2.0)
-        instruction = data.get('instruction', "Put the animal from the second picture into the street depicted by the first picture.")
-        
-        # Build input image paths string
-        input_image_paths = " ".join([os.path.join(INPUT_FOLDER, img) for img in input_images])
+        key = request.headers.get('Idempotency-Key')
+        if key is not None:
+            return idempotent_submission(key, data)
         
-        # Get inference script path from environment variable or use default
-        inference_script = os.environ.get('INFERENCE_SCRIPT_PATH', 'inference.py')
-        
-        # Build the command
-        cmd = f"python {inference_script} \
-            --model_path {model_path} \
-            --num_inference_step {num_inference_step} \
-            --height {height} \
-            --width {width} \
-            --text_guidance_scale {text_guidance_scale} \
-            --image_guidance_scale {image_guidance_scale} \
-            --instruction \"{instruction}\" \
-            --input_image_path {input_image_paths} \
-            --output_image_path {output_path}"
-        
-        # Create a unique process ID
-        process_id = str(uuid.uuid4())
-        
-        # Start the process
-        logger.info(f"Starting process: {process_id} with command: {cmd}")
-        process = subprocess.Popen(
-            shlex.split(cmd),
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            universal_newlines=True,
-            bufsize=1,
-            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-        )
-        
-        # Store process information
-        active_processes[process_id] = {
-            'process': process,
-            'status': 'running',
-            'progress': 0,
-            'start_time': datetime.now().isoformat(),
-            'output_path': output_path,
-            'output_filename': output_filename,
-            'output': [],
-            'command': cmd
-        }
-        
-        # Start monitoring thread
-        monitor_thread = threading.Thread(target=monitor_process, args=(process_id,))
-        monitor_thread.daemon = True
-        monitor_thread.start()
-        
-        return jsonify({
-            "process_id": process_id,
-            "status": "started",
-            "output_filename": output_filename
-        })
+        return submit_job(data)
     
     except Exception as e:
         logger.error(f"Error executing script: {str(e)}")
         return jsonify({"error": f"Error executing script: {str(e)}"}), 500
 
+# Start a job at most once per Idempotency-Key; retries get the stored response
+def idempotent_submission(key, data):
+    if not idempotency.valid_key(key):
+        return jsonify({"error": f"Idempotency-Key must be 1 to {idempotency.MAX_KEY_LENGTH} printable characters"}), 400
+    
+    fingerprint = idempotency.fingerprint(data)
+    deadline = time.monotonic() + idempotency.IDEMPOTENCY_WAIT_SECONDS
+    while True:
+        try:
+            stored = idempotency.claim(key, fingerprint)
+            break
+        except idempotency.KeyMismatch as e:
+            return jsonify({"error": str(e)}), 422
+        except idempotency.KeyInProgress as e:
+            # The first request is still starting the job, wait for its response
+            if time.monotonic() >= deadline:
+                response = jsonify({"error": str(e)})
+                response.headers['Retry-After'] = '1'
+                return response, 409
+            time.sleep(0.1)
+    
+    if stored is not None:
+        status_code, body = stored
+        logger.info(f"Replaying the response to Idempotency-Key {key}")
+        response = current_app.response_class(body, status=status_code, mimetype='application/json')
+        response.headers['Idempotent-Replayed'] = 'true'
+        return response
+    
+    try:
+        response = submit_job(data)
+    except Exception:
+        idempotency.release(key)
+        raise
+    if response.status_code < 300:
+        idempotency.complete(key, response.status_code, response.get_data(as_text=True))
+    else:
+        idempotency.release(key)
+    return response
+
+# Start a job and add the submission to the workload trace, unless it was
+# rejected as invalid (rejections for lack of capacity are part of the load)
+def submit_job(data):
+    arrival = time.time()
+    response = current_app.make_response(start_job(data))
+    # Rejected submissions are left out: the replay retries 503s itself
+    if response.status_code < 300:
+        trace_submission(data, arrival)
+    return response
+
+# Append a submission to the workload trace without failing the request
+def trace_submission(data, arrival):
+    if not workload.TRACE_FILE:
+        return
+    try:
+        input_paths = [layout.resolve(INPUT_FOLDER, img) for img in data.get('input_images') or []
+                       if isinstance(img, str)]
+        workload.record(data, [path for path in input_paths if os.path.isfile(path)], arrival)
+    except Exception as e:
+        logger.error(f"Error writing workload trace: {str(e)}")
+
+# Default generation parameters
+DEFAULT_JOB_PARAMS = {
+    'model_path': None,  # the registry's default model
+    'num_inference_step': 50,
+    'height': 1024,
+    'width': 1024,
+    'text_guidance_scale': 5.0,
+    'image_guidance_scale': 2.0,
+    'instruction': "Put the animal from the second picture into the street depicted by the first picture."
+}
+
+# Complete the generation parameters of a request with the defaults
+def job_params(data):
+    params = {field: data.get(field, default) for field, default in DEFAULT_JOB_PARAMS.items()}
+    params['input_images'] = data.get('input_images', [])
+    
+    # Refer to registered models by their path; unknown names are kept for validation
+    model = models.resolve(params['model_path'])
+    if model is not None:
+        params['model_path'] = model['path']
+    return params
+
+# Process-wide pool of persistent inference workers
+def worker_pool():
+    inference_script = os.environ.get('INFERENCE_SCRIPT_PATH', 'inference.py')
+    return workers.get_pool(f"python {inference_script} --worker",
+                            os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Validate job parameters and start the inference subprocess
+def start_job(data):
+    # Extract parameters
+    input_images = data.get('input_images', [])
+    if not input_images or not isinstance(input_images, list) or len(input_images) == 0:
+        return jsonify({"error": "At least one input image is required"}), 400
+    
+    # Validate input images exist
+    for img in input_images:
+        if not os.path.exists(layout.resolve(INPUT_FOLDER, img)):
+            return jsonify({"error": f"Input image not found: {img}"}), 404
+    
+    if not isinstance(data.get('model_path'), (str, type(None))):
+        return jsonify({"error": "model_path must be a model id or path"}), 400
+    
+    # Build command with parameters
+    params = job_params(data)
+    model = models.resolve(params['model_path'])
+    if model is None:
+        known = ', '.join(sorted(models.get_registry()[1]))
+        return jsonify({"error": f"Unknown model: {params['model_path']}. Available models: {known}"}), 400
+    input_hashes = [history.hash_file(layout.resolve(INPUT_FOLDER, img)) for img in input_images]
+    
+    # Return an identical earlier generation instead of computing it again
+    if data.get('reuse_previous'):
+        previous = find_previous_results(params, input_hashes)
+        if previous:
+            logger.info(f"Reusing result of process {previous[0]['process_id']}")
+            return jsonify({
+                "process_id": previous[0]['process_id'],
+                "status": "completed",
+                "output_filename": previous[0]['output_filename'],
+                "reused": True
+            })
+    
+    # Create a unique process ID
+    process_id = str(uuid.uuid4())
+    
+    # Refuse new work when every inference slot is taken, or when batching
+    # queues jobs, when the queue is full
+    error = admit_job(process_id)
+    if error:
+        return jsonify({"error": error}), 503
+    
+    try:
+        return launch_job(process_id, params, model, input_images, input_hashes)
+    finally:
+        _admissions.discard(process_id)
+
+# Reserve capacity for a new job; return the reason it was refused, if any.
+# Jobs admitted but not yet in active_processes count as running (or queued),
+# so concurrent requests can't exceed the limits.
+def admit_job(process_id):
+    with _admission_lock:
+        capacity = capacity_snapshot()
+        pending = len(_admissions)
+        if workers.batching_enabled():
+            if MAX_QUEUED_JOBS and capacity['queue_depth'] + pending >= MAX_QUEUED_JOBS:
+                return "The job queue is full, retry later"
+        elif capacity['free_slots'] == 0 or (
+                MAX_CONCURRENT_JOBS > 0 and capacity['running_jobs'] + pending >= MAX_CONCURRENT_JOBS):
+            return "No free inference slots, retry later"
+        _admissions.add(process_id)
+    return None
+
+# Start an admitted job
+def launch_job(process_id, params, model, input_images, input_hashes):
+    model_path = params['model_path']
+    num_inference_step = params['num_inference_step']
+    height = params['height']
+    width = params['width']
+    text_guidance_scale = params['text_guidance_scale']
+    image_guidance_scale = params['image_guidance_scale']
+    instruction = params['instruction']
+    
+    # Generate output filename with UUID
+    output_filename = f"{str(uuid.uuid4())}.png"
+    output_path = layout.shard_path(OUTPUT_FOLDER, output_filename)
+    
+    # Build input image paths string
+    input_image_paths = " ".join([layout.resolve(INPUT_FOLDER, img) for img in input_images])
+    
+    # Get inference script path from environment variable or use default
+    inference_script = os.environ.get('INFERENCE_SCRIPT_PATH', 'inference.py')
+    
+    # Build the command
+    cmd = f"python {inference_script} \
+        --model_path {model_path} \
+        --num_inference_step {num_inference_step} \
+        --height {height} \
+        --width {width} \
+        --text_guidance_scale {text_guidance_scale} \
+        --image_guidance_scale {image_guidance_scale} \
+        --instruction \"{instruction}\" \
+        --input_image_path {input_image_paths} \
+        --output_image_path {output_path}"
+    
+    # Ask the script for low-resolution previews while it denoises
+    preview_path = None
+    if PREVIEW_INTERVAL > 0:
+        preview_path = os.path.join(PREVIEW_FOLDER, f"{process_id}.png")
+        cmd += f" --preview_interval {PREVIEW_INTERVAL} --preview_image_path {preview_path}"
+    
+    if workers.INFERENCE_WORKERS > 0:
+        # Hand the job to an idle persistent worker, ideally one with the model
+        # loaded, or queue it to be batched with compatible jobs
+        pool = worker_pool()
+        worker = None
+        if pool.batcher is None:
+            worker = pool.acquire(process_id, model['id'])
+            if worker is None:
+                return jsonify({"error": "No free inference slots, retry later"}), 503
+        message = {key: params[key] for key in DEFAULT_JOB_PARAMS}
+        message.update({
+            'input_image_path': [layout.resolve(INPUT_FOLDER, img) for img in input_images],
+            'output_image_path': output_path
+        })
+        if preview_path:
+            message.update({'preview_interval': PREVIEW_INTERVAL, 'preview_image_path': preview_path})
+        process = workers.WorkerJob(pool, process_id, model, message, worker)
+        limits = dict(worker.limits) if worker else resources.job_limits()
+        cmd = json.dumps(message)
+        if worker:
+            logger.info(f"Starting process: {process_id} on inference worker {worker.index}")
+        else:
+            logger.info(f"Queued process: {process_id} for batching")
+    else:
+        # Pin the job to a free CPU slot with a matching thread count
+        limits = resources.job_limits()
+        if resources.slot_status():
+            slot = resources.acquire_slot(process_id)
+            if slot is None:
+                return jsonify({"error": "No free inference slots, retry later"}), 503
+            limits['slot'], limits['cpus'] = slot
+            limits['threads'] = len(limits['cpus'])
+        
+        # Start the process within the configured resource limits
+        logger.info(f"Starting process: {process_id} with command: {cmd}")
+        try:
+            process = subprocess.Popen(
+                shlex.split(cmd),
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                universal_newlines=True,
+                bufsize=1,
+                cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                env=resources.child_env(limits),
+                preexec_fn=resources.make_preexec(limits)
+            )
+        except Exception:
+            resources.release_slot(process_id)
+            raise
+    
+    # Store process information
+    queued = isinstance(process, workers.WorkerJob) and process.worker is None
+    active_processes[process_id] = {
+        'process': process,
+        'status': 'queued' if queued else 'running',
+        'progress': 0,
+        'start_time': datetime.now().isoformat(),
+        'started_at': time.monotonic(),
+        'limits': limits,
+        'output_path': output_path,
+        'output_filename': output_filename,
+        'preview_path': preview_path,
+        'preview_step': None,
+        'params': params,
+        'output': [],
+        'command': cmd,
+        # Set by the monitor once it has reaped the process
+        'finished': threading.Event()
+    }
+    _admissions.discard(process_id)
+    record_history(history.record_submission, process_id, params, input_hashes,
+                   output_filename, active_processes[process_id]['start_time'], active_processes[process_id]['status'])
+    
+    # Start monitoring thread
+    monitor_thread = threading.Thread(target=monitor_process, args=(process_id,), name=f'monitor-{process_id}')
+    monitor_thread.daemon = True
+    monitor_thread.start()
+    
+    # Enforce the wall-clock limit (queued jobs once they start)
+    if not queued:
+        start_timeout(process_id, active_processes[process_id])
+    
+    return jsonify({
+        "process_id": process_id,
+        "status": "queued" if queued else "started",
+        "output_filename": output_filename
+    })
+
+# Start the wall-clock limit of a job
+def start_timeout(process_id, process_info):
+    if process_info['limits']['timeout_seconds']:
+        timer = threading.Timer(process_info['limits']['timeout_seconds'], enforce_timeout, args=(process_id,))
+        timer.daemon = True
+        process_info['timeout_timer'] = timer
+        timer.start()
+
+# Mark a queued job as running once its batch is dispatched to a worker
+def job_started(process_id, process_info):
+    if process_info['status'] != 'queued':
+        return
+    queued_for = time.monotonic() - process_info['started_at']
+    record_history(history.record_started, process_id)
+    process_info['status'] = 'running'
+    process_info['started_at'] = time.monotonic()
+    record_history(history.record_duration, process_id, 'queue', queued_for)
+    start_timeout(process_id, process_info)
+
 # Script status endpoint
-@app.route('/api/status/<process_id>', methods=['GET'])
+@api.route('/api/status/<process_id>', methods=['GET'])
 def script_status(process_id):
     logger.info(f"Status endpoint called for process: {process_id}")
     
     if process_id not in active_processes:
-        return jsonify({"error": "Process not found"}), 404
+        # Finished jobs from earlier runs are answered from the history
+        job = history.get_job(process_id)
+        if job is None:
+            return jsonify({"error": "Process not found"}), 404
+        return jsonify(history_status(job))
     
-    process_info = active_processes[process_id]
+    return fast_jsonify(build_status(process_id, active_processes[process_id]))
+
+# Batch status endpoint
+@api.route('/api/status/batch', methods=['POST'])
+def batch_script_status():
+    logger.info("Batch status endpoint called")
     
-    # Check if process is still running
-    if process_info['status'] == 'running':
-        return_code = process_info['process'].poll()
-        if return_code is not None:
-            if return_code == 0:
-                process_info['status'] = 'completed'
-            else:
-                process_info['status'] = 'failed'
+    process_ids, error = batch_items('process_ids')
+    if error:
+        return error
+    
+    statuses = {}
+    not_found = []
+    for process_id in process_ids:
+        process_info = active_processes.get(process_id)
+        job = history.get_job(process_id) if process_info is None else None
+        if process_info is not None:
+            statuses[process_id] = build_status(process_id, process_info)
+        elif job is not None:
+            statuses[process_id] = history_status(job)
+        else:
+            not_found.append(process_id)
     
+    return fast_jsonify({"statuses": statuses, "not_found": not_found})
+
+# Build the status payload reported for a process
+def build_status(process_id, process_info):
+    # The status is kept up to date by the job's monitor, which is also
+    # the only code reaping the process
     # Prepare response
     response = {
         "process_id": process_id,
@@ -453,19 +1155,109 @@ def script_status(process_id):
         "start_time": process_info['start_time']
     }
     
+    # Add the latest intermediate preview while the job is running
+    if process_info['status'] == 'running' and process_info.get('preview_step') is not None:
+        response["preview_step"] = process_info['preview_step']
+        response["preview_url"] = url_for('api.serve_image', folder='preview', filename=f"{process_id}.png",
+                                          step=process_info['preview_step'], _external=True)
+    
     # Add output path if completed
     if process_info['status'] == 'completed':
-        file_url = url_for('serve_image', folder='output', filename=process_info['output_filename'], _external=True)
+        file_url = url_for('api.serve_image', folder='output', filename=process_info['output_filename'], _external=True)
         response["output_url"] = file_url
     
     # Add error if failed
     if process_info['status'] == 'failed' and 'error' in process_info:
         response["error"] = process_info['error']
     
-    return jsonify(response)
+    # Add resource limits and, once the process has exited, measured usage
+    if 'limits' in process_info:
+        response["limits"] = process_info['limits']
+    if 'resources' in process_info:
+        response["resources"] = process_info['resources']
+    
+    return response
+
+# Job history search endpoint
+@api.route('/api/history', methods=['GET'])
+def search_history():
+    logger.info("History search endpoint called")
+    
+    try:
+        limit = min(int(request.args.get('limit', 50)), 500)
+        offset = int(request.args.get('offset', 0))
+        filters = {
+            field: request.args[field]
+            for field in ('num_inference_step', 'height', 'width', 'text_guidance_scale', 'image_guidance_scale')
+            if field in request.args
+        }
+    except ValueError:
+        return jsonify({"error": "limit and offset must be integers"}), 400
+    
+    jobs = history.search(
+        text=request.args.get('q'),
+        status=request.args.get('status'),
+        model_path=request.args.get('model_path'),
+        since=request.args.get('since'),
+        until=request.args.get('until'),
+        filters=filters,
+        limit=limit,
+        offset=offset
+    )
+    for job in jobs:
+        if job['status'] == 'completed':
+            job['output_url'] = url_for('api.serve_image', folder='output', filename=job['output_filename'], _external=True)
+    
+    return jsonify({"jobs": jobs})
+
+# Single job history endpoint
+@api.route('/api/history/<process_id>', methods=['GET'])
+def get_history(process_id):
+    logger.info(f"History endpoint called for process: {process_id}")
+    
+    job = history.get_job(process_id)
+    if job is None:
+        return jsonify({"error": "Process not found"}), 404
+    return jsonify(job)
+
+# Find earlier results for a set of job parameters
+@api.route('/api/history/find', methods=['POST'])
+def find_history():
+    logger.info("History find endpoint called")
+    
+    data = request.get_json(silent=True) or {}
+    input_images = data.get('input_images')
+    if not input_images or not isinstance(input_images, list):
+        return jsonify({"error": "At least one input image is required"}), 400
+    for img in input_images:
+        if not os.path.exists(layout.resolve(INPUT_FOLDER, img)):
+            return jsonify({"error": f"Input image not found: {img}"}), 404
+    
+    params = job_params(data)
+    input_hashes = [history.hash_file(layout.resolve(INPUT_FOLDER, img)) for img in input_images]
+    
+    matches = find_previous_results(params, input_hashes)
+    for job in matches:
+        job['output_url'] = url_for('api.serve_image', folder='output', filename=job['output_filename'], _external=True)
+    return jsonify({"matches": matches})
+
+# Rerun a job from the history with its stored parameters
+@api.route('/api/history/<process_id>/rerun', methods=['POST'])
+def rerun_job(process_id):
+    logger.info(f"Rerun endpoint called for process: {process_id}")
+    
+    job = history.get_job(process_id)
+    if job is None:
+        return jsonify({"error": "Process not found"}), 404
+    
+    try:
+        return start_job(dict(job['params']))
+    except Exception as e:
+        logger.error(f"Error rerunning process {process_id}: {str(e)}")
+        return jsonify({"error": f"Error executing script: {str(e)}"}), 500
 
 # Script cancellation endpoint
-@app.route('/api/cancel/<process_id>', methods=['POST'])
+@api.route('/api/cancel/<process_id>', methods=['POST'])
 def cancel_script(process_id):
     logger.info(f"Cancel endpoint called for process: {process_id}")
     
@@ -474,20 +1266,20 @@ def cancel_script(process_id):
     
     process_info = active_processes[process_id]
     
-    # Check if process is still running
-    if process_info['status'] == 'running':
+    # Check if process is still running (or waiting in the batching queue)
+    if process_info['status'] in ('running', 'queued'):
         try:
             # Try to terminate the process
-            process_info['process'].terminate()
+            process_info['cancel_requested'] = True
+            signal_job(process_info['process'], signal.SIGTERM)
             
-            # Wait a bit and check if it terminated
-            try:
-                process_info['process'].wait(timeout=5)
-            except subprocess.TimeoutExpired:
-                # Force kill if it didn't terminate
-                process_info['process'].kill()
+            # Wait a bit for the monitor to reap it, force kill if it didn't terminate
+            finished = process_info.get('finished')
+            if finished is not None and not finished.wait(timeout=5):
+                signal_job(process_info['process'], signal.SIGKILL)
             
             process_info['status'] = 'cancelled'
+            remove_preview(process_info)
             logger.info(f"Process cancelled: {process_id}")
             
             return jsonify({
@@ -505,7 +1297,12 @@ def cancel_script(process_id):
             "message": "Process is not running"
         })
 
+# Application instance used by gunicorn ("app:app") and the tests
+app = create_app()
+
 if __name__ == '__main__':
+    initialize()
+    recover_interrupted_jobs()
     # Get port from environment variable or use default
     port = int(os.environ.get('BACKEND_PORT', 5000))
     logger.info(f"Starting OmniGen2 UI backend server on port {port}")
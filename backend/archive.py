@@ -0,0 +1,68 @@
+"""Streaming zip/tar archives of image files.
+
+The archives are produced as generators of byte chunks so they can be sent
+as a streamed response while they are being built. At most one read chunk
+per file is held in memory, regardless of how many files are exported.
+"""
+import os
+import tarfile
+import zipfile
+
+CHUNK_SIZE = 64 * 1024
+
+class _ChunkBuffer:
+    """Write-only file object whose contents are drained by the generator."""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+def stream_zip(files):
+    """Yield a zip archive of ``files``, a list of ``(arcname, path)`` pairs.
+
+    Images are already compressed, so entries are stored without deflate.
+    """
+    buffer = _ChunkBuffer()
+    with zipfile.ZipFile(buffer, mode='w', compression=zipfile.ZIP_STORED) as archive:
+        for arcname, path in files:
+            info = zipfile.ZipInfo.from_file(path, arcname)
+            with open(path, 'rb') as source, archive.open(info, mode='w') as target:
+                for chunk in iter(lambda: source.read(CHUNK_SIZE), b''):
+                    target.write(chunk)
+                    yield buffer.drain()
+            yield buffer.drain()
+    yield buffer.drain()
+
+def stream_tar(files):
+    """Yield an uncompressed tar archive of ``files``."""
+    size = 0
+    for arcname, path in files:
+        with open(path, 'rb') as source:
+            stat = os.fstat(source.fileno())
+            info = tarfile.TarInfo(arcname)
+            info.size = stat.st_size
+            info.mtime = stat.st_mtime
+            info.mode = 0o644
+            header = info.tobuf(format=tarfile.PAX_FORMAT)
+            yield header
+            for chunk in iter(lambda: source.read(CHUNK_SIZE), b''):
+                yield chunk
+        # Pad the member data to a whole number of blocks
+        padding = -info.size % tarfile.BLOCKSIZE
+        yield tarfile.NUL * padding
+        size += len(header) + info.size + padding
+
+    # End-of-archive marker, padded to a full record like tarfile does
+    size += 2 * tarfile.BLOCKSIZE
+    yield tarfile.NUL * (2 * tarfile.BLOCKSIZE + -size % tarfile.RECORDSIZE)
@@ -0,0 +1,102 @@
+"""Change feed of the image folders.
+
+Every image added to or removed from a folder (uploads, completed jobs,
+deletes, storage GC) is appended to an event log in the history database.
+Events are numbered by a monotonic sequence number, so a client that knows
+the version of its copy of the gallery can fetch just the changes made since
+then instead of listing the whole folder again. The log is trimmed to the
+newest ``GALLERY_FEED_RETENTION`` events; clients whose version is older than
+that have to list the folder again.
+"""
+import os
+import logging
+import threading
+from contextlib import contextmanager
+
+import history
+
+logger = logging.getLogger('app.changefeed')
+
+# Number of events kept in the log (0 keeps all of them)
+GALLERY_FEED_RETENTION = int(os.environ.get('GALLERY_FEED_RETENTION', 100000))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS gallery_events (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    folder TEXT NOT NULL,
+    action TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    size INTEGER,
+    created_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS gallery_events_folder ON gallery_events (folder, seq);
+"""
+
+_initialized = set()
+_init_lock = threading.Lock()
+
+class VersionExpired(Exception):
+    """The requested version is older than the oldest retained event."""
+
+@contextmanager
+def transaction(db_path=None):
+    """Yield a history database connection with the event log created."""
+    db_path = db_path or history.HISTORY_DB_PATH
+    with history.transaction(db_path) as connection:
+        with _init_lock:
+            if db_path not in _initialized:
+                connection.executescript(SCHEMA)
+                _initialized.add(db_path)
+        yield connection
+
+def record(folder, action, filename, created_at, size=None, db_path=None):
+    """Append an ``added`` or ``removed`` event and return its sequence number."""
+    with transaction(db_path) as connection:
+        cursor = connection.execute(
+            "INSERT INTO gallery_events (folder, action, filename, size, created_at) VALUES (?, ?, ?, ?, ?)",
+            (folder, action, filename, size, created_at)
+        )
+        seq = cursor.lastrowid
+        # Trim the log every 1000 events rather than on every insert
+        if GALLERY_FEED_RETENTION and seq % 1000 == 0:
+            connection.execute("DELETE FROM gallery_events WHERE seq <= ?", (seq - GALLERY_FEED_RETENTION,))
+    return seq
+
+def _head(connection):
+    # AUTOINCREMENT keeps the highest sequence number even after trimming
+    row = connection.execute("SELECT seq FROM sqlite_sequence WHERE name = 'gallery_events'").fetchone()
+    return row['seq'] if row else 0
+
+def current_version(db_path=None):
+    """Return the sequence number of the newest event (0 if there is none)."""
+    with transaction(db_path) as connection:
+        return _head(connection)
+
+def changes_since(folder, since, limit=500, db_path=None):
+    """Return ``(changes, version, has_more)`` for events of ``folder`` after ``since``.
+
+    Only the latest event of each filename is returned. ``version`` is the
+    version the client reaches by applying the changes.
+    """
+    with transaction(db_path) as connection:
+        oldest = connection.execute("SELECT MIN(seq) AS seq FROM gallery_events").fetchone()['seq']
+        head = _head(connection)
+        if since > head or (oldest is not None and since < oldest - 1):
+            raise VersionExpired(f"Version {since} is no longer available, current version is {head}")
+        rows = connection.execute(
+            "SELECT * FROM gallery_events WHERE folder = ? AND seq > ? ORDER BY seq LIMIT ?",
+            (folder, since, limit + 1)
+        ).fetchall()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if has_more:
+        version = rows[-1]['seq']
+    else:
+        # Events may have been appended between the two queries
+        version = max([head] + [row['seq'] for row in rows[-1:]])
+    latest = {}
+    for row in rows:
+        latest.pop(row['filename'], None)
+        latest[row['filename']] = dict(row)
+    return list(latest.values()), version, has_more
@@ -0,0 +1,64 @@
+"""Compact JSON encoding and negotiated compression of API responses.
+
+JSON bodies are encoded without whitespace, with ``orjson`` when it is
+installed. Responses above ``COMPRESS_MIN_BYTES`` are compressed with brotli
+(if the ``brotli`` package is installed) or gzip, whichever the client
+prefers in its ``Accept-Encoding`` header. Image and archive responses are
+left alone: they are already compressed or streamed.
+"""
+import os
+import gzip
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Smaller bodies are sent uncompressed (0 disables compression)
+COMPRESS_MIN_BYTES = int(os.environ.get('COMPRESS_MIN_BYTES', 1024))
+GZIP_LEVEL = int(os.environ.get('GZIP_LEVEL', 6))
+BROTLI_QUALITY = int(os.environ.get('BROTLI_QUALITY', 5))
+
+COMPRESSIBLE_MIMETYPES = ('application/json',)
+
+def dumps(payload):
+    """Encode ``payload`` as compact JSON bytes."""
+    if orjson is not None:
+        return orjson.dumps(payload)
+    return json.dumps(payload, separators=(',', ':')).encode('utf-8')
+
+def negotiate_encoding(accept_encodings):
+    """Pick ``br``, ``gzip`` or None from a parsed ``Accept-Encoding`` header."""
+    gzip_quality = accept_encodings.quality('gzip')
+    if brotli is not None and accept_encodings.quality('br') >= max(gzip_quality, 0.001):
+        return 'br'
+    if gzip_quality > 0:
+        return 'gzip'
+    return None
+
+def compress_response(response, accept_encodings):
+    """Compress a buffered JSON response in place if the client accepts it."""
+    if (not COMPRESS_MIN_BYTES or response.direct_passthrough or response.is_streamed
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES
+            or 'Content-Encoding' in response.headers):
+        return response
+
+    response.vary.add('Accept-Encoding')
+    data = response.get_data()
+    encoding = negotiate_encoding(accept_encodings)
+    if encoding is None or len(data) < COMPRESS_MIN_BYTES:
+        return response
+
+    if encoding == 'br':
+        data = brotli.compress(data, quality=BROTLI_QUALITY)
+    else:
+        data = gzip.compress(data, compresslevel=GZIP_LEVEL)
+    response.set_data(data)
+    response.headers['Content-Encoding'] = encoding
+    return response
@@ -0,0 +1,7 @@
+"""gunicorn settings, picked up by ``gunicorn app:app`` run from backend/."""
+
+def on_starting(server):
+    # Runs once in the master before any worker is forked, so no job of
+    # this server run can be mistaken for one left over by the previous run
+    import app
+    app.recover_interrupted_jobs()
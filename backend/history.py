@@ -0,0 +1,237 @@
+"""Persistent job history and generation provenance.
+
+Every submitted job is stored in a SQLite database together with its full
+parameter set, the SHA-256 hashes of its input images, its output file,
+its timings per phase and its final status. Instructions are indexed for
+full-text search (FTS5) and the parameters are reduced to a ``params_key``
+so that identical generations can be found again instead of recomputed.
+"""
+import os
+import json
+import sqlite3
+import hashlib
+import logging
+import threading
+from contextlib import contextmanager
+from functools import lru_cache
+
+logger = logging.getLogger('app.history')
+
+HISTORY_DB_PATH = os.environ.get(
+    'HISTORY_DB_PATH',
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'job_history.db')
+)
+
+# Parameters that define a generation; two jobs with the same values and
+# the same input contents produce the same image
+PARAM_FIELDS = ('model_path', 'num_inference_step', 'height', 'width',
+                'text_guidance_scale', 'image_guidance_scale', 'instruction')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    process_id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    finished_at TEXT,
+    model_path TEXT,
+    num_inference_step INTEGER,
+    height INTEGER,
+    width INTEGER,
+    text_guidance_scale REAL,
+    image_guidance_scale REAL,
+    instruction TEXT,
+    params TEXT NOT NULL,
+    input_images TEXT NOT NULL,
+    input_hashes TEXT NOT NULL,
+    params_key TEXT NOT NULL,
+    output_filename TEXT,
+    error TEXT,
+    durations TEXT NOT NULL DEFAULT '{}',
+    resources TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_created_at ON jobs (created_at);
+CREATE INDEX IF NOT EXISTS jobs_params_key ON jobs (params_key, status);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at);
+CREATE INDEX IF NOT EXISTS jobs_model_path ON jobs (model_path, created_at);
+"""
+
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS jobs_fts USING fts5(
+    instruction, content='jobs', content_rowid='rowid'
+);
+CREATE TRIGGER IF NOT EXISTS jobs_fts_insert AFTER INSERT ON jobs BEGIN
+    INSERT INTO jobs_fts (rowid, instruction) VALUES (new.rowid, new.instruction);
+END;
+"""
+
+JSON_COLUMNS = ('params', 'input_images', 'input_hashes', 'durations', 'resources')
+
+_initialized = set()
+_init_lock = threading.Lock()
+_has_fts = {}
+
+def connect(db_path=None):
+    """Open a connection to the history database, creating the schema once."""
+    db_path = db_path or HISTORY_DB_PATH
+    connection = sqlite3.connect(db_path, timeout=10)
+    connection.row_factory = sqlite3.Row
+    with _init_lock:
+        if db_path not in _initialized:
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.executescript(SCHEMA)
+            try:
+                connection.executescript(FTS_SCHEMA)
+                _has_fts[db_path] = True
+            except sqlite3.OperationalError:
+                logger.warning("SQLite FTS5 is not available, instruction search falls back to LIKE")
+                _has_fts[db_path] = False
+            _initialized.add(db_path)
+    return connection
+
+@contextmanager
+def transaction(db_path=None):
+    """Yield a connection whose changes are committed on success, then close it."""
+    connection = connect(db_path)
+    try:
+        with connection:
+            yield connection
+    finally:
+        connection.close()
+
+@lru_cache(maxsize=4096)
+def _hash_file(path, mtime_ns, size):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def hash_file(path):
+    """Return the SHA-256 of a file, cached by path, mtime and size."""
+    stat = os.stat(path)
+    return _hash_file(path, stat.st_mtime_ns, stat.st_size)
+
+def params_key(params, input_hashes):
+    """Return a stable key for the generation parameters and input contents."""
+    canonical = {field: params.get(field) for field in PARAM_FIELDS}
+    canonical['input_hashes'] = list(input_hashes)
+    return hashlib.sha256(json.dumps(canonical, sort_keys=True).encode('utf-8')).hexdigest()
+
+def record_submission(process_id, params, input_hashes, output_filename, created_at, status='running',
+                      db_path=None):
+    """Store a newly submitted job, either running or queued for a worker."""
+    with transaction(db_path) as connection:
+        connection.execute(
+            """INSERT INTO jobs (process_id, status, created_at, model_path,
+                   num_inference_step, height, width, text_guidance_scale, image_guidance_scale,
+                   instruction, params, input_images, input_hashes, params_key, output_filename)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+            (process_id, status, created_at, params.get('model_path'), params.get('num_inference_step'),
+             params.get('height'), params.get('width'), params.get('text_guidance_scale'),
+             params.get('image_guidance_scale'), params.get('instruction'), json.dumps(params),
+             json.dumps(params.get('input_images', [])), json.dumps(input_hashes),
+             params_key(params, input_hashes), output_filename)
+        )
+
+def record_started(process_id, db_path=None):
+    """Mark a queued job as running once it is dispatched to a worker."""
+    with transaction(db_path) as connection:
+        connection.execute("UPDATE jobs SET status = 'running' WHERE process_id = ? AND status = 'queued'",
+                           (process_id,))
+
+def record_completion(process_id, status, finished_at, error=None, resources=None, db_path=None):
+    """Store the final status, error and resource usage of a job."""
+    with transaction(db_path) as connection:
+        connection.execute(
+            "UPDATE jobs SET status = ?, finished_at = ?, error = ?, resources = ? WHERE process_id = ?",
+            (status, finished_at, error, json.dumps(resources) if resources else None, process_id)
+        )
+    if resources and 'wall_time_seconds' in resources:
+        record_duration(process_id, 'run', resources['wall_time_seconds'], db_path)
+
+def mark_interrupted(before, finished_at, db_path=None):
+    """Fail jobs submitted before ``before`` that never finished; return how many.
+
+    The process that ran them is gone, so they would otherwise be reported
+    as running forever.
+    """
+    with transaction(db_path) as connection:
+        cursor = connection.execute(
+            """UPDATE jobs SET status = 'failed', finished_at = ?, error = 'Interrupted by a server restart'
+               WHERE status IN ('running', 'queued') AND created_at < ?""",
+            (finished_at, before)
+        )
+        return cursor.rowcount
+
+def record_duration(process_id, phase, seconds, db_path=None):
+    """Store how long one phase (queue, run, postprocess, ...) of a job took."""
+    with transaction(db_path) as connection:
+        connection.execute(
+            "UPDATE jobs SET durations = json_set(durations, ?, ?) WHERE process_id = ?",
+            (f'$.{phase}_seconds', round(seconds, 3), process_id)
+        )
+
+def _row_to_job(row):
+    job = dict(row)
+    for column in JSON_COLUMNS:
+        if job.get(column) is not None:
+            job[column] = json.loads(job[column])
+    return job
+
+def get_job(process_id, db_path=None):
+    with transaction(db_path) as connection:
+        row = connection.execute("SELECT * FROM jobs WHERE process_id = ?", (process_id,)).fetchone()
+    return _row_to_job(row) if row else None
+
+def unfinished_jobs(db_path=None):
+    """Return the running and queued jobs of every server process."""
+    with transaction(db_path) as connection:
+        rows = connection.execute("SELECT * FROM jobs WHERE status IN ('running', 'queued')").fetchall()
+    return [_row_to_job(row) for row in rows]
+
+def find_previous(params, input_hashes, db_path=None):
+    """Return completed jobs with the same parameters and inputs, newest first."""
+    with transaction(db_path) as connection:
+        rows = connection.execute(
+            "SELECT * FROM jobs WHERE params_key = ? AND status = 'completed' ORDER BY created_at DESC",
+            (params_key(params, input_hashes),)
+        ).fetchall()
+    return [_row_to_job(row) for row in rows]
+
+def search(text=None, status=None, model_path=None, since=None, until=None,
+           filters=None, limit=50, offset=0, db_path=None):
+    """Query the history; ``filters`` maps indexed parameter columns to values."""
+    db_path = db_path or HISTORY_DB_PATH
+    clauses, args = [], []
+    with transaction(db_path) as connection:
+        if text:
+            if _has_fts.get(db_path):
+                # Quote each term so user input is never parsed as FTS syntax
+                query = ' '.join('"' + term.replace('"', '""') + '"' for term in text.split())
+                clauses.append("rowid IN (SELECT rowid FROM jobs_fts WHERE jobs_fts MATCH ?)")
+                args.append(query)
+            else:
+                clauses.append("instruction LIKE ?")
+                args.append(f'%{text}%')
+        for column, value in (('status', status), ('model_path', model_path)):
+            if value is not None:
+                clauses.append(f"{column} = ?")
+                args.append(value)
+        if since:
+            clauses.append("created_at >= ?")
+            args.append(since)
+        if until:
+            clauses.append("created_at < ?")
+            args.append(until)
+        for column, value in (filters or {}).items():
+            if column not in PARAM_FIELDS:
+                raise ValueError(f"Unknown filter: {column}")
+            clauses.append(f"{column} = ?")
+            args.append(value)
+
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+        rows = connection.execute(
+            f"SELECT * FROM jobs {where} ORDER BY created_at DESC LIMIT ? OFFSET ?",
+            args + [limit, offset]
+        ).fetchall()
+    return [_row_to_job(row) for row in rows]
@@ -0,0 +1,112 @@
+"""Idempotency keys for job submissions.
+
+A client that sends an ``Idempotency-Key`` header with ``/api/execute`` can
+retry the request after a timeout or a dropped connection without starting
+a second job: the first request with a key claims it in the history
+database, and its response is stored once it succeeds. A retry with the same
+key and payload gets the stored response (and so the original process_id),
+and a retry that arrives while the first request is still being handled
+waits for it. Keys are kept for ``IDEMPOTENCY_TTL_SECONDS``.
+
+Only successful responses are stored. A failed submission (no free slot, a
+missing input image) releases its key, so the retry is handled anew.
+"""
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from contextlib import contextmanager
+
+import history
+
+logger = logging.getLogger('app.idempotency')
+
+# How long a key and its stored response are kept
+IDEMPOTENCY_TTL_SECONDS = int(os.environ.get('IDEMPOTENCY_TTL_SECONDS', 24 * 3600))
+# How long a retry waits for a request with the same key that is still running
+IDEMPOTENCY_WAIT_SECONDS = float(os.environ.get('IDEMPOTENCY_WAIT_SECONDS', 10))
+
+MAX_KEY_LENGTH = 255
+# A claim whose request never finished (the server was stopped) is taken over after this long
+STALE_CLAIM_SECONDS = 300
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS idempotency_keys (
+    key TEXT PRIMARY KEY,
+    fingerprint TEXT NOT NULL,
+    status_code INTEGER,
+    response TEXT,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idempotency_keys_created_at ON idempotency_keys (created_at);
+"""
+
+_initialized = set()
+_init_lock = threading.Lock()
+
+class KeyInProgress(Exception):
+    """Another request with the same key has not finished yet."""
+
+class KeyMismatch(Exception):
+    """The key was already used with a different payload."""
+
+@contextmanager
+def transaction(db_path=None):
+    """Yield a history database connection with the key table created."""
+    db_path = db_path or history.HISTORY_DB_PATH
+    with history.transaction(db_path) as connection:
+        with _init_lock:
+            if db_path not in _initialized:
+                connection.executescript(SCHEMA)
+                _initialized.add(db_path)
+        yield connection
+
+def valid_key(key):
+    return bool(key) and len(key) <= MAX_KEY_LENGTH and key.isprintable()
+
+def fingerprint(payload):
+    """Hash of a request payload, independent of the key order."""
+    encoded = json.dumps(payload, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+def claim(key, fingerprint, db_path=None):
+    """Claim ``key`` for a new request, or return the stored response of an earlier one.
+
+    Returns None when the key was claimed: the caller must then ``complete``
+    or ``release`` it. Otherwise returns ``(status_code, body)``. Raises
+    ``KeyInProgress`` or ``KeyMismatch`` when the key can't be used now.
+    """
+    now = time.time()
+    with transaction(db_path) as connection:
+        connection.execute(
+            "DELETE FROM idempotency_keys WHERE created_at < ? OR (key = ? AND response IS NULL AND created_at < ?)",
+            (now - IDEMPOTENCY_TTL_SECONDS, key, now - STALE_CLAIM_SECONDS)
+        )
+        cursor = connection.execute(
+            "INSERT OR IGNORE INTO idempotency_keys (key, fingerprint, created_at) VALUES (?, ?, ?)",
+            (key, fingerprint, now)
+        )
+        if cursor.rowcount == 1:
+            return None
+        row = connection.execute("SELECT * FROM idempotency_keys WHERE key = ?", (key,)).fetchone()
+
+    if row['fingerprint'] != fingerprint:
+        raise KeyMismatch(f"Idempotency-Key {key} was already used with a different request")
+    if row['response'] is None:
+        raise KeyInProgress(f"A request with Idempotency-Key {key} is still in progress")
+    return row['status_code'], row['response']
+
+def complete(key, status_code, body, db_path=None):
+    """Store the response of the request that claimed ``key``."""
+    with transaction(db_path) as connection:
+        connection.execute(
+            "UPDATE idempotency_keys SET status_code = ?, response = ? WHERE key = ?",
+            (status_code, body, key)
+        )
+
+def release(key, db_path=None):
+    """Give up a claim without storing a response, so the key can be retried."""
+    with transaction(db_path) as connection:
+        connection.execute("DELETE FROM idempotency_keys WHERE key = ? AND response IS NULL", (key,))
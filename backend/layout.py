@@ -0,0 +1,80 @@
+"""Sharded on-disk layout for the image folders.
+
+Images are stored below two levels of hash-prefix directories, e.g.
+``output_images/3f/a2/<uuid>.png``, so that no single directory grows to
+hundreds of thousands of entries. The shard is derived from the filename
+stem, which keeps post-processed variants (``<uuid>.webp``) next to their
+original. Files that still live at the top level of a folder are found by a
+fallback lookup until they are moved with the migration tool::
+
+    python layout.py ../input_images ../output_images
+"""
+import os
+import sys
+import hashlib
+
+# Number of two-character directory levels (0 keeps folders flat)
+SHARD_DEPTH = int(os.environ.get('SHARD_DEPTH', 2))
+
+def shard_dir(folder, filename, depth=None):
+    """Return the shard directory of ``filename`` below ``folder``."""
+    depth = SHARD_DEPTH if depth is None else depth
+    digest = hashlib.md5(os.path.splitext(filename)[0].encode('utf-8')).hexdigest()
+    return os.path.join(folder, *[digest[2 * level:2 * level + 2] for level in range(depth)])
+
+def shard_path(folder, filename, depth=None):
+    """Return the path a new file should be written to, creating its shard.
+
+    The shard's mtime is bumped, so the storage collector doesn't prune it
+    as empty before the file is written.
+    """
+    directory = shard_dir(folder, filename, depth)
+    os.makedirs(directory, exist_ok=True)
+    try:
+        os.utime(directory)
+    except OSError:
+        pass
+    return os.path.join(directory, filename)
+
+def resolve(folder, filename):
+    """Return the path of an existing file, falling back to the flat layout.
+
+    If the file does not exist anywhere, its sharded path is returned.
+    """
+    path = os.path.join(shard_dir(folder, filename), filename)
+    if not os.path.exists(path):
+        flat_path = os.path.join(folder, filename)
+        if os.path.exists(flat_path):
+            return flat_path
+    return path
+
+def iter_files(folder):
+    """Yield ``os.DirEntry`` objects for every file below ``folder``."""
+    try:
+        entries = list(os.scandir(folder))
+    except FileNotFoundError:
+        return
+    for entry in entries:
+        if entry.is_dir(follow_symlinks=False):
+            yield from iter_files(entry.path)
+        elif entry.is_file(follow_symlinks=False) and not entry.name.startswith('.'):
+            yield entry
+
+def migrate(folder, depth=None):
+    """Move the top-level files of ``folder`` into their shards."""
+    moved = 0
+    for entry in list(os.scandir(folder)):
+        if not entry.is_file(follow_symlinks=False) or entry.name.startswith('.'):
+            continue
+        target = shard_path(folder, entry.name, depth)
+        if target != entry.path:
+            os.replace(entry.path, target)
+            moved += 1
+    return moved
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print(f"Usage: python {sys.argv[0]} FOLDER [FOLDER ...]")
+        sys.exit(1)
+    for folder in sys.argv[1:]:
+        print(f"{folder}: moved {migrate(folder)} files")
@@ -0,0 +1,214 @@
+"""Storage lifecycle management for the image folders.
+
+A background collector periodically enforces per-folder policies:
+
+* ``ttl_seconds``: items not used for longer than this are deleted.
+* ``quota_bytes``: when a folder is over quota, the least recently used
+  unreferenced items are evicted until it fits again.
+* ``orphans``: every unreferenced item is deleted (used for previews).
+
+It also removes partial outputs left behind by failed or cancelled jobs,
+previews whose job is gone, stale temporary files and empty shard
+directories. Files are grouped into
+items by their stem, so ``<uuid>.png`` and its ``<uuid>.webp`` variant are
+accounted and deleted together. Items referenced by running jobs are never
+touched. Every pass scans all files of the managed folders, since quotas
+depend on a folder's total size and LRU order, but deletes at most
+``batch_size`` items, so a large backlog is removed over several passes.
+
+Every server process starts the collector thread, but only the one holding
+the collector lock file runs passes.
+"""
+import os
+import time
+import fcntl
+import logging
+import threading
+
+import layout
+
+logger = logging.getLogger('app.lifecycle')
+
+# Temporary files older than this are considered abandoned
+TEMP_FILE_GRACE_SECONDS = 3600
+
+# Serving a file bumps its access time at most this often
+ACCESS_RESOLUTION_SECONDS = 60
+
+def load_policy(prefix):
+    """Read the quota and TTL policy for a folder from the environment."""
+    return {
+        'quota_bytes': int(float(os.environ.get(f'{prefix}_QUOTA_MB', 0)) * 1024 * 1024),
+        'ttl_seconds': int(float(os.environ.get(f'{prefix}_TTL_HOURS', 0)) * 3600),
+    }
+
+def touch(path):
+    """Record that a file has just been used by setting its access time.
+
+    The atime is set explicitly, so this also works on noatime mounts and is
+    seen by every server process. The mtime is kept.
+    """
+    try:
+        stat = os.stat(path)
+        if time.time() - stat.st_atime >= ACCESS_RESOLUTION_SECONDS:
+            os.utime(path, ns=(time.time_ns(), stat.st_mtime_ns))
+    except OSError:
+        pass
+
+def scan_folder(folder):
+    """Group the files of a folder into items keyed by filename stem."""
+    items = {}
+    for entry in layout.iter_files(folder):
+        stat = entry.stat()
+        stem = os.path.splitext(entry.name)[0]
+        item = items.setdefault(stem, {'name': stem, 'files': [], 'size': 0, 'last_used': 0})
+        item['files'].append(entry.path)
+        item['size'] += stat.st_size
+        item['last_used'] = max(item['last_used'], stat.st_mtime, stat.st_atime)
+    return items
+
+def plan_folder(items, policy, referenced, now):
+    """Return the items that the policy would delete, with the reason."""
+    candidates = []
+    remaining = []
+    total_size = sum(item['size'] for item in items.values())
+
+    for item in sorted(items.values(), key=lambda x: x['last_used']):
+        if item['name'] in referenced:
+            continue
+        if any(path.endswith('.tmp') for path in item['files']):
+            if now - item['last_used'] > TEMP_FILE_GRACE_SECONDS:
+                candidates.append(dict(item, reason='partial'))
+                total_size -= item['size']
+            continue
+        if policy.get('orphans'):
+            candidates.append(dict(item, reason='orphan'))
+            total_size -= item['size']
+        elif policy['ttl_seconds'] and now - item['last_used'] > policy['ttl_seconds']:
+            candidates.append(dict(item, reason='expired'))
+            total_size -= item['size']
+        else:
+            remaining.append(item)
+
+    # Evict least recently used items until the folder fits its quota
+    if policy['quota_bytes']:
+        for item in remaining:
+            if total_size <= policy['quota_bytes']:
+                break
+            candidates.append(dict(item, reason='quota'))
+            total_size -= item['size']
+
+    return candidates
+
+def prune_shards(folder, now):
+    """Remove the empty shard directories below ``folder``; return how many.
+
+    Directories changed within ``TEMP_FILE_GRACE_SECONDS`` are kept, which
+    includes shards just handed out by ``layout.shard_path`` for a file that
+    is yet to be written. A directory emptied by this pass is removed by a
+    later one.
+    """
+    def prune(directory):
+        try:
+            stale = now - os.stat(directory).st_mtime > TEMP_FILE_GRACE_SECONDS
+            entries = list(os.scandir(directory))
+        except OSError:
+            return 0, False
+        removed, left = 0, len(entries)
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                count, gone = prune(entry.path)
+                removed += count
+                left -= gone
+        if directory == folder or left or not stale:
+            return removed, False
+        try:
+            os.rmdir(directory)
+        except OSError:
+            return removed, False
+        return removed + 1, True
+
+    return prune(folder)[0]
+
+def collect(folders, policies, referenced, partial_paths, dry_run=True, batch_size=None, now=None):
+    """Run one collection pass and return a report of what was (or would be) deleted.
+
+    ``folders`` maps a folder key to its path, ``policies`` maps the same keys
+    to policies (folders without a policy only lose stale temporary files),
+    ``referenced`` maps keys to the set of item names in use and
+    ``partial_paths`` lists outputs of failed jobs.
+    """
+    now = now or time.time()
+    report = {'dry_run': dry_run, 'folders': {}, 'candidates': [], 'reclaimable_bytes': 0,
+              'pruned_directories': 0}
+    empty_policy = {'quota_bytes': 0, 'ttl_seconds': 0}
+
+    for path in partial_paths:
+        if os.path.exists(path):
+            stem = os.path.splitext(os.path.basename(path))[0]
+            report['candidates'].append({'folder': 'output', 'name': stem, 'files': [path],
+                                         'size': os.path.getsize(path), 'reason': 'failed_job'})
+
+    for key, folder in folders.items():
+        items = scan_folder(folder)
+        policy = policies.get(key, empty_policy)
+        report['folders'][key] = {
+            'items': len(items),
+            'size': sum(item['size'] for item in items.values()),
+            'quota_bytes': policy['quota_bytes'],
+            'ttl_seconds': policy['ttl_seconds'],
+        }
+        failed = {candidate['name'] for candidate in report['candidates']}
+        for candidate in plan_folder(items, policy, referenced.get(key, set()) | failed, now):
+            candidate['folder'] = key
+            report['candidates'].append(candidate)
+
+    if batch_size:
+        report['candidates'] = report['candidates'][:batch_size]
+    report['reclaimable_bytes'] = sum(c['size'] for c in report['candidates'])
+
+    if not dry_run:
+        for candidate in report['candidates']:
+            for path in candidate['files']:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    logger.warning(f"Could not delete {path}: {str(e)}")
+        report['pruned_directories'] = sum(prune_shards(folder, now) for folder in folders.values())
+        if report['candidates'] or report['pruned_directories']:
+            logger.info(f"Storage GC removed {len(report['candidates'])} items, "
+                        f"{report['reclaimable_bytes']} bytes and {report['pruned_directories']} empty directories")
+
+    for candidate in report['candidates']:
+        candidate['files'] = [os.path.basename(path) for path in candidate['files']]
+    return report
+
+def start_collector(interval, run_pass, lock_path):
+    """Call ``run_pass`` every ``interval`` seconds on a daemon thread.
+
+    Passes only run while this process holds an exclusive lock on
+    ``lock_path``; the other processes try to take it over every interval,
+    so collection resumes when the process holding it exits.
+    """
+    def loop():
+        lock_file = open(lock_path, 'a')
+        locked = False
+        while True:
+            time.sleep(interval)
+            if not locked:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    continue
+                locked = True
+                logger.info(f"Storage GC runs in this process (pid {os.getpid()})")
+            try:
+                run_pass()
+            except Exception as e:
+                logger.error(f"Storage GC pass failed: {str(e)}", exc_info=True)
+
+    thread = threading.Thread(target=loop, name='storage-gc', daemon=True)
+    thread.start()
+    return thread
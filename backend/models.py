@@ -0,0 +1,133 @@
+"""Registry of the models jobs may run, and residency bookkeeping.
+
+Models are configured in a JSON file (``MODELS_CONFIG``)::
+
+    {
+        "default": "omnigen2",
+        "models": {
+            "omnigen2": {"path": "OmniGen2/OmniGen2", "memory_mb": 18000},
+            "portraits": {"path": "/models/omnigen2-portraits", "memory_mb": 18000}
+        }
+    }
+
+Requests name a model by its id (or its path); anything else is rejected,
+so free-form paths never reach the inference command line. Persistent
+workers keep recently used models loaded; ``ResidentModels`` tracks which
+ones and picks the least recently used models to unload when a worker would
+exceed ``MODEL_CACHE_SIZE`` models or ``MODEL_MEMORY_BUDGET_MB``.
+"""
+import os
+import re
+import json
+import logging
+from collections import OrderedDict
+
+logger = logging.getLogger('app.models')
+
+# Relative paths are resolved from the project root, not the working directory
+MODELS_CONFIG = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    os.environ.get('MODELS_CONFIG', 'models.json')
+)
+
+# Models kept loaded per worker (count and memory budget, 0 disables the budget)
+MODEL_CACHE_SIZE = int(os.environ.get('MODEL_CACHE_SIZE', 2))
+MODEL_MEMORY_BUDGET_MB = int(os.environ.get('MODEL_MEMORY_BUDGET_MB', 0))
+
+DEFAULT_REGISTRY = {
+    'default': 'omnigen2',
+    'models': {'omnigen2': {'path': 'OmniGen2/OmniGen2', 'memory_mb': 0}},
+}
+
+MODEL_ID_PATTERN = re.compile(r'^[A-Za-z0-9][A-Za-z0-9._-]*$')
+MODEL_PATH_PATTERN = re.compile(r'^[A-Za-z0-9._/-]+$')
+
+def validate_registry(config):
+    """Check a registry configuration and return ``(default_id, models)``."""
+    models = config.get('models')
+    if not isinstance(models, dict) or not models:
+        raise ValueError("The model registry must define at least one model")
+    registry = {}
+    for model_id, entry in models.items():
+        if not MODEL_ID_PATTERN.match(model_id):
+            raise ValueError(f"Invalid model id: {model_id!r}")
+        path = entry.get('path') if isinstance(entry, dict) else None
+        if not isinstance(path, str) or not MODEL_PATH_PATTERN.match(path):
+            raise ValueError(f"Model {model_id} needs a path without spaces or shell characters")
+        memory_mb = entry.get('memory_mb', 0)
+        if not isinstance(memory_mb, (int, float)) or memory_mb < 0:
+            raise ValueError(f"Model {model_id} has an invalid memory_mb: {memory_mb!r}")
+        registry[model_id] = {'id': model_id, 'path': path, 'memory_mb': memory_mb}
+    default_id = config.get('default', next(iter(registry)))
+    if default_id not in registry:
+        raise ValueError(f"Default model {default_id!r} is not registered")
+    return default_id, registry
+
+def load_registry(path=None):
+    """Read and validate the registry, falling back to the stock OmniGen2 model."""
+    path = path or MODELS_CONFIG
+    if not os.path.exists(path):
+        return validate_registry(DEFAULT_REGISTRY)
+    with open(path) as f:
+        return validate_registry(json.load(f))
+
+_registry = None
+
+def get_registry():
+    """Return ``(default_id, models)``, loading the configuration on first use."""
+    global _registry
+    if _registry is None:
+        _registry = load_registry()
+        logger.info(f"Loaded {len(_registry[1])} models from the model registry")
+    return _registry
+
+def resolve(name):
+    """Return the registry entry for a model id or path (None if unknown)."""
+    default_id, registry = get_registry()
+    if name is None:
+        return registry[default_id]
+    if not isinstance(name, str):
+        return None
+    if name in registry:
+        return registry[name]
+    for entry in registry.values():
+        if entry['path'] == name:
+            return entry
+    return None
+
+class ResidentModels:
+    """Least recently used set of the models loaded in one worker."""
+
+    def __init__(self, max_models=None, budget_mb=None):
+        self.max_models = MODEL_CACHE_SIZE if max_models is None else max_models
+        self.budget_mb = MODEL_MEMORY_BUDGET_MB if budget_mb is None else budget_mb
+        self.models = OrderedDict()
+
+    def __contains__(self, model_id):
+        return model_id in self.models
+
+    def make_room(self, model_id, memory_mb=0):
+        """Mark a model as used and return the ids that must be unloaded before it is loaded.
+
+        The model itself is only recorded by ``add``, once its load is confirmed.
+        """
+        if model_id in self.models:
+            self.models.move_to_end(model_id)
+            return []
+        evicted = []
+        while self.models and (
+                len(self.models) >= max(self.max_models, 1)
+                or (self.budget_mb and sum(self.models.values()) + memory_mb > self.budget_mb)):
+            evicted.append(self.models.popitem(last=False)[0])
+        return evicted
+
+    def add(self, model_id, memory_mb=0):
+        self.models[model_id] = memory_mb
+        self.models.move_to_end(model_id)
+
+    def clear(self):
+        self.models.clear()
+
+    def ids(self):
+        """Return the resident model ids, least recently used first."""
+        return list(self.models)
@@ -0,0 +1,121 @@
+"""Post-processing of generated images.
+
+Once an inference job has finished successfully, its output is handed to a
+small worker pool that writes compressed format variants next to the original
+file (``<uuid>.webp``, ``<uuid>.avif``) and optionally re-encodes the PNG
+itself with optimization enabled. The generation parameters are embedded in
+every file that is written. All of this happens off the request path; image
+serving simply picks the best variant that already exists on disk.
+"""
+import os
+import json
+import logging
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger('app.postprocess')
+
+# Encoder settings for each supported format
+VARIANT_OPTIONS = {
+    'png': {'optimize': True},
+    'webp': {'quality': 85, 'method': 4},
+    'avif': {'quality': 60, 'speed': 6},
+}
+
+# Variants considered during content negotiation, most preferred first
+NEGOTIATED_VARIANTS = [
+    ('avif', 'image/avif'),
+    ('webp', 'image/webp'),
+]
+
+# EXIF tag used to carry the generation parameters in WebP/AVIF files
+EXIF_IMAGE_DESCRIPTION = 0x010E
+
+# Formats to produce after each successful job (empty disables post-processing)
+POSTPROCESS_FORMATS = [
+    fmt.strip().lower()
+    for fmt in os.environ.get('POSTPROCESS_FORMATS', '').split(',')
+    if fmt.strip()
+]
+POSTPROCESS_WORKERS = int(os.environ.get('POSTPROCESS_WORKERS', 2))
+
+_executor = None
+_executor_lock = threading.Lock()
+
+def get_executor():
+    """Return the shared post-processing pool, creating it on first use."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=POSTPROCESS_WORKERS,
+                                           thread_name_prefix='postprocess')
+        return _executor
+
+def variant_path(output_path, fmt):
+    return os.path.splitext(output_path)[0] + '.' + fmt
+
+def submit(output_path, params):
+    """Queue an output for post-processing; returns the future or None."""
+    if not POSTPROCESS_FORMATS:
+        return None
+    return get_executor().submit(process_output, output_path, params, POSTPROCESS_FORMATS)
+
+def process_output(output_path, params, formats):
+    """Write the requested variants of ``output_path`` and return their formats."""
+    from PIL import Image, PngImagePlugin
+
+    metadata = json.dumps(params, sort_keys=True)
+    produced = []
+
+    with Image.open(output_path) as image:
+        image.load()
+        for fmt in formats:
+            if fmt not in VARIANT_OPTIONS:
+                logger.warning(f"Unsupported post-processing format: {fmt}")
+                continue
+
+            options = dict(VARIANT_OPTIONS[fmt])
+            if fmt == 'png':
+                pnginfo = PngImagePlugin.PngInfo()
+                pnginfo.add_text('parameters', metadata)
+                options['pnginfo'] = pnginfo
+            else:
+                exif = Image.Exif()
+                exif[EXIF_IMAGE_DESCRIPTION] = metadata
+                options['exif'] = exif.tobytes()
+
+            # Encode into a temporary file so readers never see a partial variant
+            fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(output_path), suffix='.tmp')
+            os.close(fd)
+            try:
+                image.save(temp_path, format=fmt.upper(), **options)
+                os.replace(temp_path, variant_path(output_path, fmt))
+                produced.append(fmt)
+            except Exception as e:
+                logger.error(f"Error writing {fmt} variant of {output_path}: {str(e)}")
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+
+    logger.info(f"Post-processed {output_path}: {', '.join(produced) or 'no variants'}")
+    return produced
+
+def accepts_explicitly(accept_mimetypes, mimetype):
+    """Check that a client names ``mimetype`` itself rather than via a wildcard."""
+    return any(value == mimetype and quality > 0 for value, quality in accept_mimetypes)
+
+def negotiate_variant(folder, filename, accept_mimetypes):
+    """Return the filename of the best variant the client accepts, or None."""
+    for fmt, mimetype in NEGOTIATED_VARIANTS:
+        candidate = variant_path(filename, fmt)
+        if accepts_explicitly(accept_mimetypes, mimetype) and \
+                os.path.isfile(os.path.join(folder, candidate)):
+            return candidate
+    return None
+
+def remove_variants(output_path):
+    """Delete every compressed variant written for ``output_path``."""
+    for fmt in VARIANT_OPTIONS:
+        path = variant_path(output_path, fmt)
+        if path != output_path and os.path.exists(path):
+            os.remove(path)
@@ -0,0 +1,217 @@
+"""Resource limits and accounting for inference subprocesses.
+
+Limits are applied in the child between ``fork`` and ``exec`` (address
+space rlimit, nice level, CPU affinity) and through its environment (thread
+pool sizes). When a job exits it is reaped with ``wait4`` so that its CPU
+time, peak RSS and block I/O can be reported alongside its status.
+
+On CPU-only hosts the available cores can also be split into disjoint slots.
+Every job then runs on the cores of one slot with its thread pools sized to
+match, so concurrent jobs do not oversubscribe the machine.
+"""
+import os
+import json
+import time
+import resource
+import logging
+import threading
+
+logger = logging.getLogger('app.resources')
+
+# Per-job limits (0 or empty disables a limit)
+JOB_TIMEOUT_SECONDS = int(os.environ.get('JOB_TIMEOUT_SECONDS', 0))
+JOB_MEMORY_LIMIT_MB = int(os.environ.get('JOB_MEMORY_LIMIT_MB', 0))
+JOB_THREADS = int(os.environ.get('JOB_THREADS', 0))
+JOB_NICE = int(os.environ.get('JOB_NICE', 0))
+JOB_CPU_AFFINITY = os.environ.get('JOB_CPU_AFFINITY', '')
+
+# Number of CPU slots ('auto' picks the best count from benchmark results, 0 disables)
+JOB_SLOTS = os.environ.get('JOB_SLOTS', '0').strip().lower()
+# Relative to the project root, not the working directory
+SLOT_BENCHMARK_FILE = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    os.environ.get('SLOT_BENCHMARK_FILE', 'slot_benchmark.json')
+)
+
+# Environment variables that size the thread pools of torch and BLAS backends
+THREAD_ENV_VARS = ('OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'NUMEXPR_NUM_THREADS')
+
+def parse_cpu_list(value):
+    """Parse a CPU list such as ``"0-3,8"`` into a sorted list of CPU ids."""
+    cpus = set()
+    for part in value.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        if '-' in part:
+            start, end = part.split('-', 1)
+            cpus.update(range(int(start), int(end) + 1))
+        else:
+            cpus.add(int(part))
+    return sorted(cpus)
+
+def job_limits():
+    """Return the limits applied to every job, as configured."""
+    return {
+        'timeout_seconds': JOB_TIMEOUT_SECONDS or None,
+        'memory_limit_bytes': JOB_MEMORY_LIMIT_MB * 1024 * 1024 or None,
+        'threads': JOB_THREADS or None,
+        'nice': JOB_NICE or None,
+        'cpus': parse_cpu_list(JOB_CPU_AFFINITY) or None,
+    }
+
+def child_env(limits):
+    """Return the environment for a job, pinning its thread pool sizes."""
+    env = dict(os.environ)
+    if limits['threads']:
+        for name in THREAD_ENV_VARS:
+            env[name] = str(limits['threads'])
+    return env
+
+def make_preexec(limits):
+    """Return a ``preexec_fn`` applying the kernel-side limits, or None.
+
+    Like any ``preexec_fn`` it runs Python code in the forked child, which
+    the subprocess documentation warns can deadlock in a multi-threaded
+    parent. It is kept to three system calls, and None is returned when no
+    limit needs it.
+    """
+    memory_limit = limits['memory_limit_bytes']
+    nice = limits['nice']
+    cpus = limits['cpus']
+    if not (memory_limit or nice or cpus):
+        return None
+
+    def preexec():
+        if memory_limit:
+            resource.setrlimit(resource.RLIMIT_AS, (memory_limit, memory_limit))
+        if nice:
+            os.nice(nice)
+        if cpus:
+            os.sched_setaffinity(0, cpus)
+
+    return preexec
+
+# Held while a child is reaped or signalled, so that a signal never reaches
+# a pid that was already reaped (and may have been reused)
+_reap_lock = threading.Lock()
+
+def wait_with_rusage(process):
+    """Wait for ``process`` and return its exit code and resource usage.
+
+    The job's monitor must be the only caller reaping the child; if it has
+    been reaped elsewhere (e.g. by ``Popen.poll``) the usage is lost and only
+    the exit code is returned. Other code signals the child with
+    ``signal_process`` and waits for the monitor instead.
+    """
+    try:
+        # Wait for the exit without reaping, then reap under the lock
+        os.waitid(os.P_PID, process.pid, os.WEXITED | os.WNOWAIT)
+    except ChildProcessError:
+        return process.wait(), None
+    with _reap_lock:
+        _, status, rusage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(status)
+    return process.returncode, rusage
+
+def signal_process(process, sig):
+    """Send ``sig`` to a child process unless it has been reaped.
+
+    Unlike ``Popen.send_signal`` this never polls, so the child is left for
+    ``wait_with_rusage`` to reap.
+    """
+    with _reap_lock:
+        if process.returncode is None:
+            try:
+                os.kill(process.pid, sig)
+            except ProcessLookupError:
+                pass
+
+def usage_report(rusage, started_at):
+    """Summarize the resource usage of a finished job."""
+    report = {'wall_time_seconds': round(time.monotonic() - started_at, 3)}
+    if rusage is not None:
+        report.update({
+            'cpu_user_seconds': round(rusage.ru_utime, 3),
+            'cpu_system_seconds': round(rusage.ru_stime, 3),
+            # ru_maxrss is reported in kilobytes on Linux
+            'peak_rss_bytes': rusage.ru_maxrss * 1024,
+            'io_read_blocks': rusage.ru_inblock,
+            'io_write_blocks': rusage.ru_oublock,
+        })
+    return report
+
+def partition_cpus(cpus, count):
+    """Split ``cpus`` into ``count`` disjoint, contiguous, near-equal slots."""
+    count = max(1, min(count, len(cpus)))
+    size, extra = divmod(len(cpus), count)
+    slots = []
+    start = 0
+    for index in range(count):
+        end = start + size + (1 if index < extra else 0)
+        slots.append(cpus[start:end])
+        start = end
+    return slots
+
+def choose_slot_count(results, cpu_count):
+    """Pick the slot count with the best measured throughput.
+
+    ``results`` is a list of ``{"slots": N, "throughput": jobs_per_hour}``
+    entries as written by a benchmark run.
+    """
+    valid = [r for r in results if 1 <= int(r['slots']) <= cpu_count]
+    if not valid:
+        return 1
+    return int(max(valid, key=lambda r: float(r['throughput']))['slots'])
+
+def load_slot_count(cpu_count):
+    """Resolve ``JOB_SLOTS`` into a number of slots (0 when disabled)."""
+    if JOB_SLOTS != 'auto':
+        return int(JOB_SLOTS or 0)
+    try:
+        with open(SLOT_BENCHMARK_FILE) as f:
+            results = json.load(f)['results']
+    except (OSError, ValueError, KeyError) as e:
+        logger.warning(f"Could not read slot benchmark results from {SLOT_BENCHMARK_FILE}: {str(e)}")
+        return 1
+    return choose_slot_count(results, cpu_count)
+
+_slots = None
+_slot_owners = {}
+_slot_lock = threading.Lock()
+
+def get_slots():
+    """Return the CPU slots of this host, computing them on first use."""
+    global _slots
+    with _slot_lock:
+        if _slots is None:
+            cpus = sorted(os.sched_getaffinity(0))
+            count = load_slot_count(len(cpus))
+            _slots = partition_cpus(cpus, count) if count > 0 else []
+            if _slots:
+                logger.info(f"Partitioned {len(cpus)} CPUs into {len(_slots)} job slots")
+        return _slots
+
+def acquire_slot(owner):
+    """Reserve a free slot for ``owner`` and return ``(index, cpus)``, or None."""
+    slots = get_slots()
+    with _slot_lock:
+        for index, cpus in enumerate(slots):
+            if index not in _slot_owners.values():
+                _slot_owners[owner] = index
+                return index, cpus
+    return None
+
+def release_slot(owner):
+    with _slot_lock:
+        _slot_owners.pop(owner, None)
+
+def slot_status():
+    """Return the slot occupancy, or None when slots are disabled."""
+    slots = get_slots()
+    if not slots:
+        return None
+    with _slot_lock:
+        busy = len(_slot_owners)
+    return {'total': len(slots), 'free': len(slots) - busy,
+            'cpus_per_slot': [len(cpus) for cpus in slots]}
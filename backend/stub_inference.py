@@ -0,0 +1,121 @@
+"""Stand-in for the OmniGen2 inference script, for benchmarks and replays.
+
+It follows the inference script contract (see the README) without loading a
+model: every denoising step sleeps for ``STUB_STEP_SECONDS``, previews are
+written every ``--preview_interval`` steps and the output is a flat image
+scaled down from the requested size. Loading a model that is not resident
+in ``--worker`` mode costs ``STUB_LOAD_SECONDS``, and a batch of N jobs takes
+``1 + (N - 1) * STUB_BATCH_COST`` times as long as a single job, so launcher
+and scheduler changes can be measured deterministically. Cancelled jobs stop
+at their next step::
+
+    INFERENCE_SCRIPT_PATH=backend/stub_inference.py python app.py
+"""
+import os
+import sys
+import json
+import time
+import queue
+import argparse
+import threading
+
+from PIL import Image
+
+STUB_STEP_SECONDS = float(os.environ.get('STUB_STEP_SECONDS', 0.02))
+STUB_LOAD_SECONDS = float(os.environ.get('STUB_LOAD_SECONDS', 1.0))
+STUB_BATCH_COST = float(os.environ.get('STUB_BATCH_COST', 0.3))
+
+def write_image(path, height, width, shade):
+    """Write a flat grey image; previews are replaced atomically as they are served meanwhile."""
+    temp_path = f'{path}.tmp'
+    Image.new('RGB', (max(int(width), 1), max(int(height), 1)), (shade,) * 3).save(temp_path, format='PNG')
+    os.replace(temp_path, path)
+
+def denoise(steps, height, width, jobs, scale=1.0, cancelled=()):
+    """Sleep through the denoising steps, then write flat images for ``jobs``.
+
+    ``jobs`` are request dicts with an ``output_image_path`` and optionally a
+    ``job_id``, a ``prefix`` for their output lines, ``preview_interval`` and
+    ``preview_image_path``. Jobs whose id shows up in ``cancelled`` are
+    dropped at the next step; their ids are returned.
+    """
+    active = list(jobs)
+    for step in range(1, steps + 1):
+        time.sleep(STUB_STEP_SECONDS * scale)
+        active = [job for job in active if job.get('job_id') not in cancelled]
+        if not active:
+            break
+        for job in active:
+            prefix = job.get('prefix', '')
+            print(f"{prefix}progress: {step * 100 // steps}%", flush=True)
+            interval = job.get('preview_interval') or 0
+            if job.get('preview_image_path') and interval > 0 and step % interval == 0 and step < steps:
+                write_image(job['preview_image_path'], int(height) // 16, int(width) // 16, 255 * step // steps)
+                print(f"{prefix}preview: {step}", flush=True)
+    for job in active:
+        write_image(job['output_image_path'], int(height) // 8, int(width) // 8, 128)
+    return [job.get('job_id') for job in jobs if job not in active]
+
+def read_requests(requests, cancelled):
+    """Queue requests from stdin, noting cancel requests as soon as they arrive."""
+    for line in sys.stdin:
+        request = json.loads(line)
+        if request['action'] == 'cancel':
+            cancelled.add(request['job_id'])
+        else:
+            requests.put(request)
+    requests.put(None)
+
+def serve():
+    """Answer JSON requests on stdin until it is closed (``--worker`` mode)."""
+    loaded = set()
+    requests, cancelled = queue.Queue(), set()
+    threading.Thread(target=read_requests, args=(requests, cancelled), daemon=True).start()
+    for request in iter(requests.get, None):
+        result = 'ok'
+        if request['action'] == 'unload':
+            loaded.discard(request['model_path'])
+        else:
+            if request['model_path'] not in loaded:
+                time.sleep(STUB_LOAD_SECONDS)
+                loaded.add(request['model_path'])
+                print(f"loaded: {request['model_path']}", flush=True)
+            if request['action'] == 'run_batch':
+                jobs = request['jobs']
+                stopped = denoise(int(request['num_inference_step']), request['height'], request['width'],
+                                  [dict(job, prefix=f"[{job['job_id']}] ") for job in jobs],
+                                  1 + (len(jobs) - 1) * STUB_BATCH_COST, cancelled)
+                for job_id in stopped:
+                    print(f"[{job_id}] error: cancelled", flush=True)
+            else:
+                stopped = denoise(int(request['num_inference_step']), request['height'], request['width'],
+                                  [request], cancelled=cancelled)
+                if stopped:
+                    result = 'error cancelled'
+            cancelled.difference_update(stopped)
+        print(f'done: {result}', flush=True)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--worker', action='store_true')
+    parser.add_argument('--model_path')
+    parser.add_argument('--num_inference_step', type=int, default=50)
+    parser.add_argument('--height', type=int, default=1024)
+    parser.add_argument('--width', type=int, default=1024)
+    parser.add_argument('--text_guidance_scale', type=float)
+    parser.add_argument('--image_guidance_scale', type=float)
+    parser.add_argument('--instruction')
+    parser.add_argument('--input_image_path', nargs='+')
+    parser.add_argument('--output_image_path')
+    parser.add_argument('--preview_interval', type=int)
+    parser.add_argument('--preview_image_path')
+    args = parser.parse_args()
+
+    if args.worker:
+        serve()
+    else:
+        time.sleep(STUB_LOAD_SECONDS)
+        denoise(args.num_inference_step, args.height, args.width, [vars(args)])
+
+if __name__ == '__main__':
+    main()
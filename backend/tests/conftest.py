@@ -2,6 +2,7 @@ import os
 import pytest
 import tempfile
 import sys
+import threading
 from unittest.mock import patch, MagicMock
 
 # Add the parent directory to the path so we can import the app
@@ -47,3 +48,36 @@ def mock_subprocess():
         mock_popen.return_value = mock_process
         
         yield mock_popen
+
+@pytest.fixture
+def image_folders(tmp_path, monkeypatch):
+    """Point the app's image folders at temporary directories."""
+    import app as app_module
+    folders = {}
+    for name in ('INPUT_FOLDER', 'OUTPUT_FOLDER', 'PREVIEW_FOLDER'):
+        path = tmp_path / name.split('_')[0].lower()
+        path.mkdir()
+        monkeypatch.setattr(app_module, name, str(path))
+        folders[name] = str(path)
+    return folders
+
+@pytest.fixture
+def active_processes(monkeypatch):
+    """Isolate the in-memory process table for each test."""
+    import app as app_module
+    processes = {}
+    monkeypatch.setattr(app_module, 'active_processes', processes)
+    return processes
+
+@pytest.fixture(autouse=True)
+def history_db(tmp_path, monkeypatch):
+    """Keep the job history of each test in its own database."""
+    import history
+    path = str(tmp_path / 'job_history.db')
+    monkeypatch.setattr(history, 'HISTORY_DB_PATH', path)
+    yield path
+    # Let the monitors of jobs started by the test finish while the
+    # database is still patched
+    for thread in threading.enumerate():
+        if thread.name.startswith('monitor-'):
+            thread.join(timeout=10)
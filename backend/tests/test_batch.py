@@ -0,0 +1,78 @@
+import io
+import json
+import tarfile
+import zipfile
+from unittest.mock import MagicMock
+
+import layout
+
+def write_image(folder, filename, content=b'image'):
+    with open(layout.shard_path(folder, filename), 'wb') as f:
+        f.write(content)
+
+def test_batch_delete(client, image_folders):
+    """Test deleting several images in one call."""
+    write_image(image_folders['OUTPUT_FOLDER'], 'a.png')
+    write_image(image_folders['OUTPUT_FOLDER'], 'a.webp')
+    write_image(image_folders['OUTPUT_FOLDER'], 'b.png')
+
+    response = client.post('/api/images/output/batch-delete',
+                           json={'filenames': ['a.png', 'b.png', 'missing.png', '../x.png']})
+
+    assert response.status_code == 200
+    data = json.loads(response.data)
+    assert data['deleted'] == ['a.png', 'b.png']
+    assert data['not_found'] == ['missing.png', '../x.png']
+    assert json.loads(client.get('/api/images/output').data)['images'] == []
+    assert not list(layout.iter_files(image_folders['OUTPUT_FOLDER']))
+
+def test_batch_delete_validation(client, image_folders):
+    """Test that invalid folders and payloads are rejected."""
+    assert client.post('/api/images/other/batch-delete', json={'filenames': ['a.png']}).status_code == 400
+    assert client.post('/api/images/input/batch-delete', json={'filenames': []}).status_code == 400
+    assert client.post('/api/images/input/batch-delete', json={'filenames': 'a.png'}).status_code == 400
+
+def test_batch_status(client, active_processes):
+    """Test fetching the status of several processes at once."""
+    process = MagicMock()
+    process.poll.return_value = None
+    active_processes['job-1'] = {'process': process, 'status': 'running', 'progress': 30,
+                                 'start_time': '2024-01-01T00:00:00'}
+    active_processes['job-2'] = {'process': process, 'status': 'failed', 'progress': 10,
+                                 'start_time': '2024-01-01T00:00:00', 'error': 'boom'}
+
+    response = client.post('/api/status/batch', json={'process_ids': ['job-1', 'job-2', 'job-3']})
+
+    data = json.loads(response.data)
+    assert data['statuses']['job-1']['progress'] == 30
+    assert data['statuses']['job-2']['error'] == 'boom'
+    assert data['not_found'] == ['job-3']
+
+def test_export_zip(client, image_folders):
+    """Test exporting outputs as a streamed zip archive."""
+    write_image(image_folders['OUTPUT_FOLDER'], 'a.png', b'first')
+    write_image(image_folders['OUTPUT_FOLDER'], 'b.png', b'second')
+
+    response = client.post('/api/images/output/export', json={'filenames': ['a.png', 'b.png', 'a.png']})
+
+    assert response.status_code == 200
+    assert response.is_streamed
+    assert response.mimetype == 'application/zip'
+    archive = zipfile.ZipFile(io.BytesIO(response.data))
+    assert archive.namelist() == ['a.png', 'b.png']
+    assert archive.read('b.png') == b'second'
+
+def test_export_tar(client, image_folders):
+    """Test exporting outputs as a streamed tar archive."""
+    write_image(image_folders['OUTPUT_FOLDER'], 'a.png', b'first')
+
+    response = client.post('/api/images/output/export', json={'filenames': ['a.png'], 'format': 'tar'})
+
+    archive = tarfile.open(fileobj=io.BytesIO(response.data))
+    assert archive.extractfile('a.png').read() == b'first'
+
+def test_export_missing_file(client, image_folders):
+    """Test that missing outputs are reported before streaming starts."""
+    response = client.post('/api/images/output/export', json={'filenames': ['missing.png']})
+
+    assert response.status_code == 404
@@ -0,0 +1,105 @@
+import os
+import json
+import time
+import textwrap
+
+import pytest
+
+import history
+import workers
+
+WORKER_SCRIPT = textwrap.dedent('''
+    import json, sys, time
+    for line in sys.stdin:
+        request = json.loads(line)
+        if request['action'] == 'cancel':
+            continue
+        if request['action'] == 'run':
+            print('single', flush=True)
+            if request['instruction'] == 'sleep':
+                time.sleep(30)
+            open(request['output_image_path'], 'wb').write(b'image')
+        elif request['action'] == 'run_batch':
+            jobs = request['jobs']
+            print(f'batch {len(jobs)} {request["height"]}', flush=True)
+            if any(job['instruction'] == 'slow' for job in jobs):
+                time.sleep(1)
+            for job in jobs:
+                if job['instruction'] == 'fail':
+                    print(f"[{job['job_id']}] error: rejected by safety checker", flush=True)
+                    continue
+                print(f"[{job['job_id']}] progress: 100%", flush=True)
+                open(job['output_image_path'], 'wb').write(job['instruction'].encode())
+        print('done: ok', flush=True)
+''')
+
+@pytest.fixture
+def submit(client, image_folders, active_processes, tmp_path, monkeypatch):
+    """Submit jobs to one batching worker started from a fake worker script."""
+    script = tmp_path / 'inference.py'
+    script.write_text(WORKER_SCRIPT)
+    monkeypatch.setenv('INFERENCE_SCRIPT_PATH', str(script))
+    monkeypatch.setattr(workers, 'INFERENCE_WORKERS', 1)
+    monkeypatch.setattr(workers, 'INFERENCE_BATCH_SIZE', 4)
+    monkeypatch.setattr(workers, 'BATCH_WINDOW_MS', 300)
+    monkeypatch.setattr(workers, '_pool', None)
+    open(os.path.join(image_folders['INPUT_FOLDER'], 'in.png'), 'wb').close()
+
+    def run(instruction='draw', height=1024):
+        response = client.post('/api/execute', json={'input_images': ['in.png'], 'instruction': instruction,
+                                                     'height': height})
+        return json.loads(response.data)
+
+    yield run
+    if workers._pool is not None:
+        workers._pool.shutdown()
+
+def wait_for(active_processes, *process_ids):
+    deadline = time.time() + 20
+    while time.time() < deadline and any(
+            active_processes[pid]['status'] in ('running', 'queued') for pid in process_ids):
+        time.sleep(0.05)
+    return [active_processes[pid] for pid in process_ids]
+
+def test_compatible_jobs_run_as_one_batch(submit, active_processes):
+    """Test that jobs with the same shape are batched and their results split."""
+    responses = [submit('cat'), submit('dog'), submit('fail'), submit('tall', height=512)]
+    assert all(response['status'] == 'queued' for response in responses)
+
+    cat, dog, failed, tall = wait_for(active_processes, *[r['process_id'] for r in responses])
+
+    assert cat['status'] == dog['status'] == 'completed'
+    assert 'batch 3 1024' in cat['output'] and 'batch 3 1024' in dog['output']
+    assert cat['progress'] == dog['progress'] == 100
+    with open(cat['output_path'], 'rb') as f:
+        assert f.read() == b'cat'
+    with open(dog['output_path'], 'rb') as f:
+        assert f.read() == b'dog'
+    assert failed['status'] == 'failed'
+    assert failed['error'].endswith('rejected by safety checker')
+    assert tall['status'] == 'completed'
+    assert 'single' in tall['output']
+
+    durations = history.get_job(responses[0]['process_id'])['durations']
+    assert durations['queue_seconds'] >= 0.2
+
+def test_cancel_queued_and_batched_jobs(client, submit, active_processes):
+    """Test cancelling a queued job and detaching a job from a running batch."""
+    slow, quick = submit('slow'), submit('quick')
+    deadline = time.time() + 5
+    while active_processes[slow['process_id']]['status'] == 'queued' and time.time() < deadline:
+        time.sleep(0.02)
+    pid = active_processes[slow['process_id']]['process'].pid
+    waiting = submit('waiting', height=512)
+    assert history.get_job(slow['process_id'])['status'] == 'running'
+    assert history.get_job(waiting['process_id'])['status'] == 'queued'
+
+    assert json.loads(client.post(f"/api/cancel/{waiting['process_id']}").data)['status'] == 'cancelled'
+    assert json.loads(client.post(f"/api/cancel/{quick['process_id']}").data)['status'] == 'cancelled'
+
+    slow_info, quick_info, waiting_info = wait_for(
+        active_processes, slow['process_id'], quick['process_id'], waiting['process_id'])
+    assert slow_info['status'] == 'completed'
+    assert quick_info['status'] == waiting_info['status'] == 'cancelled'
+    assert 'single' not in waiting_info['output']
+    assert workers._pool.workers[0].process.pid == pid
@@ -0,0 +1,65 @@
+import io
+import json
+
+import changefeed
+
+def upload(client, name='test.png'):
+    response = client.post('/api/upload', data={'file': (io.BytesIO(b'image'), name)},
+                           content_type='multipart/form-data')
+    return json.loads(response.data)['filename']
+
+def test_changes_since_listing(client, image_folders):
+    """Test that uploads and deletes after a listing are returned as changes."""
+    kept = upload(client)
+    version = json.loads(client.get('/api/images/input').data)['version']
+
+    added = upload(client)
+    client.delete(f'/api/images/input/{kept}')
+
+    response = client.get(f'/api/images/input/changes?since={version}')
+
+    assert response.status_code == 200
+    data = json.loads(response.data)
+    assert [(c['action'], c['filename']) for c in data['changes']] == [('added', added), ('removed', kept)]
+    assert data['changes'][0]['size'] == 5
+    assert data['changes'][0]['url'].endswith(f'/api/images/view/input/{added}')
+    assert data['has_more'] is False
+
+    data = json.loads(client.get(f"/api/images/input/changes?since={data['version']}").data)
+    assert data['changes'] == []
+
+def test_changes_are_per_folder_and_collapsed(client, image_folders):
+    """Test that other folders are filtered out and only the latest event per file is kept."""
+    filename = upload(client)
+    client.delete(f'/api/images/input/{filename}')
+    changefeed.record('output', 'added', 'out.png', '2024-01-01T00:00:00', 10)
+
+    data = json.loads(client.get('/api/images/input/changes?since=0').data)
+
+    assert [(c['action'], c['filename']) for c in data['changes']] == [('removed', filename)]
+    assert data['version'] == 3
+
+def test_changes_paging(client, image_folders):
+    """Test that a limited page reports the version to continue from."""
+    for index in range(3):
+        changefeed.record('output', 'added', f'{index}.png', '2024-01-01T00:00:00', 10)
+
+    data = json.loads(client.get('/api/images/output/changes?since=0&limit=2').data)
+    assert [c['filename'] for c in data['changes']] == ['0.png', '1.png']
+    assert data['has_more'] is True
+
+    data = json.loads(client.get(f"/api/images/output/changes?since={data['version']}&limit=2").data)
+    assert [c['filename'] for c in data['changes']] == ['2.png']
+    assert data['has_more'] is False
+
+def test_expired_version_requires_full_listing(client, image_folders, monkeypatch):
+    """Test that versions older than the retained log are rejected."""
+    monkeypatch.setattr(changefeed, 'GALLERY_FEED_RETENTION', 10)
+    for index in range(1000):
+        changefeed.record('output', 'added', f'{index}.png', '2024-01-01T00:00:00', 10)
+
+    assert client.get('/api/images/output/changes?since=5').status_code == 410
+    assert client.get('/api/images/output/changes?since=990').status_code == 200
+    assert client.get('/api/images/output/changes?since=2000').status_code == 410
+    assert client.get('/api/images/output/changes').status_code == 400
+    assert client.get('/api/images/other/changes?since=0').status_code == 400
@@ -0,0 +1,71 @@
+import gzip
+import json
+from types import SimpleNamespace
+
+import compression
+import layout
+
+def write_images(folder, count):
+    for index in range(count):
+        with open(layout.shard_path(folder, f'image-{index}.png'), 'wb') as f:
+            f.write(b'image')
+
+def test_gzip_negotiated_for_large_json(client, image_folders, monkeypatch):
+    """Test that large JSON responses are gzipped when the client accepts it."""
+    monkeypatch.setattr(compression, 'brotli', None)
+    write_images(image_folders['OUTPUT_FOLDER'], 20)
+
+    response = client.get('/api/images/output', headers={'Accept-Encoding': 'gzip, deflate'})
+
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in response.headers['Vary']
+    assert len(json.loads(gzip.decompress(response.data))['images']) == 20
+
+def test_brotli_preferred_when_available(client, image_folders, monkeypatch):
+    """Test that brotli is chosen over gzip when installed and accepted."""
+    monkeypatch.setattr(compression, 'brotli', SimpleNamespace(compress=lambda data, quality: b'br' + data))
+    write_images(image_folders['OUTPUT_FOLDER'], 20)
+
+    response = client.get('/api/images/output', headers={'Accept-Encoding': 'gzip, br'})
+    assert response.headers['Content-Encoding'] == 'br'
+
+    response = client.get('/api/images/output', headers={'Accept-Encoding': 'gzip, br;q=0'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+
+def test_small_and_unaccepted_responses_uncompressed(client, image_folders):
+    """Test that small bodies and clients without Accept-Encoding get plain JSON."""
+    write_images(image_folders['OUTPUT_FOLDER'], 20)
+
+    assert 'Content-Encoding' not in client.get('/api/images/output').headers
+    response = client.get('/api/health/live', headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in response.headers
+
+def test_images_not_compressed(client, image_folders, monkeypatch):
+    """Test that image responses are sent as they are."""
+    monkeypatch.setattr(compression, 'COMPRESS_MIN_BYTES', 1)
+    write_images(image_folders['OUTPUT_FOLDER'], 1)
+
+    response = client.get('/api/images/view/output/image-0.png', headers={'Accept-Encoding': 'gzip'})
+
+    assert response.status_code == 200
+    assert 'Content-Encoding' not in response.headers
+    response.close()
+
+def test_compact_listing(client, image_folders):
+    """Test that the compact shape drops paths and URLs in favour of a base URL."""
+    write_images(image_folders['INPUT_FOLDER'], 2)
+
+    data = json.loads(client.get('/api/images/input?compact=1').data)
+
+    assert data['base_url'] == 'http://localhost/api/images/view/input/'
+    assert sorted(image['filename'] for image in data['images']) == ['image-0.png', 'image-1.png']
+    assert all(set(image) == {'filename', 'size', 'created'} for image in data['images'])
+
+    data = json.loads(client.get('/api/images/input').data)
+    assert 'base_url' not in data
+    assert all(image['url'] == f"http://localhost/api/images/view/input/{image['filename']}" for image in data['images'])
+
+def test_dumps_without_orjson(monkeypatch):
+    """Test the standard library fallback of the compact encoder."""
+    monkeypatch.setattr(compression, 'orjson', None)
+    assert compression.dumps({'a': [1, 2], 'b': 'x'}) == b'{"a":[1,2],"b":"x"}'
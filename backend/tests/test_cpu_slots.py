@@ -0,0 +1,76 @@
+import os
+import json
+from unittest.mock import MagicMock
+
+import pytest
+
+import app as app_module
+import resources
+
+@pytest.fixture
+def two_slots(monkeypatch):
+    """Configure two CPU slots of two cores each."""
+    monkeypatch.setattr(resources, '_slots', [[0, 1], [2, 3]])
+    monkeypatch.setattr(resources, '_slot_owners', {})
+
+def test_partition_cpus():
+    """Test that CPUs are split into disjoint near-equal slots."""
+    assert resources.partition_cpus([0, 1, 2, 3, 4], 2) == [[0, 1, 2], [3, 4]]
+    assert resources.partition_cpus([0, 1], 4) == [[0], [1]]
+
+def test_choose_slot_count_from_benchmark(tmp_path, monkeypatch):
+    """Test auto-tuning the slot count from benchmark results."""
+    results = [{'slots': 1, 'throughput': 10}, {'slots': 4, 'throughput': 25},
+               {'slots': 2, 'throughput': 18}, {'slots': 64, 'throughput': 99}]
+    assert resources.choose_slot_count(results, 8) == 4
+
+    benchmark = tmp_path / 'slot_benchmark.json'
+    benchmark.write_text(json.dumps({'results': results}))
+    monkeypatch.setattr(resources, 'JOB_SLOTS', 'auto')
+    monkeypatch.setattr(resources, 'SLOT_BENCHMARK_FILE', str(benchmark))
+    assert resources.load_slot_count(8) == 4
+
+    monkeypatch.setattr(resources, 'SLOT_BENCHMARK_FILE', str(tmp_path / 'missing.json'))
+    assert resources.load_slot_count(8) == 1
+
+def test_acquire_and_release(two_slots):
+    """Test that slots are handed out once and can be reused after release."""
+    assert resources.acquire_slot('a') == (0, [0, 1])
+    assert resources.acquire_slot('b') == (1, [2, 3])
+    assert resources.acquire_slot('c') is None
+    assert resources.slot_status()['free'] == 0
+
+    resources.release_slot('a')
+    assert resources.acquire_slot('c') == (0, [0, 1])
+
+def test_execute_pins_job_to_slot(client, image_folders, active_processes, two_slots, monkeypatch):
+    """Test that jobs get the affinity and thread count of their slot."""
+    open(os.path.join(image_folders['INPUT_FOLDER'], 'in.png'), 'wb').close()
+    popen = MagicMock()
+    monkeypatch.setattr(app_module.subprocess, 'Popen', popen)
+    monkeypatch.setattr(app_module, 'monitor_process', MagicMock())
+
+    responses = [client.post('/api/execute', json={'input_images': ['in.png']}) for _ in range(3)]
+
+    assert [r.status_code for r in responses] == [200, 200, 503]
+    process_id = json.loads(responses[1].data)['process_id']
+    assert active_processes[process_id]['limits']['cpus'] == [2, 3]
+    assert popen.call_args_list[1][1]['env']['OMP_NUM_THREADS'] == '2'
+    assert popen.call_args_list[1][1]['preexec_fn'] is not None
+
+    ready = json.loads(client.get('/api/health/ready').data)
+    assert ready['max_concurrent_jobs'] == 2
+    assert ready['free_slots'] == 0
+
+def test_monitor_releases_slot(image_folders, active_processes, two_slots):
+    """Test that a finished job gives its slot back."""
+    resources.acquire_slot('job')
+    process = MagicMock()
+    process.pid = os.getpid()
+    process.stdout.readline.return_value = ''
+    process.wait.return_value = 0
+    active_processes['job'] = {'process': process, 'status': 'running', 'output_path': '', 'output': []}
+
+    app_module.monitor_process('job')
+
+    assert resources.slot_status()['free'] == 2
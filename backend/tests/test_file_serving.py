@@ -0,0 +1,54 @@
+import os
+import json
+
+import app as app_module
+import layout
+
+def write_output(image_folders, filename='result.png', content=b'image'):
+    path = layout.shard_path(image_folders['OUTPUT_FOLDER'], filename)
+    with open(path, 'wb') as f:
+        f.write(content)
+    return path
+
+def test_x_accel_redirect(client, image_folders, monkeypatch):
+    """Test that nginx mode returns an internal redirect without a body."""
+    monkeypatch.setattr(app_module, 'FILE_SERVING_MODE', 'x-accel')
+    monkeypatch.setattr(app_module, 'X_ACCEL_PREFIX', '/protected/')
+    path = write_output(image_folders)
+
+    response = client.get('/api/images/view/output/result.png')
+
+    relative_path = os.path.relpath(path, os.path.dirname(image_folders['OUTPUT_FOLDER']))
+    assert response.status_code == 200
+    assert response.headers['X-Accel-Redirect'] == '/protected/' + relative_path.replace(os.sep, '/')
+    assert response.headers['Content-Type'] == 'image/png'
+    assert response.data == b''
+
+def test_x_accel_missing_file(client, image_folders, monkeypatch):
+    """Test that missing files are still reported by the route."""
+    monkeypatch.setattr(app_module, 'FILE_SERVING_MODE', 'x-accel')
+
+    response = client.get('/api/images/view/output/missing.png')
+
+    assert response.status_code == 404
+    assert json.loads(response.data)['error'] == 'Not Found'
+
+def test_x_sendfile(client, image_folders, monkeypatch):
+    """Test that X-Sendfile mode passes the absolute path to the proxy."""
+    monkeypatch.setattr(app_module, 'FILE_SERVING_MODE', 'x-sendfile')
+    monkeypatch.setitem(app_module.app.config, 'USE_X_SENDFILE', True)
+    path = write_output(image_folders)
+
+    response = client.get('/api/images/view/output/result.png')
+
+    assert response.headers['X-Sendfile'] == path
+    assert response.data == b''
+
+def test_direct_mode_streams_file(client, image_folders):
+    """Test that the default mode sends the bytes itself."""
+    write_output(image_folders)
+
+    response = client.get('/api/images/view/output/result.png')
+
+    assert 'X-Accel-Redirect' not in response.headers
+    assert response.data == b'image'
@@ -0,0 +1,92 @@
+import os
+import json
+import time
+import threading
+from collections import namedtuple
+from unittest.mock import MagicMock
+
+import app as app_module
+
+DiskUsage = namedtuple('DiskUsage', ['total', 'used', 'free'])
+
+def test_liveness(client, mocker):
+    """Test that the liveness probe answers without logging."""
+    log = mocker.patch.object(app_module.logger, 'info')
+
+    response = client.get('/api/health/live')
+
+    assert response.status_code == 200
+    assert json.loads(response.data) == {'status': 'ok'}
+    log.assert_not_called()
+
+def test_readiness_reports_capacity(client, image_folders, active_processes, monkeypatch):
+    """Test that readiness reports slots, queue depth and loaded models."""
+    monkeypatch.setattr(app_module, 'MAX_CONCURRENT_JOBS', 2)
+    active_processes['job-1'] = {'status': 'running', 'params': {'model_path': 'OmniGen2/OmniGen2'}}
+    active_processes['job-2'] = {'status': 'queued', 'params': {'model_path': 'OmniGen2/OmniGen2'}}
+    active_processes['job-3'] = {'status': 'completed', 'params': {'model_path': 'other'}}
+
+    response = client.get('/api/health/ready')
+
+    assert response.status_code == 200
+    data = json.loads(response.data)
+    assert data['status'] == 'ready'
+    assert data['free_slots'] == 1
+    assert data['queue_depth'] == 1
+    assert data['loaded_models'] == ['OmniGen2/OmniGen2']
+
+def test_readiness_busy_when_slots_full(client, image_folders, active_processes, monkeypatch):
+    """Test that a full instance reports itself as not ready."""
+    monkeypatch.setattr(app_module, 'MAX_CONCURRENT_JOBS', 1)
+    active_processes['job-1'] = {'status': 'running'}
+
+    response = client.get('/api/health/ready')
+
+    assert response.status_code == 503
+    assert json.loads(response.data)['status'] == 'busy'
+
+def test_readiness_busy_when_disk_full(client, image_folders, active_processes, monkeypatch):
+    """Test that low disk headroom makes the instance not ready."""
+    monkeypatch.setattr(app_module.shutil, 'disk_usage', MagicMock(return_value=DiskUsage(100, 100, 0)))
+
+    response = client.get('/api/health/ready')
+
+    assert response.status_code == 503
+    assert json.loads(response.data)['disk_ok'] is False
+
+def test_execute_rejected_when_slots_full(client, image_folders, active_processes, monkeypatch):
+    """Test that new jobs are refused while all slots are busy."""
+    monkeypatch.setattr(app_module, 'MAX_CONCURRENT_JOBS', 1)
+    active_processes['job-1'] = {'status': 'running'}
+    open(os.path.join(image_folders['INPUT_FOLDER'], 'in.png'), 'wb').close()
+
+    response = client.post('/api/execute', json={'input_images': ['in.png']})
+
+    assert response.status_code == 503
+
+def test_concurrent_submissions_respect_the_limit(image_folders, active_processes, monkeypatch):
+    """Test that requests racing for the last slot start only one job."""
+    monkeypatch.setattr(app_module, 'MAX_CONCURRENT_JOBS', 1)
+    open(os.path.join(image_folders['INPUT_FOLDER'], 'in.png'), 'wb').close()
+
+    def slow_popen(*args, **kwargs):
+        time.sleep(0.2)
+        return MagicMock()
+
+    monkeypatch.setattr(app_module.subprocess, 'Popen', slow_popen)
+    monkeypatch.setattr(app_module, 'monitor_process', MagicMock())
+    statuses = []
+
+    def submit():
+        with app_module.app.test_client() as client:
+            statuses.append(client.post('/api/execute', json={'input_images': ['in.png']}).status_code)
+
+    threads = [threading.Thread(target=submit) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(statuses) == [200, 503, 503, 503]
+    assert len(active_processes) == 1
+    assert not app_module._admissions
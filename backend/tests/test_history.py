@@ -0,0 +1,173 @@
+import os
+import json
+from unittest.mock import MagicMock
+
+import pytest
+
+import app as app_module
+import history
+import layout
+
+PARAMS = {
+    'model_path': 'OmniGen2/OmniGen2',
+    'num_inference_step': 50,
+    'height': 512,
+    'width': 512,
+    'text_guidance_scale': 5.0,
+    'image_guidance_scale': 2.0,
+    'instruction': 'Put the cat on the red sofa',
+    'input_images': ['in.png']
+}
+
+@pytest.fixture
+def input_image(image_folders):
+    path = layout.shard_path(image_folders['INPUT_FOLDER'], 'in.png')
+    with open(path, 'wb') as f:
+        f.write(b'input')
+    return path
+
+@pytest.fixture
+def fake_popen(monkeypatch):
+    """Start jobs without running anything."""
+    popen = MagicMock()
+    monkeypatch.setattr(app_module.subprocess, 'Popen', popen)
+    monkeypatch.setattr(app_module, 'monitor_process', MagicMock())
+    return popen
+
+def record_completed_job(image_folders, process_id='old-job', params=PARAMS, created_at='2024-01-01T00:00:00'):
+    """Store a finished job in the history and create its output."""
+    hashes = [history.hash_file(layout.resolve(image_folders['INPUT_FOLDER'], 'in.png'))]
+    history.record_submission(process_id, params, hashes, f'{process_id}.png', created_at)
+    history.record_completion(process_id, 'completed', created_at, resources={'wall_time_seconds': 12.5})
+    open(layout.shard_path(image_folders['OUTPUT_FOLDER'], f'{process_id}.png'), 'wb').close()
+
+def test_params_key_depends_on_inputs():
+    """Test that the same parameters with other inputs give another key."""
+    assert history.params_key(PARAMS, ['a']) == history.params_key(dict(PARAMS), ['a'])
+    assert history.params_key(PARAMS, ['a']) != history.params_key(PARAMS, ['b'])
+
+def test_execute_records_submission(client, input_image, fake_popen):
+    """Test that submitted jobs are persisted with their inputs' hashes."""
+    response = client.post('/api/execute', json=PARAMS)
+
+    job = history.get_job(json.loads(response.data)['process_id'])
+    assert job['status'] == 'running'
+    assert job['params']['instruction'] == PARAMS['instruction']
+    assert job['input_hashes'] == [history.hash_file(input_image)]
+
+def test_monitor_records_completion(image_folders, active_processes):
+    """Test that the final status and run duration are persisted."""
+    history.record_submission('job', PARAMS, ['hash'], 'job.png', '2024-01-01T00:00:00')
+    process = MagicMock()
+    process.pid = os.getpid()
+    process.stdout.readline.return_value = ''
+    process.wait.return_value = 1
+    active_processes['job'] = {'process': process, 'status': 'running', 'output_path': '',
+                               'output': ['Traceback: boom']}
+
+    app_module.monitor_process('job')
+
+    job = history.get_job('job')
+    assert job['status'] == 'failed'
+    assert job['error'] == 'Traceback: boom'
+    assert job['finished_at'] is not None
+    assert 'run_seconds' in job['durations']
+
+def test_completion_and_search(image_folders, input_image):
+    """Test full-text and parameter queries over finished jobs."""
+    record_completed_job(image_folders, 'job-1')
+    record_completed_job(image_folders, 'job-2', dict(PARAMS, instruction='A dog in the snow', height=1024),
+                         created_at='2024-02-01T00:00:00')
+
+    assert [j['process_id'] for j in history.search(text='sofa cat')] == ['job-1']
+    assert [j['process_id'] for j in history.search(filters={'height': 1024})] == ['job-2']
+    assert [j['process_id'] for j in history.search(since='2024-01-15')] == ['job-2']
+    assert history.get_job('job-1')['durations'] == {'run_seconds': 12.5}
+    assert history.search(text='"unbalanced') == []
+
+def test_history_endpoints(client, image_folders, input_image):
+    """Test searching and fetching jobs through the API."""
+    record_completed_job(image_folders)
+
+    data = json.loads(client.get('/api/history?q=sofa&width=512').data)
+    assert [job['process_id'] for job in data['jobs']] == ['old-job']
+    assert data['jobs'][0]['output_url'].endswith('/api/images/view/output/old-job.png')
+
+    assert json.loads(client.get('/api/history/old-job').data)['status'] == 'completed'
+    assert client.get('/api/history/missing').status_code == 404
+
+def test_status_falls_back_to_history(client, image_folders, input_image, active_processes):
+    """Test that finished jobs stay queryable after the process table is gone."""
+    record_completed_job(image_folders)
+
+    data = json.loads(client.get('/api/status/old-job').data)
+
+    assert data['status'] == 'completed'
+    assert data['progress'] == 100
+    assert data['output_url'].endswith('/api/images/view/output/old-job.png')
+
+def test_jobs_of_previous_run_are_marked_interrupted(client, image_folders, input_image, active_processes,
+                                                     monkeypatch):
+    """Test that jobs left running by a previous server run are reported as failed."""
+    hashes = [history.hash_file(input_image)]
+    history.record_submission('lost-job', PARAMS, hashes, 'lost-job.png', '2024-01-01T00:00:00')
+    history.record_submission('new-job', PARAMS, hashes, 'new-job.png', '2099-01-01T00:00:00')
+    monkeypatch.setattr(app_module, '_initialized', False)
+    monkeypatch.setattr(app_module, 'configure_logging', lambda: None)
+    monkeypatch.setattr(app_module, 'STORAGE_GC_INTERVAL', 0)
+
+    # Worker processes start while their siblings run jobs: they leave the history alone
+    app_module.initialize()
+    assert history.get_job('lost-job')['status'] == 'running'
+
+    app_module.recover_interrupted_jobs()
+
+    data = json.loads(client.get('/api/status/lost-job').data)
+    assert data['status'] == 'failed'
+    assert data['error'] == 'Interrupted by a server restart'
+    assert history.get_job('lost-job')['finished_at'] is not None
+    assert history.get_job('new-job')['status'] == 'running'
+
+def test_find_and_reuse_previous_result(client, image_folders, input_image, fake_popen):
+    """Test that identical requests can reuse an earlier output."""
+    record_completed_job(image_folders)
+
+    matches = json.loads(client.post('/api/history/find', json=PARAMS).data)['matches']
+    assert [job['process_id'] for job in matches] == ['old-job']
+
+    data = json.loads(client.post('/api/execute', json=dict(PARAMS, reuse_previous=True)).data)
+    assert data == {'process_id': 'old-job', 'status': 'completed',
+                    'output_filename': 'old-job.png', 'reused': True}
+    fake_popen.assert_not_called()
+
+    # Without the opt-in, or with other parameters, the job runs again
+    client.post('/api/execute', json=dict(PARAMS, reuse_previous=True, height=768))
+    client.post('/api/execute', json=PARAMS)
+    assert fake_popen.call_count == 2
+
+def test_rerun(client, image_folders, input_image, fake_popen):
+    """Test starting a new job with the parameters of an old one."""
+    record_completed_job(image_folders)
+
+    response = client.post('/api/history/old-job/rerun')
+
+    assert response.status_code == 200
+    job = history.get_job(json.loads(response.data)['process_id'])
+    assert job['params'] == PARAMS
+    assert client.post('/api/history/missing/rerun').status_code == 404
+
+def test_cancelled_job_is_recorded_as_cancelled(client, active_processes):
+    """Test that a job terminated by the cancel endpoint is not stored as failed."""
+    history.record_submission('job', PARAMS, ['hash'], 'job.png', '2024-01-01T00:00:00')
+    process = MagicMock()
+    process.pid = os.getpid()
+    process.stdout.readline.return_value = ''
+    process.wait.return_value = -15
+    active_processes['job'] = {'process': process, 'status': 'running', 'output_path': '', 'output': []}
+
+    assert client.post('/api/cancel/job').status_code == 200
+    active_processes['job']['status'] = 'running'  # monitor observes the exit before the flag is cleared
+    app_module.monitor_process('job')
+
+    assert active_processes['job']['status'] == 'cancelled'
+    assert history.get_job('job')['status'] == 'cancelled'
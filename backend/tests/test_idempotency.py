@@ -0,0 +1,83 @@
+import os
+import json
+import threading
+
+import idempotency
+
+PAYLOAD = {'input_images': ['in.png'], 'instruction': 'draw a cat'}
+
+def submit(client, payload=PAYLOAD, key='retry-1'):
+    return client.post('/api/execute', json=payload, headers={'Idempotency-Key': key})
+
+def test_retry_returns_original_process(client, image_folders, active_processes, mock_subprocess):
+    """Test that a retried submission returns the first job instead of starting another."""
+    mock_subprocess.return_value.pid = os.getpid()
+    open(os.path.join(image_folders['INPUT_FOLDER'], 'in.png'), 'wb').close()
+
+    first = submit(client)
+    retry = submit(client, dict(reversed(list(PAYLOAD.items()))))
+    other = submit(client, key='retry-2')
+
+    assert first.status_code == retry.status_code == 200
+    assert json.loads(retry.data) == json.loads(first.data)
+    assert retry.headers['Idempotent-Replayed'] == 'true'
+    cross_origin = client.post('/api/execute', json=PAYLOAD,
+                               headers={'Idempotency-Key': 'retry-1', 'Origin': 'http://localhost:8080'})
+    assert 'Idempotent-Replayed' in cross_origin.headers['Access-Control-Expose-Headers']
+    assert json.loads(other.data)['process_id'] != json.loads(first.data)['process_id']
+    assert mock_subprocess.call_count == 2
+    assert len(active_processes) == 2
+
+def test_key_reused_with_other_payload(client, image_folders, active_processes, mock_subprocess):
+    """Test that a key can't be replayed for a different request."""
+    mock_subprocess.return_value.pid = os.getpid()
+    open(os.path.join(image_folders['INPUT_FOLDER'], 'in.png'), 'wb').close()
+    submit(client)
+
+    response = submit(client, dict(PAYLOAD, instruction='draw a dog'))
+
+    assert response.status_code == 422
+    assert mock_subprocess.call_count == 1
+
+def test_failed_submission_releases_key(client, image_folders, active_processes, mock_subprocess):
+    """Test that a rejected submission is handled again when retried."""
+    mock_subprocess.return_value.pid = os.getpid()
+
+    assert submit(client).status_code == 404
+    open(os.path.join(image_folders['INPUT_FOLDER'], 'in.png'), 'wb').close()
+    response = submit(client)
+
+    assert response.status_code == 200
+    assert 'Idempotent-Replayed' not in response.headers
+    assert mock_subprocess.call_count == 1
+
+def test_retry_waits_for_request_in_progress(client, history_db, monkeypatch):
+    """Test that a retry waits for the first request, and gives up with 409."""
+    monkeypatch.setattr(idempotency, 'IDEMPOTENCY_WAIT_SECONDS', 0.3)
+    fingerprint = idempotency.fingerprint(PAYLOAD)
+    assert idempotency.claim('retry-1', fingerprint) is None
+
+    response = submit(client)
+    assert response.status_code == 409
+    assert response.headers['Retry-After'] == '1'
+
+    body = json.dumps({'process_id': 'first', 'status': 'started'})
+    threading.Timer(0.1, idempotency.complete, args=('retry-1', 200, body)).start()
+    response = submit(client)
+    assert response.status_code == 200
+    assert json.loads(response.data)['process_id'] == 'first'
+
+def test_expired_and_stale_keys_are_reused(history_db, monkeypatch):
+    """Test that keys past the TTL and abandoned claims can be claimed again."""
+    fingerprint = idempotency.fingerprint(PAYLOAD)
+    assert idempotency.claim('done', fingerprint) is None
+    idempotency.complete('done', 200, '{}')
+    assert idempotency.claim('abandoned', fingerprint) is None
+    assert idempotency.claim('done', fingerprint) == (200, '{}')
+
+    monkeypatch.setattr(idempotency, 'STALE_CLAIM_SECONDS', -1)
+    assert idempotency.claim('abandoned', idempotency.fingerprint({})) is None
+    assert idempotency.claim('done', fingerprint) == (200, '{}')
+
+    monkeypatch.setattr(idempotency, 'IDEMPOTENCY_TTL_SECONDS', -1)
+    assert idempotency.claim('done', fingerprint) is None
@@ -0,0 +1,71 @@
+import io
+import os
+import json
+from unittest.mock import MagicMock
+
+import app as app_module
+import layout
+
+def test_shard_path_uses_stem_hash(tmp_path):
+    """Test that variants of an image share its shard directory."""
+    png = layout.shard_path(str(tmp_path), 'abc.png')
+    webp = layout.shard_path(str(tmp_path), 'abc.webp')
+
+    assert os.path.dirname(png) == os.path.dirname(webp)
+    assert len(os.path.relpath(png, tmp_path).split(os.sep)) == layout.SHARD_DEPTH + 1
+    assert os.path.isdir(os.path.dirname(png))
+
+def test_resolve_falls_back_to_flat_layout(tmp_path):
+    """Test that files from before the migration are still found."""
+    flat = tmp_path / 'old.png'
+    flat.write_bytes(b'old')
+
+    assert layout.resolve(str(tmp_path), 'old.png') == str(flat)
+    assert layout.resolve(str(tmp_path), 'new.png') == os.path.join(
+        layout.shard_dir(str(tmp_path), 'new.png'), 'new.png')
+
+def test_migrate_moves_flat_files(tmp_path):
+    """Test that the migration shards top-level files and is idempotent."""
+    (tmp_path / 'a.png').write_bytes(b'a')
+    (tmp_path / '.gitkeep').write_bytes(b'')
+
+    assert layout.migrate(str(tmp_path)) == 1
+    assert layout.migrate(str(tmp_path)) == 0
+    assert os.path.exists(os.path.join(layout.shard_dir(str(tmp_path), 'a.png'), 'a.png'))
+    assert os.path.exists(tmp_path / '.gitkeep')
+
+def test_upload_list_serve_and_delete_sharded(client, image_folders):
+    """Test the image endpoints end to end with the sharded layout."""
+    response = client.post('/api/upload', data={'file': (io.BytesIO(b'content'), 'cat.png')},
+                           content_type='multipart/form-data')
+    filename = json.loads(response.data)['filename']
+    assert os.path.exists(os.path.join(layout.shard_dir(image_folders['INPUT_FOLDER'], filename), filename))
+
+    with open(os.path.join(image_folders['INPUT_FOLDER'], 'flat.png'), 'wb') as f:
+        f.write(b'flat')
+    images = json.loads(client.get('/api/images/input').data)['images']
+    assert sorted(image['filename'] for image in images) == sorted([filename, 'flat.png'])
+
+    assert client.get(f'/api/images/view/input/{filename}').data == b'content'
+    assert client.get('/api/images/view/input/flat.png').data == b'flat'
+
+    assert client.delete(f'/api/images/input/{filename}').status_code == 200
+    assert client.delete('/api/images/input/flat.png').status_code == 200
+    assert json.loads(client.get('/api/images/input').data)['images'] == []
+
+def test_execute_writes_output_into_shard(client, image_folders, active_processes, monkeypatch):
+    """Test that inputs are resolved and the output is placed in its shard."""
+    input_path = layout.shard_path(image_folders['INPUT_FOLDER'], 'in.png')
+    open(input_path, 'wb').close()
+    process = MagicMock()
+    process.stdout.readline.return_value = ''
+    popen = MagicMock(return_value=process)
+    monkeypatch.setattr(app_module.subprocess, 'Popen', popen)
+
+    response = client.post('/api/execute', json={'input_images': ['in.png']})
+
+    output_filename = json.loads(response.data)['output_filename']
+    args = popen.call_args[0][0]
+    assert args[args.index('--input_image_path') + 1] == input_path
+    assert args[args.index('--output_image_path') + 1] == os.path.join(
+        layout.shard_dir(image_folders['OUTPUT_FOLDER'], output_filename), output_filename)
@@ -0,0 +1,128 @@
+import os
+import json
+import time
+
+import history
+import lifecycle
+
+def make_file(folder, name, size=10, age=0):
+    """Create a file of ``size`` bytes last used ``age`` seconds ago."""
+    path = os.path.join(folder, name)
+    with open(path, 'wb') as f:
+        f.write(b'x' * size)
+    stamp = time.time() - age
+    os.utime(path, (stamp, stamp))
+    return path
+
+def test_ttl_expires_old_items(tmp_path):
+    """Test that items older than the TTL are deleted."""
+    old = make_file(tmp_path, 'old.png', age=7200)
+    new = make_file(tmp_path, 'new.png')
+    policy = {'quota_bytes': 0, 'ttl_seconds': 3600}
+
+    report = lifecycle.collect({'input': str(tmp_path)}, {'input': policy}, {}, [], dry_run=False)
+
+    assert [c['name'] for c in report['candidates']] == ['old']
+    assert report['candidates'][0]['reason'] == 'expired'
+    assert not os.path.exists(old)
+    assert os.path.exists(new)
+
+def test_quota_evicts_least_recently_used_unreferenced(tmp_path):
+    """Test LRU eviction that skips referenced items and groups variants."""
+    make_file(tmp_path, 'a.png', size=100, age=300)
+    make_file(tmp_path, 'a.webp', size=50, age=300)
+    make_file(tmp_path, 'b.png', size=100, age=200)
+    make_file(tmp_path, 'c.png', size=100, age=100)
+    policy = {'quota_bytes': 150, 'ttl_seconds': 0}
+
+    report = lifecycle.collect({'output': str(tmp_path)}, {'output': policy},
+                               {'output': {'a'}}, [], dry_run=False)
+
+    assert [c['name'] for c in report['candidates']] == ['b', 'c']
+    assert sorted(os.listdir(tmp_path)) == ['a.png', 'a.webp']
+
+def test_recent_access_protects_from_eviction(tmp_path):
+    """Test that serving a file counts as using it."""
+    a = make_file(tmp_path, 'a.png', size=100, age=300)
+    make_file(tmp_path, 'b.png', size=100, age=200)
+    mtime = os.stat(a).st_mtime_ns
+    lifecycle.touch(a)
+    policy = {'quota_bytes': 100, 'ttl_seconds': 0}
+
+    report = lifecycle.collect({'output': str(tmp_path)}, {'output': policy}, {}, [])
+
+    assert [c['name'] for c in report['candidates']] == ['b']
+    assert os.stat(a).st_mtime_ns == mtime
+
+def test_dry_run_and_batches(tmp_path):
+    """Test that dry runs keep files and passes are bounded by the batch size."""
+    for name in ('a.png', 'b.png', 'c.png'):
+        make_file(tmp_path, name, age=7200)
+    policies = {'input': {'quota_bytes': 0, 'ttl_seconds': 60}}
+
+    report = lifecycle.collect({'input': str(tmp_path)}, policies, {}, [])
+    assert len(report['candidates']) == 3
+    assert len(os.listdir(tmp_path)) == 3
+
+    lifecycle.collect({'input': str(tmp_path)}, policies, {}, [], dry_run=False, batch_size=2)
+    assert len(os.listdir(tmp_path)) == 1
+
+def test_stale_temporary_files_are_removed(tmp_path):
+    """Test that abandoned temporary files are cleaned up."""
+    make_file(tmp_path, 'tmpabc.tmp', age=lifecycle.TEMP_FILE_GRACE_SECONDS + 10)
+    make_file(tmp_path, 'tmpdef.tmp')
+
+    report = lifecycle.collect({'output': str(tmp_path)}, {}, {}, [], dry_run=False)
+
+    assert [c['reason'] for c in report['candidates']] == ['partial']
+    assert os.listdir(tmp_path) == ['tmpdef.tmp']
+
+def test_report_endpoint(client, image_folders, active_processes):
+    """Test the dry-run report with failed outputs, orphan previews and running jobs."""
+    failed = make_file(image_folders['OUTPUT_FOLDER'], 'failed.png')
+    make_file(image_folders['OUTPUT_FOLDER'], 'running.png')
+    make_file(image_folders['PREVIEW_FOLDER'], 'gone.png')
+    make_file(image_folders['PREVIEW_FOLDER'], 'job-2.png')
+    active_processes['job-1'] = {'status': 'failed', 'output_path': failed}
+    active_processes['job-2'] = {'status': 'running', 'output_filename': 'running.png',
+                                 'params': {'input_images': []}}
+    # Running in another server process
+    make_file(image_folders['PREVIEW_FOLDER'], 'job-3.png')
+    history.record_submission('job-3', {'input_images': []}, [], 'sibling.png', '2024-01-01T00:00:00')
+
+    response = client.get('/api/storage/gc/report')
+
+    assert response.status_code == 200
+    data = json.loads(response.data)
+    assert data['dry_run'] is True
+    reasons = {(c['folder'], c['name']): c['reason'] for c in data['candidates']}
+    assert reasons == {('output', 'failed'): 'failed_job', ('preview', 'gone'): 'orphan'}
+    assert data['folders']['output']['items'] == 2
+    assert os.path.exists(failed)
+
+def test_empty_shards_are_pruned(tmp_path):
+    """Test that empty shard directories are removed unless they were just used."""
+    stale = time.time() - lifecycle.TEMP_FILE_GRACE_SECONDS - 10
+    for shard in ('ab/cd', 'ab/ef', '12/34', '56/78'):
+        os.makedirs(tmp_path / shard)
+    make_file(tmp_path / 'ab' / 'cd', 'old.png', age=7200)
+    for shard in ('ab/ef', 'ab', '12/34', '12', '56'):
+        os.utime(tmp_path / shard, (stale, stale))
+    policy = {'quota_bytes': 0, 'ttl_seconds': 3600}
+
+    report = lifecycle.collect({'input': str(tmp_path)}, {'input': policy}, {}, [], dry_run=False)
+
+    assert report['pruned_directories'] == 3
+    # ab/cd was emptied by this pass and 56/78 was just handed out
+    assert sorted(os.listdir(tmp_path)) == ['56', 'ab']
+    assert os.listdir(tmp_path / 'ab') == ['cd']
+
+def test_collector_runs_in_one_process(tmp_path):
+    """Test that only the collector holding the lock file runs passes."""
+    passes = [[], []]
+    for runs in passes:
+        lifecycle.start_collector(0.02, lambda runs=runs: runs.append(1), str(tmp_path / 'gc.lock'))
+
+    time.sleep(0.3)
+
+    assert sorted(len(runs) > 0 for runs in passes) == [False, True]
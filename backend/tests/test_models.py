@@ -0,0 +1,205 @@
+import os
+import json
+import time
+import textwrap
+
+import pytest
+
+import models
+import workers
+
+WORKER_SCRIPT = textwrap.dedent('''
+    import json, select, sys, time
+    assert '--worker' in sys.argv
+    loaded = []
+    for line in iter(sys.stdin.readline, ''):
+        request = json.loads(line)
+        if request['action'] == 'cancel':
+            continue
+        if request['action'] == 'unload':
+            if request['model_path'] in loaded:
+                loaded.remove(request['model_path'])
+        else:
+            if request['instruction'] == 'fail':
+                print('done: error out of memory', flush=True)
+                continue
+            if request['model_path'] not in loaded:
+                loaded.append(request['model_path'])
+                print('loaded: ' + request['model_path'], flush=True)
+            if request['instruction'] == 'sleep':
+                # Run until the job is cancelled
+                select.select([sys.stdin], [], [], 30)
+                assert json.loads(sys.stdin.readline())['job_id'] == request['job_id']
+                print('done: error cancelled', flush=True)
+                continue
+            if request['instruction'] == 'hang':
+                time.sleep(30)
+            print('progress: 100%', flush=True)
+            open(request['output_image_path'], 'wb').write(b'image')
+        print('done: ok', flush=True)
+''')
+
+REGISTRY = {
+    'default': 'omnigen2',
+    'models': {
+        'omnigen2': {'path': 'OmniGen2/OmniGen2', 'memory_mb': 100},
+        'portraits': {'path': '/models/portraits', 'memory_mb': 100},
+    },
+}
+
+@pytest.fixture
+def registry(tmp_path, monkeypatch):
+    """Configure a registry with two models."""
+    path = tmp_path / 'models.json'
+    path.write_text(json.dumps(REGISTRY))
+    monkeypatch.setattr(models, 'MODELS_CONFIG', str(path))
+    monkeypatch.setattr(models, '_registry', None)
+
+@pytest.fixture
+def run_job(client, image_folders, active_processes, registry, tmp_path, monkeypatch):
+    """Run jobs on persistent workers started from a fake worker script."""
+    script = tmp_path / 'inference.py'
+    script.write_text(WORKER_SCRIPT)
+    monkeypatch.setenv('INFERENCE_SCRIPT_PATH', str(script))
+    monkeypatch.setattr(workers, 'INFERENCE_WORKERS', 2)
+    monkeypatch.setattr(models, 'MODEL_CACHE_SIZE', 1)
+    monkeypatch.setattr(workers, '_pool', None)
+    open(os.path.join(image_folders['INPUT_FOLDER'], 'in.png'), 'wb').close()
+
+    def run(model, instruction='draw', wait=True):
+        response = client.post('/api/execute', json={'input_images': ['in.png'], 'model_path': model,
+                                                     'instruction': instruction})
+        process_id = json.loads(response.data)['process_id']
+        deadline = time.time() + 20
+        while wait and active_processes[process_id]['status'] == 'running' and time.time() < deadline:
+            time.sleep(0.05)
+        return process_id, active_processes[process_id]
+
+    yield run
+    if workers._pool is not None:
+        workers._pool.shutdown()
+
+def test_registry_validation(registry):
+    """Test that invalid registries are rejected."""
+    with pytest.raises(ValueError):
+        models.validate_registry({'models': {}})
+    with pytest.raises(ValueError):
+        models.validate_registry({'models': {'a': {'path': 'x; rm -rf /'}}})
+    with pytest.raises(ValueError):
+        models.validate_registry({'default': 'b', 'models': {'a': {'path': 'x'}}})
+
+    assert models.resolve('portraits')['path'] == '/models/portraits'
+    assert models.resolve('/models/portraits')['id'] == 'portraits'
+    assert models.resolve(None)['id'] == 'omnigen2'
+    assert models.resolve('other') is None
+
+def test_resident_models_evict_least_recently_used():
+    """Test eviction by model count and by memory budget."""
+    def use(resident, model_id, memory_mb=0):
+        evicted = resident.make_room(model_id, memory_mb)
+        resident.add(model_id, memory_mb)
+        return evicted
+
+    resident = models.ResidentModels(max_models=2, budget_mb=0)
+    assert use(resident, 'a') == []
+    assert use(resident, 'b') == []
+    assert use(resident, 'a') == []
+    assert resident.make_room('c') == ['b']
+    assert resident.ids() == ['a']
+    resident.add('c')
+    assert resident.ids() == ['a', 'c']
+
+    resident = models.ResidentModels(max_models=3, budget_mb=100)
+    use(resident, 'a', 60)
+    use(resident, 'b', 30)
+    assert use(resident, 'c', 50) == ['a']
+    assert resident.ids() == ['b', 'c']
+
+def test_unknown_model_rejected(client, image_folders, registry):
+    """Test that only registered models can be requested."""
+    open(os.path.join(image_folders['INPUT_FOLDER'], 'in.png'), 'wb').close()
+
+    response = client.post('/api/execute', json={'input_images': ['in.png'], 'model_path': '/tmp/evil'})
+
+    assert response.status_code == 400
+    assert 'omnigen2, portraits' in json.loads(response.data)['error']
+
+    response = client.post('/api/execute', json={'input_images': ['in.png'], 'model_path': ['omnigen2']})
+
+    assert response.status_code == 400
+
+def test_models_endpoint(client, registry):
+    """Test listing the registered models."""
+    data = json.loads(client.get('/api/models').data)
+
+    assert data['default'] == 'omnigen2'
+    assert [model['id'] for model in data['models']] == ['omnigen2', 'portraits']
+
+def test_workers_keep_models_resident(client, run_job):
+    """Test that jobs are routed to the worker that has their model loaded."""
+    _, first = run_job('omnigen2')
+    _, second = run_job('portraits')
+    _, third = run_job('omnigen2')
+
+    assert first['status'] == second['status'] == third['status'] == 'completed'
+    assert 'loaded: OmniGen2/OmniGen2' in first['output']
+    assert 'loaded: /models/portraits' in second['output']
+    assert third['output'] == ['progress: 100%']
+    assert os.path.exists(third['output_path'])
+
+    data = json.loads(client.get('/api/models').data)
+    assert sorted(w['resident_models'] for w in data['workers']) == [['omnigen2'], ['portraits']]
+
+def test_worker_evicts_and_reports_errors(client, run_job, monkeypatch):
+    """Test eviction within a worker and models that fail to load."""
+    monkeypatch.setattr(workers, 'INFERENCE_WORKERS', 1)
+
+    run_job('omnigen2')
+    _, failed = run_job('/models/portraits', instruction='fail')
+    data = json.loads(client.get('/api/models').data)
+    assert data['workers'][0]['resident_models'] == []
+    _, reloaded = run_job('omnigen2')
+
+    assert failed['status'] == 'failed'
+    assert failed['error'].endswith('out of memory')
+    assert 'loaded: /models/portraits' not in failed['output']
+    assert reloaded['status'] == 'completed'
+    assert 'loaded: OmniGen2/OmniGen2' in reloaded['output']
+
+    data = json.loads(client.get('/api/models').data)
+    assert data['workers'][0]['resident_models'] == ['omnigen2']
+
+def start_job(run_job, instruction):
+    process_id, info = run_job('omnigen2', instruction=instruction, wait=False)
+    deadline = time.time() + 10
+    while 'loaded: OmniGen2/OmniGen2' not in info['output'] and time.time() < deadline:
+        time.sleep(0.02)
+    return process_id, info
+
+def test_cancel_keeps_worker_and_models(client, run_job):
+    """Test that a cancelled job is stopped over the protocol, keeping its worker."""
+    process_id, info = start_job(run_job, 'sleep')
+    pid = info['process'].pid
+
+    response = client.post(f'/api/cancel/{process_id}')
+
+    assert json.loads(response.data)['status'] == 'cancelled'
+    assert info['finished'].wait(5)
+    data = json.loads(client.get('/api/models').data)
+    worker = next(worker for worker in data['workers'] if worker['pid'] == pid)
+    assert worker['resident_models'] == ['omnigen2']
+    assert all(worker['job_id'] is None for worker in data['workers'])
+
+def test_cancel_kills_unresponsive_worker(client, run_job, monkeypatch):
+    """Test that a worker that ignores the cancel request is killed and restarted."""
+    monkeypatch.setattr(workers, 'WORKER_CANCEL_GRACE_SECONDS', 0.2)
+    process_id, info = start_job(run_job, 'hang')
+    pid = info['process'].pid
+
+    response = client.post(f'/api/cancel/{process_id}')
+
+    assert json.loads(response.data)['status'] == 'cancelled'
+    assert info['finished'].wait(5)
+    data = json.loads(client.get('/api/models').data)
+    assert pid not in [worker['pid'] for worker in data['workers']]
+    assert all(worker['job_id'] is None for worker in data['workers'])
@@ -0,0 +1,93 @@
+import os
+import json
+from unittest.mock import MagicMock
+
+import pytest
+from PIL import Image
+
+import app as app_module
+import postprocess
+
+PARAMS = {'instruction': 'A cat in the street', 'num_inference_step': 50}
+
+@pytest.fixture
+def output_image(image_folders):
+    """Create a small generated image in the output folder."""
+    path = os.path.join(image_folders['OUTPUT_FOLDER'], 'result.png')
+    Image.new('RGB', (16, 16), (200, 50, 50)).save(path)
+    return path
+
+def test_process_output_writes_variants_with_metadata(output_image):
+    """Test that variants are written and carry the generation parameters."""
+    produced = postprocess.process_output(output_image, PARAMS, ['png', 'webp', 'bogus'])
+
+    assert produced == ['png', 'webp']
+    with Image.open(output_image) as image:
+        assert json.loads(image.text['parameters']) == PARAMS
+    with Image.open(postprocess.variant_path(output_image, 'webp')) as image:
+        description = image.getexif()[postprocess.EXIF_IMAGE_DESCRIPTION]
+        assert json.loads(description) == PARAMS
+    assert not [f for f in os.listdir(os.path.dirname(output_image)) if f.endswith('.tmp')]
+
+def test_submit_is_disabled_without_formats(output_image, monkeypatch):
+    """Test that nothing is queued when no formats are configured."""
+    monkeypatch.setattr(postprocess, 'POSTPROCESS_FORMATS', [])
+    assert postprocess.submit(output_image, PARAMS) is None
+
+def test_serve_output_negotiates_variant(client, output_image):
+    """Test that the best explicitly accepted variant is served."""
+    postprocess.process_output(output_image, PARAMS, ['webp'])
+
+    response = client.get('/api/images/view/output/result.png',
+                          headers={'Accept': 'image/avif,image/webp,*/*'})
+    assert response.headers['Content-Type'] == 'image/webp'
+    assert 'Accept' in response.headers['Vary']
+
+    response = client.get('/api/images/view/output/result.png', headers={'Accept': '*/*'})
+    assert response.headers['Content-Type'] == 'image/png'
+
+def test_delete_output_removes_variants(client, output_image):
+    """Test that deleting an output also deletes its variants."""
+    postprocess.process_output(output_image, PARAMS, ['webp'])
+
+    response = client.delete('/api/images/output/result.png')
+
+    assert response.status_code == 200
+    assert os.listdir(os.path.dirname(output_image)) == []
+
+def test_monitor_submits_completed_output(image_folders, active_processes, monkeypatch):
+    """Test that a successful exit queues the output for post-processing."""
+    submit = MagicMock()
+    monkeypatch.setattr(postprocess, 'submit', submit)
+    process = MagicMock()
+    process.stdout.readline.return_value = ''
+    process.pid = os.getpid()  # not a child, so wait4 falls back to wait()
+    process.wait.return_value = 0
+    active_processes['job'] = {
+        'process': process,
+        'status': 'running',
+        'progress': 0,
+        'output_path': '/tmp/result.png',
+        'params': PARAMS,
+        'output': []
+    }
+
+    app_module.monitor_process('job')
+
+    submit.assert_called_once_with('/tmp/result.png', PARAMS)
+
+def test_failed_postprocessing_is_logged_without_duration(monkeypatch, caplog):
+    """Test that a post-processing error is logged and no duration is recorded."""
+    record_duration = MagicMock()
+    monkeypatch.setattr(app_module.history, 'record_duration', record_duration)
+    future = MagicMock()
+    future.exception.return_value = OSError('disk full')
+
+    app_module.postprocess_finished('job', 0, future)
+
+    assert 'disk full' in caplog.text
+    record_duration.assert_not_called()
+
+    future.exception.return_value = None
+    app_module.postprocess_finished('job', 0, future)
+    assert record_duration.call_args[0][:2] == ('job', 'postprocess')
@@ -0,0 +1,104 @@
+import io
+import os
+import json
+from unittest.mock import MagicMock
+
+import app as app_module
+
+def make_process(lines, return_code=0):
+    """Build a fake Popen object that yields the given stdout lines."""
+    process = MagicMock()
+    process.stdout = io.StringIO(''.join(line + '\n' for line in lines))
+    process.pid = os.getpid()  # not a child, so wait4 falls back to wait()
+    process.wait.return_value = return_code
+    process.poll.return_value = None
+    return process
+
+def test_execute_passes_preview_arguments(client, image_folders, active_processes, monkeypatch):
+    """Test that preview arguments are appended when previews are enabled."""
+    open(os.path.join(image_folders['INPUT_FOLDER'], 'in.png'), 'wb').close()
+    monkeypatch.setattr(app_module, 'PREVIEW_INTERVAL', 5)
+    popen = MagicMock(return_value=make_process([]))
+    monkeypatch.setattr(app_module.subprocess, 'Popen', popen)
+
+    response = client.post('/api/execute', json={'input_images': ['in.png']})
+
+    assert response.status_code == 200
+    process_id = json.loads(response.data)['process_id']
+    args = popen.call_args[0][0]
+    assert args[args.index('--preview_interval') + 1] == '5'
+    assert args[args.index('--preview_image_path') + 1] == os.path.join(
+        image_folders['PREVIEW_FOLDER'], f"{process_id}.png")
+
+def test_execute_without_previews(client, image_folders, active_processes, monkeypatch):
+    """Test that the command is unchanged when previews are disabled."""
+    open(os.path.join(image_folders['INPUT_FOLDER'], 'in.png'), 'wb').close()
+    monkeypatch.setattr(app_module, 'PREVIEW_INTERVAL', 0)
+    popen = MagicMock(return_value=make_process([]))
+    monkeypatch.setattr(app_module.subprocess, 'Popen', popen)
+
+    client.post('/api/execute', json={'input_images': ['in.png']})
+
+    assert '--preview_interval' not in popen.call_args[0][0]
+
+def test_monitor_tracks_preview_and_cleans_up(image_folders, active_processes):
+    """Test that preview lines are parsed and the preview is removed on exit."""
+    preview_path = os.path.join(image_folders['PREVIEW_FOLDER'], 'job.png')
+    open(preview_path, 'wb').close()
+    active_processes['job'] = {
+        'process': make_process(['progress: 20%', 'preview: 10', 'preview: x']),
+        'status': 'running',
+        'progress': 0,
+        'output_path': '',
+        'preview_path': preview_path,
+        'preview_step': None,
+        'output': []
+    }
+
+    app_module.monitor_process('job')
+
+    assert active_processes['job']['preview_step'] == 10
+    assert active_processes['job']['progress'] == 20
+    assert active_processes['job']['status'] == 'completed'
+    assert not os.path.exists(preview_path)
+
+def test_monitor_keeps_cancelled_status(image_folders, active_processes):
+    """Test that a cancelled job is not reported as failed when it exits."""
+    active_processes['job'] = {
+        'process': make_process([], return_code=-15),
+        'status': 'cancelled',
+        'progress': 0,
+        'output_path': '',
+        'preview_path': None,
+        'output': []
+    }
+
+    app_module.monitor_process('job')
+
+    assert active_processes['job']['status'] == 'cancelled'
+
+def test_status_reports_preview_url(client, image_folders, active_processes):
+    """Test that the status endpoint exposes the latest preview."""
+    active_processes['job'] = {
+        'process': make_process([]),
+        'status': 'running',
+        'progress': 40,
+        'start_time': '2024-01-01T00:00:00',
+        'preview_step': 20
+    }
+
+    data = json.loads(client.get('/api/status/job').data)
+
+    assert data['preview_step'] == 20
+    assert data['preview_url'].endswith('/api/images/view/preview/job.png?step=20')
+
+def test_serve_preview_disables_caching(client, image_folders):
+    """Test that previews are served without caching."""
+    with open(os.path.join(image_folders['PREVIEW_FOLDER'], 'job.png'), 'wb') as f:
+        f.write(b'preview')
+
+    response = client.get('/api/images/view/preview/job.png')
+
+    assert response.status_code == 200
+    assert response.data == b'preview'
+    assert response.headers['Cache-Control'] == 'no-store'
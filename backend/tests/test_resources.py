@@ -0,0 +1,105 @@
+import os
+import sys
+import json
+import time
+import signal
+import textwrap
+import subprocess
+
+import pytest
+
+import resources
+
+SCRIPT = textwrap.dedent('''
+    import os, sys, time
+    mode = sys.argv[sys.argv.index('--instruction') + 1]
+    print('threads: ' + os.environ.get('OMP_NUM_THREADS', 'unset'), flush=True)
+    if mode == 'sleep':
+        time.sleep(30)
+    elif mode == 'allocate':
+        data = bytearray(1024 * 1024 * 1024)
+    else:
+        sum(i * i for i in range(200000))
+    print('progress: 100%', flush=True)
+''')
+
+@pytest.fixture
+def run_job(client, image_folders, active_processes, tmp_path, monkeypatch):
+    """Run the fake inference script with a real subprocess and wait for it."""
+    script = tmp_path / 'inference.py'
+    script.write_text(SCRIPT)
+    monkeypatch.setenv('INFERENCE_SCRIPT_PATH', str(script))
+    open(os.path.join(image_folders['INPUT_FOLDER'], 'in.png'), 'wb').close()
+
+    def run(mode):
+        response = client.post('/api/execute', json={'input_images': ['in.png'], 'instruction': mode})
+        process_id = json.loads(response.data)['process_id']
+        deadline = time.time() + 20
+        while active_processes[process_id]['status'] == 'running' and time.time() < deadline:
+            time.sleep(0.05)
+        return json.loads(client.get(f'/api/status/{process_id}').data), active_processes[process_id]
+
+    return run
+
+def test_parse_cpu_list():
+    """Test parsing of CPU list syntax."""
+    assert resources.parse_cpu_list('0-2, 5,3') == [0, 1, 2, 3, 5]
+    assert resources.parse_cpu_list('') == []
+
+def test_usage_is_recorded(run_job, monkeypatch):
+    """Test that thread pinning is applied and usage is reported."""
+    monkeypatch.setattr(resources, 'JOB_THREADS', 2)
+
+    status, process_info = run_job('work')
+
+    assert status['status'] == 'completed'
+    assert 'threads: 2' in process_info['output']
+    assert status['limits']['threads'] == 2
+    assert status['resources']['peak_rss_bytes'] > 0
+    assert status['resources']['cpu_user_seconds'] >= 0
+
+def test_timeout_kills_job(run_job, monkeypatch):
+    """Test that a job exceeding the wall-clock limit is killed."""
+    monkeypatch.setattr(resources, 'JOB_TIMEOUT_SECONDS', 1)
+
+    status, _ = run_job('sleep')
+
+    assert status['status'] == 'failed'
+    assert 'time limit' in status['error']
+    assert status['resources']['wall_time_seconds'] < 10
+
+def test_memory_limit_stops_job(run_job, monkeypatch):
+    """Test that the address space limit stops a job allocating too much."""
+    monkeypatch.setattr(resources, 'JOB_MEMORY_LIMIT_MB', 512)
+
+    status, _ = run_job('allocate')
+
+    assert status['status'] == 'failed'
+    assert 'MemoryError' in status['error']
+
+def test_cancelled_job_usage_is_recorded(client, run_job, active_processes):
+    """Test that status polls and cancellation leave reaping to the monitor."""
+    response = client.post('/api/execute', json={'input_images': ['in.png'], 'instruction': 'sleep'})
+    process_id = json.loads(response.data)['process_id']
+    deadline = time.time() + 10
+    while 'threads: ' not in ''.join(active_processes[process_id]['output']) and time.time() < deadline:
+        assert json.loads(client.get(f'/api/status/{process_id}').data)['status'] == 'running'
+        time.sleep(0.05)
+
+    assert json.loads(client.post(f'/api/cancel/{process_id}').data)['status'] == 'cancelled'
+
+    process_info = active_processes[process_id]
+    assert process_info['finished'].is_set()
+    assert process_info['status'] == 'cancelled'
+    assert process_info['resources']['peak_rss_bytes'] > 0
+
+def test_signal_process_leaves_reaping_to_the_monitor():
+    """Test that signalling a child never reaps it, and reaped children aren't signalled."""
+    process = subprocess.Popen([sys.executable, '-c', 'import time; time.sleep(30)'])
+
+    resources.signal_process(process, signal.SIGKILL)
+    return_code, rusage = resources.wait_with_rusage(process)
+
+    assert return_code == -signal.SIGKILL
+    assert rusage is not None
+    resources.signal_process(process, signal.SIGKILL)
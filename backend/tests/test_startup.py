@@ -0,0 +1,57 @@
+import os
+import sys
+import json
+import subprocess
+
+import app as app_module
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Importing the app (Flask included) must stay well below this
+STARTUP_BUDGET_SECONDS = 1.5
+
+IMPORT_PROBE = """
+import json, logging, os, sys, threading, time
+start = time.perf_counter()
+import app
+elapsed = time.perf_counter() - start
+print(json.dumps({
+    'elapsed': elapsed,
+    'handlers': len(logging.getLogger('app').handlers),
+    'threads': threading.active_count(),
+    'files': sorted(os.listdir('.')),
+}))
+"""
+
+def test_import_is_cheap_and_side_effect_free(tmp_path):
+    """Test that importing the app stays within budget and defers its setup."""
+    env = dict(os.environ, PYTHONPATH=BACKEND_DIR, STORAGE_GC_INTERVAL='60')
+    result = subprocess.run([sys.executable, '-c', IMPORT_PROBE], cwd=tmp_path, env=env,
+                            capture_output=True, text=True, timeout=30, check=True)
+    probe = json.loads(result.stdout.strip().splitlines()[-1])
+
+    assert probe['elapsed'] < STARTUP_BUDGET_SECONDS
+    assert probe['handlers'] == 0
+    assert probe['threads'] == 1
+    assert probe['files'] == []
+
+def test_initialize_runs_once(client, monkeypatch):
+    """Test that the first request initializes the app exactly once."""
+    calls = []
+    monkeypatch.setattr(app_module, '_initialized', False)
+    monkeypatch.setattr(app_module, 'configure_logging', lambda: calls.append('logging'))
+    monkeypatch.setattr(app_module, 'STORAGE_GC_INTERVAL', 0)
+
+    client.get('/api/health/live')
+    client.get('/api/health/live')
+    app_module.initialize()
+
+    assert calls == ['logging']
+
+def test_create_app_builds_independent_apps():
+    """Test that the factory registers the API on every app it creates."""
+    first, second = app_module.create_app(), app_module.create_app()
+
+    assert first is not second
+    assert first.test_client().get('/api/health/live').status_code == 200
+    assert second.test_client().get('/api/health/live').status_code == 200
@@ -0,0 +1,134 @@
+import io
+import os
+import sys
+import json
+import hmac
+import hashlib
+import subprocess
+
+import pytest
+from PIL import Image
+
+import app as app_module
+import workload
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+class ClientSession:
+    """Minimal ``requests.Session`` interface over the Flask test client."""
+
+    class Response:
+        def __init__(self, response):
+            self.status_code = response.status_code
+            self.data = response.data
+
+        def json(self):
+            return json.loads(self.data)
+
+        def raise_for_status(self):
+            assert self.status_code < 400, self.data
+
+    def __init__(self, client):
+        self.client = client
+
+    def get(self, url):
+        return self.Response(self.client.get(url))
+
+    def post(self, url, json=None, files=None):
+        if files:
+            data = {name: (io.BytesIO(content), filename) for name, (filename, content, _) in files.items()}
+            return self.Response(self.client.post(url, data=data, content_type='multipart/form-data'))
+        return self.Response(self.client.post(url, json=json))
+
+def test_submissions_are_traced_anonymized(client, image_folders, mock_subprocess, tmp_path, monkeypatch):
+    """Test that /api/execute payloads are captured without prompts or filenames."""
+    trace_file = tmp_path / 'trace.jsonl'
+    monkeypatch.setattr(workload, 'TRACE_FILE', str(trace_file))
+    mock_subprocess.return_value.pid = os.getpid()
+    Image.new('RGB', (64, 48)).save(os.path.join(image_folders['INPUT_FOLDER'], 'secret-name.png'))
+
+    instruction = 'Put my neighbour into the picture'
+    client.post('/api/execute', json={'input_images': ['secret-name.png'], 'height': 512,
+                                      'instruction': instruction})
+    client.post('/api/execute', json={'input_images': ['missing.png'], 'instruction': instruction})
+    with monkeypatch.context() as full:
+        full.setattr(app_module, 'admit_job', lambda process_id: "No free inference slots, retry later")
+        assert client.post('/api/execute', json={'input_images': ['secret-name.png'],
+                                                 'instruction': instruction}).status_code == 503
+    client.post('/api/execute', json={'input_images': ['secret-name.png'], 'instruction': instruction})
+
+    lines = trace_file.read_text().splitlines()
+    assert len(lines) == 2
+    traced = json.loads(lines[0])
+    assert traced['arrival'] > 0
+    assert traced['payload']['height'] == 512
+    assert traced['payload']['input_images'] == [{'width': 64, 'height': 48}]
+    assert traced['payload']['instruction'].startswith('prompt-')
+    assert len(traced['payload']['instruction'].split()) == 6
+    assert 'neighbour' not in lines[0] and 'secret-name' not in lines[0]
+    assert hashlib.sha256(instruction.encode()).hexdigest()[:12] not in lines[0]
+    assert json.loads(lines[1])['payload']['instruction'] == traced['payload']['instruction']
+
+def test_replay_reports_queueing_and_throughput(client, image_folders, active_processes, tmp_path, monkeypatch):
+    """Test replaying a trace against the stub inference script."""
+    monkeypatch.setenv('INFERENCE_SCRIPT_PATH', os.path.join(BACKEND_DIR, 'stub_inference.py'))
+    monkeypatch.setenv('STUB_STEP_SECONDS', '0.01')
+    monkeypatch.setenv('STUB_LOAD_SECONDS', '0')
+    monkeypatch.setattr(app_module, 'MAX_CONCURRENT_JOBS', 1)
+    trace_file = tmp_path / 'trace.jsonl'
+    payload = {'num_inference_step': 5, 'height': 64, 'width': 64, 'instruction': 'prompt-0 x',
+               'input_images': [{'width': 32, 'height': 32}]}
+    trace_file.write_text(''.join(json.dumps({'arrival': 1000 + i * 0.1, 'payload': payload}) + '\n'
+                                  for i in range(3)))
+
+    jobs = workload.replay(ClientSession(client), '', workload.load_trace(str(trace_file)),
+                           speed=2, poll_interval=0.05, retry_interval=0.05)
+    report = workload.summarize(jobs, speed=2)
+
+    assert report['completed'] == 3
+    assert report['rejected_submissions'] > 0
+    assert [job['arrival'] for job in jobs] == pytest.approx([0, 0.05, 0.1])
+    assert report['queue_delay_seconds']['max'] > 0
+    assert report['turnaround_seconds']['p95'] >= report['turnaround_seconds']['p50'] > 0
+    assert report['throughput_jobs_per_hour'] > 0
+
+def test_merge_slot_benchmark(tmp_path):
+    """Test that replay throughput feeds the JOB_SLOTS=auto benchmark file."""
+    path = str(tmp_path / 'slot_benchmark.json')
+
+    workload.merge_slot_benchmark(path, 2, 18.5)
+    workload.merge_slot_benchmark(path, 1, 12.0)
+    workload.merge_slot_benchmark(path, 2, 20.0)
+
+    with open(path) as f:
+        assert json.load(f) == {'results': [{'slots': 1, 'throughput': 12.0}, {'slots': 2, 'throughput': 20.0}]}
+
+def test_trace_key_from_environment(monkeypatch):
+    """Test that tokens are keyed with TRACE_KEY, so they match across processes."""
+    monkeypatch.setattr(workload, '_trace_key', None)
+    monkeypatch.setenv('TRACE_KEY', 'shared-secret')
+
+    token = workload.anonymize({'instruction': 'a red bicycle'}, [])['instruction'].split()[0]
+
+    digest = hmac.new(b'shared-secret', b'a red bicycle', hashlib.sha256).hexdigest()[:12]
+    assert token == f'prompt-{digest}'
+
+def test_stub_writes_previews(tmp_path):
+    """Test that the stub script follows the preview contract, also per job of a batch."""
+    stub = [sys.executable, os.path.join(BACKEND_DIR, 'stub_inference.py')]
+    env = dict(os.environ, STUB_STEP_SECONDS='0', STUB_LOAD_SECONDS='0')
+    output = subprocess.run(stub + ['--num_inference_step', '4', '--height', '64', '--width', '64',
+                                    '--output_image_path', str(tmp_path / 'out.png'), '--preview_interval', '2',
+                                    '--preview_image_path', str(tmp_path / 'preview.png')],
+                            env=env, capture_output=True, text=True, check=True).stdout
+    assert 'preview: 2' in output.splitlines()
+    assert os.path.exists(tmp_path / 'preview.png') and os.path.exists(tmp_path / 'out.png')
+
+    jobs = [{'job_id': job_id, 'output_image_path': str(tmp_path / f'{job_id}.png'), 'preview_interval': 2,
+             'preview_image_path': str(tmp_path / f'{job_id}-preview.png')} for job_id in ('a', 'b')]
+    request = {'action': 'run_batch', 'model_path': 'm', 'num_inference_step': 4, 'height': 64, 'width': 64,
+               'jobs': jobs}
+    output = subprocess.run(stub + ['--worker'], input=json.dumps(request) + '\n', env=env,
+                            capture_output=True, text=True, check=True).stdout
+    assert {'[a] preview: 2', '[b] preview: 2', 'done: ok'} <= set(output.splitlines())
+    assert os.path.exists(tmp_path / 'b-preview.png')
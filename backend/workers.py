@@ -0,0 +1,416 @@
+"""Persistent inference workers that keep models loaded between jobs.
+
+With ``INFERENCE_WORKERS`` set, the inference script is started once per
+worker with ``--worker`` instead of once per job. A worker reads one JSON
+request per line on stdin and answers every request with the usual output
+lines (``progress: <percent>``, ``preview: <step>``, log lines) followed by
+``done: ok`` or ``done: error <message>``. A worker that loads a model for
+a request reports it with a ``loaded: <model_path>`` line::
+
+    {"action": "run", "job_id": ..., "model_path": ..., "num_inference_step": ...,
+     "height": ..., "width": ..., "text_guidance_scale": ..., "image_guidance_scale": ...,
+     "instruction": ..., "input_image_path": [...], "output_image_path": ...}
+    {"action": "unload", "model_path": ...}
+    {"action": "cancel", "job_id": ...}
+
+``cancel`` may arrive while a job is running and gets no reply of its own:
+the worker should stop that job at its next step and end the request with
+``done: error cancelled``, and ignore job ids it is not running.
+
+Which models stay loaded is decided here: each worker has a
+``models.ResidentModels`` set, evicted models are unloaded before a job
+runs, and jobs go to an idle worker that already has their model loaded
+whenever there is one. A model only joins the set once the worker confirms
+loading it; when a request fails before that, the model is unloaded in
+case it was partly loaded (unloading a model that isn't loaded is a no-op).
+
+With ``INFERENCE_BATCH_SIZE`` above 1, jobs are queued and jobs sharing
+``BATCH_KEYS`` are sent to one worker as a single batched forward pass::
+
+    {"action": "run_batch", "model_path": ..., "num_inference_step": ..., "height": ...,
+     "width": ..., "jobs": [{"job_id": ..., "instruction": ..., ...}, ...]}
+
+Output lines prefixed with ``[<job_id>] `` belong to that job (a
+``[<job_id>] error: <message>`` line fails just that job); other lines go
+to every job of the batch. Cancelling or timing out a job sends ``cancel``
+for it; a job that shares a batch is detached from it right away (a worker
+may stop it early with a ``[<job_id>] error: cancelled`` line). Only a
+worker that doesn't end a job running alone within
+``WORKER_CANCEL_GRACE_SECONDS`` is killed, and restarted with no models
+loaded.
+"""
+import os
+import re
+import json
+import time
+import shlex
+import signal
+import logging
+import threading
+import subprocess
+
+import models
+import resources
+
+logger = logging.getLogger('app.workers')
+
+# Number of persistent workers (0 starts a new process for every job)
+INFERENCE_WORKERS = int(os.environ.get('INFERENCE_WORKERS', 0))
+
+# Jobs per batched forward pass (1 disables batching) and how long the oldest
+# queued job waits for compatible jobs
+INFERENCE_BATCH_SIZE = int(os.environ.get('INFERENCE_BATCH_SIZE', 1))
+BATCH_WINDOW_MS = int(os.environ.get('BATCH_WINDOW_MS', 200))
+
+# How long a worker has to end a cancelled job before it is killed
+WORKER_CANCEL_GRACE_SECONDS = float(os.environ.get('WORKER_CANCEL_GRACE_SECONDS', 10))
+
+def batching_enabled():
+    """Whether jobs are queued and batched instead of started right away."""
+    return INFERENCE_WORKERS > 0 and INFERENCE_BATCH_SIZE > 1
+
+class WorkerExited(Exception):
+    """The worker process ended while a request was in flight."""
+
+class Worker:
+    """One persistent inference process and the models it has loaded."""
+
+    def __init__(self, index, command, cwd, limits):
+        self.index = index
+        self.command = command
+        self.cwd = cwd
+        self.limits = limits
+        self.resident = models.ResidentModels()
+        self.job_id = None
+        self.process = None
+        self.write_lock = threading.Lock()
+        self.start()
+
+    def start(self):
+        self.process = subprocess.Popen(
+            shlex.split(self.command),
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            universal_newlines=True,
+            bufsize=1,
+            cwd=self.cwd,
+            env=resources.child_env(self.limits),
+            preexec_fn=resources.make_preexec(self.limits)
+        )
+        self.resident.clear()
+        logger.info(f"Started inference worker {self.index} (pid {self.process.pid})")
+
+    def restart(self):
+        """Replace a killed or crashed worker process with a fresh one."""
+        self.kill()
+        resources.wait_with_rusage(self.process)
+        self.start()
+
+    def kill(self):
+        """Kill the worker process; it is reaped by ``restart`` or ``shutdown``."""
+        resources.signal_process(self.process, signal.SIGKILL)
+
+    def send(self, message):
+        """Write one request line; cancel requests are sent while another is running."""
+        try:
+            with self.write_lock:
+                self.process.stdin.write(json.dumps(message) + '\n')
+                self.process.stdin.flush()
+        except (BrokenPipeError, ValueError) as e:
+            raise WorkerExited(str(e))
+
+    def request(self, message, on_line):
+        """Send one request and pass its output lines to ``on_line``.
+
+        Returns the error message reported by the worker, or None on success.
+        """
+        self.send(message)
+        for line in iter(self.process.stdout.readline, ''):
+            line = line.rstrip('\n')
+            if line.startswith('done:'):
+                result = line[len('done:'):].strip()
+                return None if result == 'ok' else result[len('error'):].strip() or 'Worker reported an error'
+            on_line(line)
+        raise WorkerExited(f"Inference worker {self.index} exited with code {resources.wait_with_rusage(self.process)[0]}")
+
+    def run(self, model, message, on_line):
+        """Send a run request for ``model`` after unloading the models it displaces."""
+        _, registry = models.get_registry()
+        for model_id in self.resident.make_room(model['id'], model['memory_mb']):
+            logger.info(f"Unloading model {model_id} from inference worker {self.index}")
+            self.request({'action': 'unload', 'model_path': registry[model_id]['path']}, on_line)
+        loaded = model['id'] in self.resident
+
+        def watch(line):
+            nonlocal loaded
+            if line == f"loaded: {model['path']}":
+                loaded = True
+                self.resident.add(model['id'], model['memory_mb'])
+            on_line(line)
+
+        error = self.request(message, watch)
+        if error is None:
+            self.resident.add(model['id'], model['memory_mb'])
+        elif not loaded:
+            logger.info(f"Unloading model {model['id']} after a failed load on inference worker {self.index}")
+            self.request({'action': 'unload', 'model_path': model['path']}, on_line)
+        return error
+
+# Parameters a batched forward pass shares; the rest may differ per job
+BATCH_KEYS = ('model_path', 'num_inference_step', 'height', 'width')
+
+# Output line addressed to one job of a batch: "[<job_id>] <line>"
+JOB_LINE = re.compile(r'^\[([^\]]+)\] (.*)$')
+
+class WorkerJob:
+    """Process-like handle of a job running (or queued) for a worker.
+
+    It stands in for the ``subprocess.Popen`` of a job: the job's monitor
+    calls ``run``, and cancellation and timeouts call ``stop``. Jobs created without a worker wait in the pool's batcher until they are
+    dispatched together with compatible jobs.
+    """
+
+    def __init__(self, pool, job_id, model, message, worker=None):
+        self.pool = pool
+        self.job_id = job_id
+        self.model = model
+        self.message = message
+        self.worker = worker
+        self.pid = worker.process.pid if worker else None
+        self.batch = None
+        self.returncode = None
+        self.error = None
+        self.on_line = None
+        self.on_start = None
+        self.cancelling = False
+        self.finished = threading.Event()
+
+    @property
+    def batch_key(self):
+        return tuple(self.message[key] for key in BATCH_KEYS)
+
+    def run(self, on_line, on_start=None):
+        """Run the job to completion and return ``(return_code, error)``."""
+        self.on_line = on_line
+        self.on_start = on_start
+        if self.worker is None:
+            self.pool.batcher.submit(self)
+            self.finished.wait()
+        else:
+            execute(self.pool, self.worker, [self])
+        return self.returncode, self.error
+
+    def stop(self, returncode):
+        """Stop the job without affecting other jobs of its batch.
+
+        A queued job is taken off the queue. A running job is sent a
+        ``cancel`` request: a job sharing a batch is detached right away and
+        its result is discarded, a job running alone ends with the worker's
+        reply, and its worker is killed if that doesn't come within
+        ``WORKER_CANCEL_GRACE_SECONDS``.
+        """
+        if self.pool.batcher is not None and self.pool.batcher.cancel(self):
+            self.returncode = returncode
+            self.finished.set()
+            return
+        with self.pool.lock:
+            if self.finished.is_set() or self.cancelling:
+                return
+            self.cancelling = True
+            worker, process = self.worker, self.worker.process
+            alone = [job for job in self.batch or [self] if not job.finished.is_set()] == [self]
+            if not alone:
+                self.returncode = returncode
+                self.finished.set()
+        try:
+            worker.send({'action': 'cancel', 'job_id': self.job_id})
+        except WorkerExited:
+            pass
+        if alone:
+            timer = threading.Timer(WORKER_CANCEL_GRACE_SECONDS, self.expire, args=(worker, process))
+            timer.daemon = True
+            timer.start()
+
+    def expire(self, worker, process):
+        """Kill the worker process if it is still running this cancelled job."""
+        if not self.finished.is_set():
+            logger.warning(f"Inference worker {worker.index} ignored the cancellation of job {self.job_id}, killing it")
+            resources.signal_process(process, signal.SIGKILL)
+
+def batch_message(jobs):
+    """Build the worker request running ``jobs`` as one forward pass."""
+    if len(jobs) == 1:
+        return dict(jobs[0].message, action='run', job_id=jobs[0].job_id)
+    message = {key: jobs[0].message[key] for key in BATCH_KEYS}
+    message['action'] = 'run_batch'
+    message['jobs'] = [
+        dict({key: value for key, value in job.message.items() if key not in BATCH_KEYS}, job_id=job.job_id)
+        for job in jobs
+    ]
+    return message
+
+def execute(pool, worker, jobs):
+    """Run ``jobs`` on ``worker`` and route their output and results."""
+    routes = {job.job_id: job for job in jobs}
+
+    def on_line(line):
+        match = JOB_LINE.match(line) if len(jobs) > 1 else None
+        targets = [routes[match.group(1)]] if match and match.group(1) in routes else jobs
+        text = match.group(2) if match and match.group(1) in routes else line
+        for job in targets:
+            if job.finished.is_set():
+                continue
+            if match and text.startswith('error:'):
+                job.error = text[len('error:'):].strip()
+            else:
+                job.on_line(text)
+
+    with pool.lock:
+        for job in jobs:
+            job.worker, job.pid, job.batch = worker, worker.process.pid, jobs
+    for job in jobs:
+        if job.on_start:
+            job.on_start()
+    results = [(-1, f"Inference worker {worker.index} failed")] * len(jobs)
+    try:
+        error = worker.run(jobs[0].model, batch_message(jobs), on_line)
+        results = [(0, None) if error is None and job.error is None else (1, job.error or error)
+                   for job in jobs]
+    except Exception as e:
+        # The worker was killed, crashed or is out of step with us: start over
+        results = [(worker.process.returncode or -1, str(e))] * len(jobs)
+        worker.restart()
+    finally:
+        # Jobs are finished before the worker is released, so that a late
+        # cancellation can't affect the worker's next job
+        for job, (returncode, error) in zip(jobs, results):
+            if not job.finished.is_set():
+                job.returncode, job.error = returncode, error
+                job.finished.set()
+        pool.release(worker)
+
+class Batcher:
+    """Groups queued jobs with the same ``BATCH_KEYS`` into batched runs.
+
+    The oldest queued job waits up to ``window`` seconds for compatible jobs
+    (at most ``max_size`` per batch), then its batch is dispatched to an idle
+    worker, preferably one that has the model loaded.
+    """
+
+    def __init__(self, pool, window, max_size):
+        self.pool = pool
+        self.window = window
+        self.max_size = max_size
+        self.pending = []
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self.loop, name='inference-batcher', daemon=True)
+        self.thread.start()
+
+    def submit(self, job):
+        with self.condition:
+            job.queued_at = time.monotonic()
+            self.pending.append(job)
+            self.condition.notify()
+
+    def cancel(self, job):
+        """Remove a job that is still queued; return whether it was."""
+        with self.condition:
+            if job in self.pending:
+                self.pending.remove(job)
+                return True
+            return False
+
+    def wakeup(self):
+        with self.condition:
+            self.condition.notify()
+
+    def queued(self):
+        with self.condition:
+            return len(self.pending)
+
+    def next_batch(self):
+        """Return ``(jobs, worker)`` ready to run, or ``(None, seconds to wait)``."""
+        if not self.pending:
+            return None, None
+        oldest = self.pending[0]
+        batch = [job for job in self.pending if job.batch_key == oldest.batch_key][:self.max_size]
+        age = time.monotonic() - oldest.queued_at
+        if len(batch) < self.max_size and age < self.window:
+            return None, self.window - age
+        worker = self.pool.acquire(oldest.job_id, oldest.model['id'])
+        if worker is None:
+            return None, None
+        with self.pool.lock:
+            for job in batch:
+                self.pending.remove(job)
+                job.worker, job.pid, job.batch = worker, worker.process.pid, batch
+        return batch, worker
+
+    def loop(self):
+        while True:
+            with self.condition:
+                batch, worker = self.next_batch()
+                while batch is None:
+                    self.condition.wait(worker)
+                    batch, worker = self.next_batch()
+            if len(batch) > 1:
+                logger.info(f"Running {len(batch)} jobs as one batch on inference worker {worker.index}")
+            threading.Thread(target=execute, args=(self.pool, worker, batch), daemon=True).start()
+
+class WorkerPool:
+    """Fixed set of workers, pinned to the CPU slots when those are enabled."""
+
+    def __init__(self, size, command, cwd, batch_size=1, batch_window=0):
+        slots = resources.get_slots()
+        self.workers = []
+        for index in range(size):
+            limits = resources.job_limits()
+            if slots:
+                limits['slot'], limits['cpus'] = index % len(slots), slots[index % len(slots)]
+                limits['threads'] = len(limits['cpus'])
+            self.workers.append(Worker(index, command, cwd, limits))
+        self.lock = threading.Lock()
+        self.batcher = Batcher(self, batch_window, batch_size) if batch_size > 1 else None
+
+    def acquire(self, job_id, model_id):
+        """Reserve an idle worker for a job, preferring one with the model loaded."""
+        with self.lock:
+            idle = [worker for worker in self.workers if worker.job_id is None]
+            if not idle:
+                return None
+            # Otherwise take the worker with the fewest models to displace
+            worker = min(idle, key=lambda w: (model_id not in w.resident, len(w.resident.models)))
+            worker.job_id = job_id
+            return worker
+
+    def release(self, worker):
+        with self.lock:
+            worker.job_id = None
+        if self.batcher is not None:
+            self.batcher.wakeup()
+
+    def idle_count(self):
+        with self.lock:
+            return sum(1 for worker in self.workers if worker.job_id is None)
+
+    def status(self):
+        with self.lock:
+            return [{'index': worker.index, 'pid': worker.process.pid, 'job_id': worker.job_id,
+                     'resident_models': worker.resident.ids()} for worker in self.workers]
+
+    def shutdown(self):
+        for worker in self.workers:
+            worker.kill()
+            resources.wait_with_rusage(worker.process)
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool(command, cwd):
+    """Return the worker pool, starting its processes on first use."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = WorkerPool(INFERENCE_WORKERS, command, cwd, INFERENCE_BATCH_SIZE, BATCH_WINDOW_MS / 1000)
+        return _pool
@@ -0,0 +1,246 @@
+"""Capture and replay of ``/api/execute`` workloads.
+
+With ``TRACE_FILE`` set, the backend appends every ``/api/execute`` payload
+it accepted and its arrival time to a JSON-lines trace. Traces
+are anonymized: instructions are replaced by a keyed hash token padded to the
+same number of words and input images by their dimensions, while the
+parameters that determine the cost of a job (model, steps, size, guidance)
+are kept. The hash is keyed with ``TRACE_KEY``, a secret that is never
+written to the trace, so tokens can't be matched against guessed prompts,
+but identical prompts keep identical tokens across server processes and
+restarts. Without ``TRACE_KEY`` each process uses a random key, and tokens
+only match within that process.
+
+A trace can be replayed against a running backend, typically one configured
+with ``stub_inference.py``, at its original pace or accelerated::
+
+    python workload.py trace.jsonl --url http://localhost:5000 --speed 10
+
+The replay submits every job at its (scaled) arrival time, retries rejected
+submissions like a client would and reports queueing delay (time until the
+job started, including retries after ``503`` and time spent queued for
+batching), turnaround time and throughput. With ``--slots N`` the throughput
+is also merged into a ``slot_benchmark.json`` file used by ``JOB_SLOTS=auto``.
+"""
+import os
+import io
+import sys
+import json
+import hmac
+import math
+import time
+import hashlib
+import logging
+import secrets
+import argparse
+import threading
+
+import resources
+
+logger = logging.getLogger('app.workload')
+
+TRACE_FILE = os.environ.get('TRACE_FILE', '')
+
+# Request fields copied to the trace as they are
+TRACED_FIELDS = ('model_path', 'num_inference_step', 'height', 'width',
+                 'text_guidance_scale', 'image_guidance_scale', 'reuse_previous')
+
+TERMINAL_STATUSES = ('completed', 'failed', 'cancelled')
+
+_trace_lock = threading.Lock()
+# Key of the instruction tokens, read on first use
+_trace_key = None
+_trace_key_lock = threading.Lock()
+
+def trace_key():
+    """Return the key of the instruction tokens, from ``TRACE_KEY`` if it is set."""
+    global _trace_key
+    with _trace_key_lock:
+        if _trace_key is None:
+            key = os.environ.get('TRACE_KEY', '')
+            if key:
+                _trace_key = key.encode('utf-8')
+            else:
+                logger.warning("TRACE_KEY is not set, instruction tokens only match within this process")
+                _trace_key = secrets.token_bytes(32)
+        return _trace_key
+
+def image_info(path):
+    """Describe an input image by its size, without its contents."""
+    from PIL import Image
+    with Image.open(path) as image:
+        return {'width': image.width, 'height': image.height}
+
+def anonymize(payload, input_paths):
+    """Return the traced form of an ``/api/execute`` payload."""
+    record = {field: payload[field] for field in TRACED_FIELDS if field in payload}
+    instruction = payload.get('instruction')
+    if isinstance(instruction, str):
+        words = instruction.split()
+        digest = hmac.new(trace_key(), instruction.encode('utf-8'), hashlib.sha256).hexdigest()[:12]
+        record['instruction'] = ' '.join([f'prompt-{digest}'] + ['x'] * (len(words) - 1))
+    record['input_images'] = [image_info(path) for path in input_paths]
+    return record
+
+def record(payload, input_paths, arrival=None, trace_file=None):
+    """Append a submission that arrived at ``arrival`` (default: now) to the trace file."""
+    trace_file = trace_file or TRACE_FILE
+    if not trace_file:
+        return
+    arrival = time.time() if arrival is None else arrival
+    line = json.dumps({'arrival': round(arrival, 3), 'payload': anonymize(payload, input_paths)})
+    with _trace_lock:
+        with open(trace_file, 'a') as f:
+            f.write(line + '\n')
+
+def load_trace(path):
+    """Read a trace and return its records with arrival offsets from the first one."""
+    with open(path) as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    records.sort(key=lambda r: r['arrival'])
+    start = records[0]['arrival'] if records else 0
+    return [dict(r, offset=r['arrival'] - start) for r in records]
+
+def prepare_inputs(session, base_url, records):
+    """Upload one placeholder image per traced image size; return name lookup."""
+    from PIL import Image
+    uploaded = {}
+    for r in records:
+        for info in r['payload'].get('input_images', []):
+            key = (info['width'], info['height'])
+            if key in uploaded:
+                continue
+            buffer = io.BytesIO()
+            Image.new('RGB', key, (128, 128, 128)).save(buffer, format='PNG')
+            response = session.post(f'{base_url}/api/upload',
+                                    files={'file': ('replay.png', buffer.getvalue(), 'image/png')})
+            response.raise_for_status()
+            uploaded[key] = response.json()['filename']
+    return uploaded
+
+def replay(session, base_url, records, speed=1.0, poll_interval=0.2, retry_interval=1.0, batch_size=100):
+    """Submit the traced jobs at their scaled arrival times and follow them to the end."""
+    uploaded = prepare_inputs(session, base_url, records)
+    jobs = []
+    for index, r in enumerate(records):
+        payload = {k: v for k, v in r['payload'].items() if k != 'input_images'}
+        payload['input_images'] = [uploaded[(i['width'], i['height'])] for i in r['payload']['input_images']]
+        arrival = r['offset'] / speed
+        jobs.append({'index': index, 'payload': payload, 'arrival': arrival, 'next_attempt': arrival,
+                     'rejections': 0, 'process_id': None, 'accepted': None, 'finished': None, 'status': None})
+
+    start = time.monotonic()
+    next_poll = 0
+    while any(job['finished'] is None for job in jobs):
+        now = time.monotonic() - start
+        for job in jobs:
+            if job['process_id'] is None and job['finished'] is None and job['next_attempt'] <= now:
+                response = session.post(f'{base_url}/api/execute', json=job['payload'])
+                now = time.monotonic() - start
+                if response.status_code == 503:
+                    job['rejections'] += 1
+                    job['next_attempt'] = now + retry_interval
+                elif response.status_code == 200:
+                    data = response.json()
+                    job['process_id'], job['accepted'] = data['process_id'], now
+                    if data.get('status') in TERMINAL_STATUSES:
+                        job['status'], job['finished'] = data['status'], now
+                else:
+                    job['status'], job['finished'] = f'error {response.status_code}', now
+
+        in_flight = [job for job in jobs if job['process_id'] and job['finished'] is None]
+        if in_flight and now >= next_poll:
+            for chunk in range(0, len(in_flight), batch_size):
+                batch = in_flight[chunk:chunk + batch_size]
+                statuses = session.post(f'{base_url}/api/status/batch',
+                                        json={'process_ids': [job['process_id'] for job in batch]}).json()
+                now = time.monotonic() - start
+                for job in batch:
+                    status = statuses['statuses'].get(job['process_id'], {}).get('status')
+                    if status in TERMINAL_STATUSES:
+                        job['status'], job['finished'] = status, now
+            next_poll = now + poll_interval
+
+        pending = [job['next_attempt'] for job in jobs if job['process_id'] is None and job['finished'] is None]
+        wake = min(pending + ([next_poll] if in_flight else []), default=now)
+        time.sleep(max(0, min(wake - (time.monotonic() - start), poll_interval)))
+
+    # Time spent queued on the server (batching) is part of the queueing delay
+    for job in jobs:
+        job['server_queue'] = 0.0
+        if job['process_id'] and job['status'] in TERMINAL_STATUSES:
+            response = session.get(f"{base_url}/api/history/{job['process_id']}")
+            if response.status_code == 200:
+                job['server_queue'] = response.json().get('durations', {}).get('queue_seconds', 0.0)
+    return jobs
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a non-empty list."""
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+def summarize(jobs, speed=1.0):
+    """Reduce replayed jobs to queueing, turnaround and throughput figures."""
+    completed = [job for job in jobs if job['status'] == 'completed']
+    report = {
+        'jobs': len(jobs),
+        'completed': len(completed),
+        'failed': sum(1 for job in jobs if job['status'] not in ('completed', None)),
+        'rejected_submissions': sum(job['rejections'] for job in jobs),
+        'speed': speed,
+    }
+    if completed:
+        queue = [job['accepted'] - job['arrival'] + job['server_queue'] for job in completed]
+        turnaround = [job['finished'] - job['arrival'] for job in completed]
+        makespan = max(job['finished'] for job in completed) - min(job['arrival'] for job in jobs)
+        for name, values in (('queue_delay_seconds', queue), ('turnaround_seconds', turnaround)):
+            report[name] = {
+                'mean': round(sum(values) / len(values), 3),
+                'p50': round(percentile(values, 0.5), 3),
+                'p95': round(percentile(values, 0.95), 3),
+                'max': round(max(values), 3),
+            }
+        report['makespan_seconds'] = round(makespan, 3)
+        report['throughput_jobs_per_hour'] = round(len(completed) * 3600 / makespan, 2) if makespan > 0 else None
+    return report
+
+def merge_slot_benchmark(path, slots, throughput):
+    """Store the throughput measured with ``slots`` CPU slots for ``JOB_SLOTS=auto``."""
+    try:
+        with open(path) as f:
+            results = json.load(f)['results']
+    except (OSError, ValueError, KeyError):
+        results = []
+    results = [r for r in results if int(r['slots']) != slots]
+    results.append({'slots': slots, 'throughput': throughput})
+    with open(path, 'w') as f:
+        json.dump({'results': sorted(results, key=lambda r: r['slots'])}, f, indent=2)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Replay a captured /api/execute workload.')
+    parser.add_argument('trace', help='trace file written with TRACE_FILE')
+    parser.add_argument('--url', default='http://localhost:5000', help='backend base URL')
+    parser.add_argument('--speed', type=float, default=1.0, help='arrival time acceleration factor')
+    parser.add_argument('--report', help='also write the report to this JSON file')
+    parser.add_argument('--slots', type=int, help='JOB_SLOTS the backend runs with')
+    parser.add_argument('--slot-benchmark', default=resources.SLOT_BENCHMARK_FILE,
+                        help='benchmark file updated when --slots is given')
+    args = parser.parse_args(argv)
+
+    import requests
+    records = load_trace(args.trace)
+    if not records:
+        print(f"{args.trace} contains no submissions")
+        return 1
+    jobs = replay(requests.Session(), args.url.rstrip('/'), records, speed=args.speed)
+    report = summarize(jobs, args.speed)
+    print(json.dumps(report, indent=2))
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(dict(report, details=jobs), f, indent=2)
+    if args.slots and report.get('throughput_jobs_per_hour'):
+        merge_slot_benchmark(args.slot_benchmark, args.slots, report['throughput_jobs_per_hour'])
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -14,6 +14,20 @@ const apiClient = axios.create({
   }
 });
 
+// Retries of a job submission that got no response (timeout, network error)
+// or found its first attempt still in progress. They reuse the submission's
+// Idempotency-Key, so the backend never starts the job twice.
+const EXECUTE_RETRIES = 2;
+const EXECUTE_RETRY_DELAY = 1000;
+
+// Generate a key identifying one job submission across its retries
+export function newIdempotencyKey() {
+  if (globalThis.crypto?.randomUUID) {
+    return globalThis.crypto.randomUUID();
+  }
+  return `${Date.now().toString(36)}-${Math.random().toString(36).slice(2)}`;
+}
+
 // Request interceptor for API calls
 apiClient.interceptors.request.use(
   config => {
@@ -76,6 +90,11 @@ class ApiService {
     return apiClient.get('/images/output');
   }
   
+  // List the images added to or removed from a folder since a gallery version
+  static async getImageChanges(folder, since) {
+    return apiClient.get(`/images/${folder}/changes`, { params: { since } });
+  }
+  
   // Delete input image
   static async deleteInputImage(filename) {
     return apiClient.delete(`/images/input/${filename}`);
@@ -86,9 +105,33 @@ class ApiService {
     return apiClient.delete(`/images/output/${filename}`);
   }
   
-  // Execute script
-  static async executeScript(params) {
-    return apiClient.post('/execute', params);
+  // Delete several images from a folder ('input' or 'output') in one call
+  static async batchDeleteImages(folder, filenames) {
+    return apiClient.post(`/images/${folder}/batch-delete`, { filenames });
+  }
+  
+  // Download a zip or tar archive of output images
+  static async exportOutputImages(filenames, format = 'zip') {
+    return apiClient.post('/images/output/export', { filenames, format }, {
+      responseType: 'blob',
+      timeout: 0
+    });
+  }
+  
+  // Execute script, retrying with the same Idempotency-Key when no response arrived
+  static async executeScript(params, idempotencyKey = newIdempotencyKey()) {
+    const config = { headers: { 'Idempotency-Key': idempotencyKey } };
+    for (let attempt = 0; ; attempt++) {
+      try {
+        return await apiClient.post('/execute', params, config);
+      } catch (error) {
+        const response = error.originalError?.response;
+        if (attempt >= EXECUTE_RETRIES || (response && response.status !== 409)) {
+          throw error;
+        }
+        await new Promise(resolve => setTimeout(resolve, EXECUTE_RETRY_DELAY));
+      }
+    }
   }
   
   // Get script status
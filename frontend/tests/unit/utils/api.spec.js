@@ -108,6 +108,21 @@ describe('ApiService', () => {
     expect(response.data).toEqual(mockResponse);
   });
   
+  it('should retry an unanswered submission with the same idempotency key', async () => {
+    const mockResponse = { process_id: 'test-process-id', status: 'started' };
+    
+    // Time out once, then answer with the original job
+    mock.onPost('http://localhost:5000/api/execute').timeoutOnce()
+      .onPost('http://localhost:5000/api/execute').reply(200, mockResponse);
+    
+    // Call the method
+    const response = await ApiService.executeScript({ input_images: ['test1.jpg'] }, 'key-1');
+    
+    // Assert both attempts carried the key
+    expect(response.data).toEqual(mockResponse);
+    expect(mock.history.post.map(post => post.headers['Idempotency-Key'])).toEqual(['key-1', 'key-1']);
+  });
+  
   it('should get script status', async () => {
     const processId = 'test-process-id';
     const mockResponse = {
@@ -126,6 +141,40 @@ describe('ApiService', () => {
     expect(response.data).toEqual(mockResponse);
   });
   
+  it('should get image changes since a version', async () => {
+    const mockResponse = {
+      changes: [{ action: 'removed', filename: 'input1.jpg', seq: 8 }],
+      version: 8,
+      has_more: false
+    };
+    
+    mock.onGet('http://localhost:5000/api/images/input/changes').reply(200, mockResponse);
+    
+    // Call the method
+    const response = await ApiService.getImageChanges('input', 7);
+    
+    // Assert the response
+    expect(response.data).toEqual(mockResponse);
+    expect(mock.history.get[0].params).toEqual({ since: 7 });
+  });
+  
+  it('should delete several images', async () => {
+    const mockResponse = {
+      deleted: ['output1.jpg'],
+      not_found: [],
+      errors: {}
+    };
+    
+    // Mock the API response
+    mock.onPost('http://localhost:5000/api/images/output/batch-delete').reply(200, mockResponse);
+    
+    // Call the method
+    const response = await ApiService.batchDeleteImages('output', ['output1.jpg']);
+    
+    // Assert the response
+    expect(response.data).toEqual(mockResponse);
+  });
+  
   it('should cancel script execution', async () => {
     const processId = 'test-process-id';
     const mockResponse = {